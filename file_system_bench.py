@@ -0,0 +1,673 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import string
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from file_system_components import FAT_END, FAT_FREE, SPACE_FREE, SPACE_OCCUPY, FileSystem, count_refs
+
+
+# 日志重放: 执行op_num次操作后不做检查点直接"崩溃" 统计重新打开时重放日志的耗时
+def bench_journal_replay(op_num=2000, data_size=64):
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, "image")
+        fs = FileSystem(path, block_size=64, block_num=2 ** 14, journal=True, demo=False)
+        fs.journal.checkpoint_interval = op_num * 4
+        data = "x" * data_size
+        start = time.perf_counter()
+        for i in range(op_num // 2):
+            fcb = fs.create_file("f%d" % i, fs.file_tree.root)
+            fs.write_and_close_file(data, fcb)
+        log_time = time.perf_counter() - start
+        fs.sync()
+        journal_size = os.path.getsize(path + ".journal")
+
+        start = time.perf_counter()
+        recovered = FileSystem(path, journal=True, demo=False)
+        replay_time = time.perf_counter() - start
+        assert len(recovered.file_tree.root.leaf_node_children) == op_num // 2
+        recovered.checkpoint()
+
+        start = time.perf_counter()
+        FileSystem(path, journal=True, demo=False)
+        load_time = time.perf_counter() - start
+        return {
+            "ops": op_num,
+            "journal_bytes": journal_size,
+            "log_ops_per_sec": op_num / log_time,
+            "replay_sec": replay_time,
+            "replay_ops_per_sec": op_num / replay_time,
+            "load_after_checkpoint_sec": load_time,
+        }
+    finally:
+        shutil.rmtree(workdir)
+
+
+# 检查块分配是否一致: 没有块属于两条链 链上的块均已占用 其余块均空闲
+def check_blocks(fs: FileSystem):
+    owner = {}
+    stack = [fs.file_tree.root]
+    while stack:
+        node = stack.pop()
+        stack.extend(node.tree_node_children)
+        for fcb in node.leaf_node_children:
+            cursor = fcb.start_address
+            count = 0
+            shared = False
+            while cursor is not None and cursor != FAT_END:
+                # 去重后共用的链尾必须从refs中的块开始
+                shared = shared or cursor in fs.refs
+                assert cursor not in owner or shared, \
+                    "block %d shared by %s and %s" % (cursor, owner[cursor], fs.path_of(fcb))
+                assert fs.free_space.bitmap[cursor] == SPACE_OCCUPY, "block %d not marked occupied" % cursor
+                owner[cursor] = fs.path_of(fcb)
+                cursor = fs.fat.table[cursor]
+                count += 1
+            assert count == fs.block_count(fcb), fs.path_of(fcb)
+    deferred = set(fs.allocator.deferred)
+    leaked = fs.free_space.bitmap.count(SPACE_OCCUPY) - len(owner) - len(deferred)
+    assert leaked == 0, "%d blocks leaked" % leaked
+    assert fs.allocator.free_num == fs.free_space.bitmap.count(SPACE_FREE)
+    assert fs.refs == count_refs(fs.fat.table), "reference counts out of date"
+    return len(owner)
+
+
+# 并发压力测试: 每个工作线程在自己的文件夹中反复创建/改写/追加/删除文件
+# 所有线程结束后检查没有块丢失或被重复分配 并统计不同线程数下的吞吐量
+def bench_concurrency(worker_nums=(1, 2, 4, 8), op_num=4000, data_size=256):
+    results = []
+    for workers in worker_nums:
+        fs = FileSystem(block_size=64, block_num=2 ** 16, demo=False)
+        root = fs.file_tree.root
+        dirs = [fs.create_dir(root, "w%d" % i, datetime.now()) for i in range(workers)]
+
+        def work(i):
+            node = dirs[i]
+            for j in range(op_num // workers):
+                name = "f%d" % (j % 16)
+                fcb = node.file_index.get(name) or fs.create_file(name, node)
+                if j % 4 == 0:
+                    fs.write_and_close_file(os.urandom(data_size * (1 + j % 3)), fcb)
+                elif j % 4 == 1:
+                    fs.append_file(fcb, b"y" * (data_size // 4))
+                elif j % 4 == 2:
+                    fs.pread(fcb, 0, data_size)
+                else:
+                    fs.delete_file(fcb)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(work, range(workers)))
+        elapsed = time.perf_counter() - start
+        check_blocks(fs)
+
+        # 批量接口: 并行改写全部文件
+        fcbs = [fcb for node in dirs for fcb in node.leaf_node_children]
+        start = time.perf_counter()
+        fs.run_batch([("write_and_close_file", os.urandom(data_size), fcb) for fcb in fcbs], workers)
+        batch_elapsed = time.perf_counter() - start
+        results.append({
+            "workers": workers,
+            "ops_per_sec": op_num / elapsed,
+            "batch_ops_per_sec": len(fcbs) / batch_elapsed if fcbs else 0.0,
+            "blocks_in_use": check_blocks(fs),
+        })
+    return results
+
+
+# 一致性检查: 在block_num块的卷上写满约fill比例的文件后计时一次完整检查
+def bench_fsck(block_num=2 ** 20, fill=0.5, file_blocks=256):
+    from file_system_fsck import fsck
+    fs = FileSystem(block_size=16, block_num=block_num, demo=False)
+    data = b"x" * (16 * file_blocks)
+    for i in range(int(block_num * fill) // file_blocks):
+        fs.write_and_close_file(data, fs.create_file("f%d" % i, fs.file_tree.root))
+    start = time.perf_counter()
+    report = fsck(fs)
+    return {"blocks": block_num, "files": report["files"], "errors": report["errors"],
+            "check_sec": time.perf_counter() - start}
+
+
+# 旧版的结点布局: 普通对象 每个结点带两个datetime FAT为逐项append的list
+class _DictFCB:
+    def __init__(self, file_name, create_time, length, start_address=None):
+        self.file_name = file_name
+        self.create_time = create_time
+        self.modify_time = create_time
+        self.length = length
+        self.start_address = start_address
+        self.parent = None
+
+
+class _DictNode:
+    def __init__(self, name, create_time):
+        self.dir_index = {}
+        self.file_index = {}
+        self.parent = None
+        self.dir_name = name
+        self.create_time = create_time
+        self.modify_time = create_time
+
+
+def _build_tree(node_class, fcb_class, dir_num, file_num):
+    root = node_class("/", datetime.now())
+    dirs = [root]
+    for i in range(dir_num):
+        node = node_class("d%d" % i, datetime.now())
+        node.parent = dirs[i // 8]
+        node.parent.dir_index[node.dir_name] = node
+        dirs.append(node)
+    for i in range(file_num):
+        fcb = fcb_class("f%d" % i, datetime.now(), 0)
+        fcb.parent = dirs[i % len(dirs)]
+        fcb.parent.file_index[fcb.file_name] = fcb
+    return root
+
+
+def _list_fat(block_num):
+    table = []
+    for i in range(block_num):
+        table.append(FAT_FREE)
+    # 装入不同的整数 避免小整数缓存掩盖装箱开销
+    for i in range(block_num - 1):
+        table[i] = i + 1
+    return table
+
+
+# 内存占用: 分别用旧布局与当前布局构建同样规模的目录树和FAT 比较tracemalloc统计的峰值与pickle大小
+def bench_memory(dir_num=10000, file_num=200000, block_num=2 ** 20):
+    import pickle
+    import tracemalloc
+    from file_system_components import FAT, FCB, FileTreeNode
+
+    def measure(build):
+        tracemalloc.start()
+        obj = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return obj, size
+
+    def new_fat():
+        fat = FAT(block_num)
+        for i in range(block_num - 1):
+            fat.table[i] = i + 1
+        return fat
+
+    old_tree, old_tree_size = measure(lambda: _build_tree(_DictNode, _DictFCB, dir_num, file_num))
+    new_tree, new_tree_size = measure(lambda: _build_tree(FileTreeNode, FCB, dir_num, file_num))
+    old_fat, old_fat_size = measure(lambda: _list_fat(block_num))
+    new_fat, new_fat_size = measure(new_fat)
+    return {
+        "files": file_num,
+        "old_tree_bytes": old_tree_size,
+        "new_tree_bytes": new_tree_size,
+        "old_bytes_per_file": old_tree_size / file_num,
+        "new_bytes_per_file": new_tree_size / file_num,
+        "old_fat_bytes": old_fat_size,
+        "new_fat_bytes": new_fat_size,
+        "old_fat_pickle_bytes": len(pickle.dumps(old_fat, pickle.HIGHEST_PROTOCOL)),
+        "new_fat_pickle_bytes": len(pickle.dumps(new_fat, pickle.HIGHEST_PROTOCOL)),
+    }
+
+
+
+# 去重: 一半文件内容完全相同 另一半以不同的块开头 后接相同的样板内容(按块对齐)
+# 分别在开启/关闭去重时写入 比较占用的块数与写入吞吐量
+def bench_dedup(file_num=2000, block_size=64, body_blocks=16):
+    boilerplate = bytes(range(256)) * (block_size * body_blocks // 256 + 1)
+    boilerplate = boilerplate[:block_size * body_blocks]
+    results = []
+    for dedup in (False, True):
+        fs = FileSystem(block_size=block_size, block_num=file_num * (body_blocks + 1) * 2, dedup=dedup, demo=False)
+        fcbs = [fs.create_file("f%d" % i, fs.file_tree.root) for i in range(file_num)]
+        contents = [(b"" if i % 2 else ("%d" % i).encode().ljust(block_size, b"#")) + boilerplate
+                    for i in range(file_num)]
+        start = time.perf_counter()
+        for fcb, data in zip(fcbs, contents):
+            fs.write_and_close_file(data, fcb)
+        write_time = time.perf_counter() - start
+        # 改写一部分文件的中间 触发写时复制
+        start = time.perf_counter()
+        for fcb in fcbs[::10]:
+            fs.pwrite(fcb, block_size * 2, b"!" * block_size)
+        cow_time = time.perf_counter() - start
+        check_blocks(fs)
+        for fcb in fcbs[::10]:
+            assert fs.open_and_read_bytes(fcb)[block_size * 2:block_size * 3] == b"!" * block_size
+        stats = fs.dedup_stats()
+        stats.update({
+            "dedup": dedup,
+            "write_mb_per_sec": sum(map(len, contents)) / write_time / 2 ** 20,
+            "cow_writes_per_sec": len(fcbs[::10]) / cow_time,
+        })
+        for fcb in fcbs:
+            fs.delete_file(fcb)
+        check_blocks(fs)
+        assert fs.fat.table.count(FAT_FREE) == fs.block_num and not fs.refs
+        results.append(stats)
+    return results
+
+
+
+# 压缩: 写入日志式文本 比较占用的块数 open_and_read_file/write_and_close_file的吞吐量与随机读取的速度
+def bench_compression(file_num=50, file_size=64 * 1024, read_num=2000, block_size=64):
+    import random
+    rng = random.Random(0)
+    texts = []
+    for i in range(file_num):
+        lines = []
+        while sum(map(len, lines)) < file_size:
+            lines.append("2024-01-%02d 12:%02d:%02d INFO worker-%d request %d finished in %dms\n"
+                         % (i % 28 + 1, rng.randrange(60), rng.randrange(60), rng.randrange(8),
+                            rng.randrange(10 ** 6), rng.randrange(1000)))
+        texts.append("".join(lines)[:file_size])
+    results = []
+    for compression in (None, "zlib", "lzma"):
+        fs = FileSystem(block_size=block_size, block_num=file_num * file_size // block_size * 2, demo=False)
+        fcbs = []
+        for i in range(file_num):
+            fcb = fs.create_file("f%d" % i, fs.file_tree.root)
+            fs.set_compression(fcb, compression)
+            fcbs.append(fcb)
+        start = time.perf_counter()
+        for fcb, text in zip(fcbs, texts):
+            fs.write_and_close_file(text, fcb)
+        write_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for fcb, text in zip(fcbs, texts):
+            assert fs.open_and_read_file(fcb) == text
+        read_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(read_num):
+            i = rng.randrange(file_num)
+            offset = rng.randrange(file_size - 100)
+            assert fs.pread(fcbs[i], offset, 100) == texts[i][offset:offset + 100].encode()
+        pread_time = time.perf_counter() - start
+        check_blocks(fs)
+        total = file_num * file_size
+        results.append({
+            "compression": compression,
+            "blocks": fs.block_num - fs.allocator.free_num,
+            "ratio": sum(fcb.length for fcb in fcbs) / max(sum(fcb.stored_length for fcb in fcbs), 1),
+            "write_mb_per_sec": total / write_time / 2 ** 20,
+            "read_mb_per_sec": total / read_time / 2 ** 20,
+            "random_reads_per_sec": read_num / pread_time,
+        })
+    return results
+
+
+
+# 元数据查询: 比较递归遍历与索引的按名查找/按时间查找/du 以及建立索引后每次写入的额外开销
+def bench_metadata(dir_num=2000, file_num=50000, query_num=200):
+    import random
+    rng = random.Random(0)
+    fs = FileSystem(block_size=64, block_num=2 ** 16, demo=False)
+    dirs = [fs.file_tree.root]
+    for i in range(dir_num):
+        dirs.append(fs.create_dir(rng.choice(dirs), "d%d" % i, datetime.now()))
+    fcbs = [fs.create_file("f%d" % i, rng.choice(dirs)) for i in range(file_num)]
+    for fcb in fcbs[:query_num]:
+        fs.write_and_close_file("w", fcb)
+
+    def walk(node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            stack.extend(node.tree_node_children)
+            yield from node.leaf_node_children
+
+    names = ["f%d" % rng.randrange(file_num) for _ in range(query_num)]
+    cutoff = fcbs[-100].modify_time
+    start = time.perf_counter()
+    for name in names:
+        [fcb for fcb in walk(fs.file_tree.root) if fcb.file_name == name]
+    [fcb for fcb in walk(fs.file_tree.root) if fcb.modify_time > cutoff]
+    sum(fcb.length for fcb in walk(dirs[1]))
+    walk_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fs.metadata_index()
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for name in names:
+        assert fs.find_files(name)
+    assert len(fs.find_files(modified_after=cutoff)) == 99 + query_num
+    fs.dir_stats(dirs[1])
+    index_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for fcb in fcbs[:query_num]:
+        fs.write_and_close_file("x", fcb)
+    write_time = time.perf_counter() - start
+    fs.metadata.close()
+    fs.metadata = None
+    start = time.perf_counter()
+    for fcb in fcbs[:query_num]:
+        fs.write_and_close_file("y", fcb)
+    plain_write_time = time.perf_counter() - start
+    return {
+        "files": file_num,
+        "walk_queries_sec": walk_time,
+        "index_build_sec": build_time,
+        "index_queries_sec": index_time,
+        "write_overhead": write_time / plain_write_time,
+    }
+
+
+
+# 批量导入: 比较逐个create_dir/create_file/write_and_close_file与bulk_import 以及开启日志时逐个操作与apply_batch
+def bench_bulk_import(dir_num=100, file_num=5000, data_size=200, batch_num=500):
+    entries = [("d%d" % (i % dir_num), None, None) for i in range(dir_num)]
+    entries += [("d%d/f%d" % (i % dir_num, i), os.urandom(data_size), None) for i in range(file_num)]
+    block_num = file_num * data_size // 16 * 2
+
+    fs = FileSystem(block_size=16, block_num=block_num, demo=False)
+    start = time.perf_counter()
+    root = fs.file_tree.root
+    for path, data, _ in entries:
+        if data is None:
+            fs.create_dir(root, path, datetime.now())
+        else:
+            parent, name = path.split("/")
+            fs.write_and_close_file(data, fs.create_file(name, root.dir_index[parent]))
+    single_time = time.perf_counter() - start
+    check_blocks(fs)
+
+    fs = FileSystem(block_size=16, block_num=block_num, demo=False)
+    start = time.perf_counter()
+    assert fs.bulk_import(fs.file_tree.root, entries) == file_num
+    bulk_time = time.perf_counter() - start
+    check_blocks(fs)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, "image")
+        fs = FileSystem(path, block_size=16, block_num=block_num, journal=True, demo=False)
+        start = time.perf_counter()
+        for i in range(batch_num):
+            fs.write_and_close_file("x" * 32, fs.create_file("s%d" % i, fs.file_tree.root))
+        fs.sync()
+        journal_single_time = time.perf_counter() - start
+        ops = []
+        for i in range(batch_num):
+            ops += [("create", "/", "b%d" % i), ("write", "/b%d" % i, "x" * 32)]
+        start = time.perf_counter()
+        fs.apply_batch(ops)
+        journal_batch_time = time.perf_counter() - start
+        fs.close()
+    finally:
+        shutil.rmtree(workdir)
+    return {
+        "files": file_num,
+        "single_sec": single_time,
+        "bulk_import_sec": bulk_time,
+        "journaled_single_ops_per_sec": batch_num * 2 / journal_single_time,
+        "journaled_batch_ops_per_sec": batch_num * 2 / journal_batch_time,
+    }
+
+
+
+# 快照: 不同文件数下create_snapshot的耗时(应与文件数无关) 快照后改写一部分文件的额外开销与占用的块
+# 以及diff_snapshots/rollback与保存整个镜像作为备份的耗时对比
+def bench_snapshot(file_nums=(1000, 10000, 50000), modify_fraction=0.01, data_size=256, block_size=64):
+    results = []
+    for file_num in file_nums:
+        fs = FileSystem(block_size=block_size, block_num=file_num * (data_size // block_size + 1) * 3, demo=False)
+        root = fs.file_tree.root
+        dirs = [fs.create_dir(root, "d%d" % i, datetime.now()) for i in range(file_num // 100 + 1)]
+        fcbs = [fs.create_file("f%d" % i, dirs[i % len(dirs)]) for i in range(file_num)]
+        for fcb in fcbs:
+            fs.write_and_close_file(os.urandom(data_size), fcb)
+        used = fs.block_num - fs.allocator.free_num
+        modified = fcbs[::int(1 / modify_fraction)]
+
+        start = time.perf_counter()
+        for fcb in modified:
+            fs.pwrite(fcb, block_size, b"!" * block_size)
+        plain_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fs.create_snapshot("s")
+        create_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for fcb in modified:
+            fs.pwrite(fcb, block_size, b"?" * block_size)
+        snapshot_time = time.perf_counter() - start
+        for fcb in modified[::2]:
+            fs.delete_file(fcb)
+        stats = fs.list_snapshots()[0]
+
+        start = time.perf_counter()
+        diff = fs.diff_snapshots("s")
+        diff_time = time.perf_counter() - start
+        assert len(diff) == len(modified)
+        start = time.perf_counter()
+        fs.rollback("s")
+        rollback_time = time.perf_counter() - start
+        assert all(fcb.parent is not None for fcb in modified)
+
+        workdir = tempfile.mkdtemp()
+        try:
+            start = time.perf_counter()
+            fs.save(os.path.join(workdir, "backup"))
+            save_time = time.perf_counter() - start
+        finally:
+            shutil.rmtree(workdir)
+        fs.delete_snapshot("s")
+        check_blocks(fs)
+        results.append({
+            "files": file_num,
+            "create_us": create_time * 1e6,
+            "write_overhead": snapshot_time / plain_time,
+            "modified_files": len(modified),
+            "nodes_saved": stats["nodes"],
+            # 快照独占的块 占卷中已用块的比例
+            "snapshot_blocks": stats["copied_blocks"] + stats["held_blocks"],
+            "space_overhead": (stats["copied_blocks"] + stats["held_blocks"]) / used,
+            "diff_sec": diff_time,
+            "rollback_sec": rollback_time,
+            "full_save_sec": save_time,
+        })
+    return results
+
+
+# ---- 可复现的基准测试套件 ----
+# 以固定种子生成目录树与文件长度 统计各热点操作的延迟/读写块数 结果可导出为JSON并与其他版本比较
+# 只依赖FileSystem本身 不需要PyQt
+
+LAYOUTS = ("deep", "wide", "fragmented")
+ALPHABET = string.ascii_letters + string.digits + " \n"
+
+
+# 文件长度近似对数正态分布 均值约为mean_size 多数文件较小 少数较大
+def file_sizes(rng, count, mean_size):
+    mu = math.log(mean_size) - 0.5
+    return [max(1, min(int(rng.lognormvariate(mu, 1.0)), mean_size * 20)) for _ in range(count)]
+
+
+def random_text(rng, size):
+    return "".join(rng.choices(ALPHABET, k=size))
+
+
+# 按布局生成目录树并写入文件 返回(顶层文件夹, 文件)
+#   deep: 一条深度为depth的文件夹链 文件均匀分布在各层
+#   wide: 根目录下fanout个文件夹 文件轮流放入
+#   fragmented: 先写满单块的占位文件再隔一个删一个 之后写入的文件散落在空洞中
+def build_layout(fs: FileSystem, layout, sizes, rng, depth=100, fanout=None):
+    root = fs.file_tree.root
+    now = datetime.now()
+    if layout == "deep":
+        dirs = [fs.create_dir(root, "deep0", now)]
+        for i in range(1, depth):
+            dirs.append(fs.create_dir(dirs[-1], "deep%d" % i, now))
+        parents = [dirs[i * depth // len(sizes)] for i in range(len(sizes))]
+        top = dirs[:1]
+    elif layout == "wide":
+        fanout = fanout or max(1, len(sizes) // 20)
+        top = [fs.create_dir(root, "wide%d" % i, now) for i in range(fanout)]
+        parents = [top[i % fanout] for i in range(len(sizes))]
+    elif layout == "fragmented":
+        top = [fs.create_dir(root, "frag%d" % i, now) for i in range(10)]
+        parents = [top[i % 10] for i in range(len(sizes))]
+        holder = fs.create_dir(root, "holes", now)
+        fillers = []
+        for i in range(sum(sizes) // fs.block_size + 1):
+            fcb = fs.create_file("h%d" % i, holder)
+            fs.write_and_close_file("h" * fs.block_size, fcb)
+            fillers.append(fcb)
+        for fcb in fillers[::2]:
+            fs.delete_file(fcb)
+        # 游标回到开头 让之后的分配落入空洞
+        fs.allocator.cursor = 0
+        top.append(holder)
+    else:
+        raise ValueError("unknown layout: %s" % layout)
+    fcbs = []
+    for i, (parent, size) in enumerate(zip(parents, sizes)):
+        fcb = fs.create_file("f%d" % i, parent)
+        fs.write_and_close_file(random_text(rng, size), fcb)
+        fcbs.append(fcb)
+    return top, fcbs
+
+
+def run_suite(layouts=LAYOUTS, file_num=2000, mean_size=256, block_size=16, seed=0, profile=False,
+              trace_memory=False, label=None):
+    from file_system_defrag import fragmentation
+    results = {
+        "meta": {
+            "label": label,
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": seed,
+            "file_num": file_num,
+            "mean_size": mean_size,
+            "block_size": block_size,
+        },
+        "layouts": {},
+    }
+    for layout in layouts:
+        rng = random.Random(seed)
+        sizes = file_sizes(rng, file_num, mean_size)
+        fs = FileSystem(block_size=block_size, block_num=sum(sizes) * 4 // block_size + 1024, demo=False)
+        top, fcbs = build_layout(fs, layout, sizes, rng)
+        layout_stats = fragmentation(fs)
+        new_sizes = file_sizes(rng, file_num, mean_size)
+        texts = [random_text(rng, size) for size in new_sizes]
+
+        stats = fs.enable_stats(profile, trace_memory)
+        for _ in range(file_num):
+            fs.find_free_index()
+        for fcb in fcbs:
+            fs.open_and_read_file(fcb)
+        for fcb, text in zip(fcbs, texts):
+            fs.write_and_close_file(text, fcb)
+        workdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(workdir, "image")
+            fs.save(path)
+            # 少量修改后的增量保存
+            for fcb in fcbs[::50]:
+                fs.write_and_close_file("changed", fcb)
+            fs.save(path)
+            fs.close()
+        finally:
+            shutil.rmtree(workdir)
+        for node in top:
+            fs.delete_dir(node)
+        fs.disable_stats()
+
+        result = stats.to_dict()
+        result["layout"] = {
+            "files": layout_stats["files"],
+            "blocks": layout_stats["blocks"],
+            "fragmentation": layout_stats["fragmentation"],
+        }
+        results["layouts"][layout] = result
+    return results
+
+
+# 比较两次run_suite的结果 返回[(布局, 操作, 旧平均微秒, 新平均微秒, 新/旧)]
+def compare_results(old, new):
+    rows = []
+    for layout, result in new["layouts"].items():
+        old_ops = old["layouts"].get(layout, {}).get("ops", {})
+        for name, op in result["ops"].items():
+            if name in old_ops:
+                before = old_ops[name]["mean_us"]
+                rows.append((layout, name, before, op["mean_us"], op["mean_us"] / before if before else float("inf")))
+    return rows
+
+
+def print_suite(results):
+    for layout, result in results["layouts"].items():
+        print("[%s] files=%d blocks=%d fragmentation=%.3f" % (
+            layout, result["layout"]["files"], result["layout"]["blocks"], result["layout"]["fragmentation"]))
+        for name, op in result["ops"].items():
+            print("  %-22s n=%-6d mean=%9.1fus p50<=%-7d p99<=%-7d max=%9.1fus read=%-8d written=%d" % (
+                name, op["count"], op["mean_us"], op["p50_us"], op["p99_us"], op["max_us"],
+                op["blocks_read"], op["blocks_written"]))
+        for row in result.get("profile", [])[:10]:
+            print("  %8.3fs %s" % (row["tottime"], row["function"]))
+        if "memory" in result:
+            print("  memory peak %d bytes" % result["memory"]["peak_bytes"])
+
+
+def run_all(op_num):
+    print(bench_journal_replay(op_num))
+    for result in bench_concurrency():
+        print(result)
+    print(bench_fsck())
+    print(bench_memory())
+    for result in bench_dedup():
+        print(result)
+    for result in bench_compression():
+        print(result)
+    print(bench_metadata())
+    print(bench_bulk_import())
+    for result in bench_snapshot():
+        print(result)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="file system benchmarks")
+    parser.add_argument("op_num", nargs="?", type=int, default=2000, help="operations for the legacy benchmarks")
+    parser.add_argument("--suite", action="store_true", help="run the reproducible benchmark suite")
+    parser.add_argument("--layouts", default=",".join(LAYOUTS))
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--mean-size", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label")
+    parser.add_argument("--profile", action="store_true", help="record a cProfile profile")
+    parser.add_argument("--trace-memory", action="store_true", help="track allocations with tracemalloc")
+    parser.add_argument("--json", help="write the suite results to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two suite result files")
+    args = parser.parse_args(argv)
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            new = json.load(f)
+        for layout, name, before, after, ratio in compare_results(old, new):
+            print("%-10s %-22s %10.1fus -> %10.1fus  x%.2f" % (layout, name, before, after, ratio))
+    elif args.suite:
+        suite_results = run_suite(args.layouts.split(","), args.files, args.mean_size, seed=args.seed,
+                                  profile=args.profile, trace_memory=args.trace_memory, label=args.label)
+        print_suite(suite_results)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(suite_results, f, ensure_ascii=False, indent=2)
+    else:
+        run_all(args.op_num)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import io
+import os
+import tarfile
+from datetime import datetime
+
+from file_system_components import FCB, FileSystem, FileTreeNode
+
+# 批量导入/导出
+# 导入时先收集全部条目 再交给FileSystem.bulk_import一次完成: 名称检查一次 新文件的块一次分配 只写一条日志
+# 修改时间随条目一起导入导出 文件夹只保存名称与修改时间
+# 导入时成员名中的..会被拒绝 导出时名称在宿主机上不安全(含路径分隔符或为..)则拒绝 以免写到目标目录之外
+
+
+def _target(fs: FileSystem, node):
+    return fs.file_tree.root if node is None else node
+
+
+# 导入宿主机上的目录树 host_dir本身不导入 其内容放在node下 返回导入的文件数
+def import_tree(fs: FileSystem, host_dir, node: FileTreeNode = None):
+    entries = []
+    for current, dirs, files in os.walk(host_dir):
+        rel = os.path.relpath(current, host_dir).replace(os.sep, "/")
+        prefix = "" if rel == "." else rel + "/"
+        for name in sorted(dirs):
+            path = os.path.join(current, name)
+            entries.append((prefix + name, None, datetime.fromtimestamp(os.stat(path).st_mtime)))
+        for name in sorted(files):
+            path = os.path.join(current, name)
+            if not os.path.isfile(path):
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            entries.append((prefix + name, data, datetime.fromtimestamp(os.stat(path).st_mtime)))
+    return fs.bulk_import(_target(fs, node), entries)
+
+
+# 导入tar包 只导入普通文件与文件夹 返回导入的文件数
+def import_tar(fs: FileSystem, tar_path, node: FileTreeNode = None):
+    entries = []
+    with tarfile.open(tar_path) as tar:
+        for member in tar:
+            mtime = datetime.fromtimestamp(member.mtime)
+            if member.isdir():
+                entries.append((member.name, None, mtime))
+            elif member.isfile():
+                entries.append((member.name, tar.extractfile(member).read(), mtime))
+    return fs.bulk_import(_target(fs, node), entries)
+
+
+def _check_name(name):
+    if name in ("", ".", "..") or "/" in name or os.sep in name or (os.altsep and os.altsep in name):
+        raise ValueError("cannot export name: %r" % name)
+
+
+# 按先序遍历子树 返回(相对路径, 结点) 文件夹在其内容之前
+def _walk(node: FileTreeNode):
+    stack = [("", node)]
+    while stack:
+        prefix, current = stack.pop()
+        for child in reversed(current.tree_node_children):
+            _check_name(child.dir_name)
+            stack.append((prefix + child.dir_name + "/", child))
+        for fcb in current.leaf_node_children:
+            _check_name(fcb.file_name)
+            yield prefix + fcb.file_name, fcb
+        if prefix:
+            yield prefix.rstrip("/"), current
+
+
+# 导出子树到宿主机目录 返回导出的文件数 导出期间其他线程不能修改文件系统
+# 先检查全部名称 有不能导出的名称时不写任何文件
+def export_tree(fs: FileSystem, host_dir, node: FileTreeNode = None):
+    count = 0
+    dir_times = []
+    with fs.volume_lock.read():
+        items = list(_walk(_target(fs, node)))
+        os.makedirs(host_dir, exist_ok=True)
+        for rel, item in items:
+            path = os.path.join(host_dir, *rel.split("/"))
+            if isinstance(item, FCB):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(fs.open_and_read_bytes(item))
+                os.utime(path, (item.modify_time.timestamp(),) * 2)
+                count += 1
+            else:
+                os.makedirs(path, exist_ok=True)
+                dir_times.append((path, item.modify_time.timestamp()))
+    # 文件夹的时间在写完其中的文件后再设置
+    for path, mtime in dir_times:
+        os.utime(path, (mtime, mtime))
+    return count
+
+
+# 导出子树为tar包 返回导出的文件数 有不能导出的名称时不创建tar包
+def export_tar(fs: FileSystem, tar_path, node: FileTreeNode = None):
+    count = 0
+    with fs.volume_lock.read():
+        items = list(_walk(_target(fs, node)))
+        with tarfile.open(tar_path, "w") as tar:
+            for rel, item in items:
+                info = tarfile.TarInfo(rel)
+                info.mtime = item.modify_time.timestamp()
+                if isinstance(item, FCB):
+                    data = bytes(fs.open_and_read_bytes(item))
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+                    count += 1
+                else:
+                    info.type = tarfile.DIRTYPE
+                    info.mode = 0o755
+                    tar.addfile(info)
+    return count
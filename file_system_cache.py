@@ -0,0 +1,176 @@
+import threading
+from collections import OrderedDict
+
+from file_system_components import FAT_END, FAT_FREE
+
+CACHE_BLOCKS = 256  # 默认缓存块数
+READ_AHEAD = 8  # 未命中时沿FAT链预读的块数
+
+
+# 淘汰策略 只管理块号的顺序 admit返回需要换出的块号
+class LRUPolicy:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.order = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.order
+
+    def hit(self, key):
+        self.order.move_to_end(key)
+
+    def admit(self, key):
+        self.order[key] = None
+        victims = []
+        while len(self.order) > self.capacity:
+            victims.append(self.order.popitem(last=False)[0])
+        return victims
+
+
+# ARC: T1/T2为最近访问一次/多次的常驻块 B1/B2为对应的幽灵列表
+# 幽灵命中时调整T1的目标大小p 在近期性与频率之间自适应
+class ARCPolicy:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.p = 0
+        self.t1, self.t2 = OrderedDict(), OrderedDict()
+        self.b1, self.b2 = OrderedDict(), OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.t1 or key in self.t2
+
+    def hit(self, key):
+        if key in self.t1:
+            del self.t1[key]
+        else:
+            del self.t2[key]
+        self.t2[key] = None
+
+    def __replace(self, key, victims):
+        if self.t1 and (len(self.t1) > self.p or (key in self.b2 and len(self.t1) == self.p)):
+            victim = self.t1.popitem(last=False)[0]
+            self.b1[victim] = None
+        else:
+            victim = self.t2.popitem(last=False)[0]
+            self.b2[victim] = None
+        victims.append(victim)
+
+    def admit(self, key):
+        c = self.capacity
+        victims = []
+        if key in self.b1:
+            self.p = min(c, self.p + max(len(self.b2) // len(self.b1), 1))
+            self.__replace(key, victims)
+            del self.b1[key]
+            self.t2[key] = None
+        elif key in self.b2:
+            self.p = max(0, self.p - max(len(self.b1) // len(self.b2), 1))
+            self.__replace(key, victims)
+            del self.b2[key]
+            self.t2[key] = None
+        else:
+            if len(self.t1) + len(self.b1) == c:
+                if len(self.t1) < c:
+                    self.b1.popitem(last=False)
+                    self.__replace(key, victims)
+                else:
+                    victims.append(self.t1.popitem(last=False)[0])
+            else:
+                total = len(self.t1) + len(self.t2) + len(self.b1) + len(self.b2)
+                if total >= c:
+                    if total == 2 * c:
+                        self.b2.popitem(last=False)
+                    self.__replace(key, victims)
+            self.t1[key] = None
+        return victims
+
+
+POLICIES = {"lru": LRUPolicy, "arc": ARCPolicy}
+
+
+# 磁盘块缓存 位于FileSystem与Disk之间
+# 写入只修改缓存并标记为脏 换出或flush时才写回磁盘(write-back)
+class BlockCache:
+    def __init__(self, disk, fat, capacity=CACHE_BLOCKS, policy="lru", read_ahead=READ_AHEAD):
+        self.disk = disk
+        self.fat = fat
+        self.policy = POLICIES[policy](capacity)
+        self.read_ahead = read_ahead
+        self.blocks = {}  # 块号 -> 块内容
+        self.dirty = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writebacks = 0
+        self.prefetches = 0
+        self.lock = threading.RLock()
+
+    # 将块放入缓存 data为None时从磁盘读取
+    def __load(self, index, data=None):
+        for victim in self.policy.admit(index):
+            victim_data = self.blocks.pop(victim)
+            if victim in self.dirty:
+                self.dirty.discard(victim)
+                self.disk.write_block(victim, victim_data)
+                self.writebacks += 1
+            self.evictions += 1
+        if data is None:
+            data = self.disk.read_block(index)
+        self.blocks[index] = data
+        return data
+
+    # 读取一块 未命中时顺着FAT链预读后续的块
+    def read_block(self, index):
+        with self.lock:
+            if index in self.policy:
+                self.hits += 1
+                self.policy.hit(index)
+                return self.blocks[index]
+            self.misses += 1
+            data = self.__load(index)
+            cursor = self.fat.table[index]
+            for _ in range(self.read_ahead):
+                if cursor == FAT_END or cursor == FAT_FREE:
+                    break
+                if cursor not in self.policy:
+                    self.__load(cursor)
+                    self.prefetches += 1
+                cursor = self.fat.table[cursor]
+            return data
+
+    # 从块内offset处写入data
+    def write_block(self, index, data, offset=0):
+        with self.lock:
+            block_size = self.disk.block_size
+            data = bytes(data)
+            if len(data) < block_size:
+                # 不足一块时保留原有内容的其余部分
+                old = self.read_block(index)
+                data = old[:offset] + data + old[offset + len(data):]
+            if index in self.policy:
+                self.policy.hit(index)
+                self.blocks[index] = data
+            else:
+                self.__load(index, data)
+            self.dirty.add(index)
+
+    # 将全部脏块写回磁盘
+    def flush(self):
+        with self.lock:
+            for index in sorted(self.dirty):
+                self.disk.write_block(index, self.blocks[index])
+                self.writebacks += 1
+            self.dirty.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "writebacks": self.writebacks,
+            "prefetches": self.prefetches,
+            "resident": len(self.blocks),
+            "dirty": len(self.dirty),
+        }
@@ -0,0 +1,328 @@
+import argparse
+import json
+import os
+import socket
+import sys
+
+# 无界面的命令行入口 不依赖PyQt
+#   python file_system_cli.py [--image 镜像] [--socket 套接字] 命令 参数...
+# 未指定--socket或守护进程未运行时 直接打开镜像执行一条命令 有修改时保存镜像后退出
+# serve启动守护进程 卷常驻内存 修改写入日志 之后的命令通过本地Unix套接字交给它执行 省去每次载入镜像的开销
+# 文件系统相关模块均在用到时才导入 客户端只需要标准库
+
+SYSTEM_INFO = "file_system_info"  # 与file_system_components.SYSTEM_INFO一致 此处不导入以免载入整个文件系统
+MODIFYING = ("write", "mkdir", "rm", "mv")
+SNAPSHOT_COMMANDS = ("snapshot", "snapshots", "rollback", "diff")  # 快照只在内存中 需要守护进程
+
+
+# 全局选项 写在命令之前
+def build_options():
+    options = argparse.ArgumentParser(add_help=False)
+    options.add_argument("--image", default=SYSTEM_INFO, help="volume image (default: %(default)s)")
+    options.add_argument("--socket", default=os.environ.get("FILE_SYSTEM_SOCKET"),
+                         help="daemon socket, also read from FILE_SYSTEM_SOCKET")
+    return options
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="file_system_cli", description="headless file system shell",
+                                     parents=[build_options()])
+    commands = parser.add_subparsers(dest="command", required=True)
+    ls = commands.add_parser("ls", help="list a folder")
+    ls.add_argument("path", nargs="?", default="/")
+    ls.add_argument("-l", action="store_true", dest="long", help="show size and modify time")
+    cat = commands.add_parser("cat", help="print a file")
+    cat.add_argument("path")
+    write = commands.add_parser("write", help="write a file, created if missing")
+    write.add_argument("path")
+    write.add_argument("text", nargs="?", help="content, read from stdin if omitted")
+    mkdir = commands.add_parser("mkdir", help="create a folder")
+    mkdir.add_argument("path")
+    mkdir.add_argument("-p", action="store_true", dest="parents", help="create missing parents")
+    rm = commands.add_parser("rm", help="delete a file or folder")
+    rm.add_argument("path")
+    rm.add_argument("-r", action="store_true", dest="recursive", help="delete a folder and its content")
+    mv = commands.add_parser("mv", help="rename a file or folder within its folder")
+    mv.add_argument("path")
+    mv.add_argument("new_name")
+    stat = commands.add_parser("stat", help="show file or folder information")
+    stat.add_argument("path")
+    fsck = commands.add_parser("fsck", help="check the volume")
+    fsck.add_argument("--repair", action="store_true")
+    snapshot = commands.add_parser("snapshot", help="create a snapshot of the volume")
+    snapshot.add_argument("name")
+    snapshot.add_argument("-d", action="store_true", dest="delete", help="delete the snapshot instead")
+    commands.add_parser("snapshots", help="list snapshots")
+    rollback = commands.add_parser("rollback", help="roll the volume back to a snapshot")
+    rollback.add_argument("name")
+    diff = commands.add_parser("diff", help="compare a snapshot with a later one or the current volume")
+    diff.add_argument("old")
+    diff.add_argument("new", nargs="?")
+    bench = commands.add_parser("bench", help="run file_system_bench with the remaining arguments")
+    bench.add_argument("args", nargs=argparse.REMAINDER)
+    serve = commands.add_parser("serve", help="keep the volume resident and serve commands on --socket")
+    serve.add_argument("--cache-blocks", type=int, default=0)
+    commands.add_parser("stop", help="save the volume and stop the daemon")
+    return parser
+
+
+# 去掉全局选项后的命令及其参数 由argparse切分 选项的值与命令同名时也不会切错
+def command_argv(argv):
+    options = build_options()
+    options.add_argument("command", nargs=argparse.REMAINDER)
+    return options.parse_args(argv).command
+
+
+# 打开镜像 镜像不存在时为空卷 不创建演示用的目录树
+def open_volume(image=SYSTEM_INFO, **kwargs):
+    from file_system_components import FileSystem
+    kwargs.setdefault("lazy", True)
+    return FileSystem(image, demo=False, **kwargs)
+
+
+# 路径拆分为(父路径, 名称)
+def split_path(path):
+    names = [x for x in path.split("/") if x != ""]
+    if not names:
+        raise ValueError("root has no parent")
+    return "/" + "/".join(names[:-1]), names[-1]
+
+
+def _lookup(fs, path):
+    node = fs.resolve(path)
+    if node is None:
+        raise FileNotFoundError(path)
+    return node
+
+
+def _format_time(time):
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+# 在fs上执行一条已解析的命令 返回输出的bytes 失败时抛出异常
+# 修改均通过apply_batch以路径执行 每条命令只写一条日志
+def execute(fs, args, data=None):
+    from file_system_components import FCB
+    if args.command == "ls":
+        node = _lookup(fs, args.path)
+        if args.long:
+            # 文件夹大小来自元数据索引 首次建立时要取卷写锁 须在取文件夹锁之前 见file_system_lock的加锁顺序
+            fs.metadata_index()
+        if isinstance(node, FCB):
+            items = [node]
+        else:
+            # 只在文件夹锁内收集子结点 统计在释放之后进行
+            with fs.dir_locks[node].read():
+                items = sorted(node.tree_node_children, key=lambda x: x.dir_name) \
+                        + sorted(node.leaf_node_children, key=lambda x: x.file_name)
+        lines = []
+        for item in items:
+            if isinstance(item, FCB):
+                name, size = item.file_name, item.length
+            else:
+                name, size = item.dir_name + "/", fs.dir_stats(item)["bytes"]
+            lines.append("%10d  %s  %s" % (size, _format_time(item.modify_time), name) if args.long else name)
+        return "".join(line + "\n" for line in lines).encode("utf-8")
+    elif args.command == "cat":
+        node = _lookup(fs, args.path)
+        if not isinstance(node, FCB):
+            raise IsADirectoryError(args.path)
+        return bytes(fs.open_and_read_bytes(node))
+    elif args.command == "write":
+        if args.text is not None:
+            data = args.text.encode("utf-8")
+        parent, name = split_path(args.path)
+        node = fs.resolve(args.path)
+        operations = []
+        if node is None:
+            operations.append(("create", parent, name))
+        elif not isinstance(node, FCB):
+            raise IsADirectoryError(args.path)
+        operations.append(("write", args.path, data or b""))
+        fs.apply_batch(operations)
+    elif args.command == "mkdir":
+        operations = []
+        current = "/"
+        names = [x for x in args.path.split("/") if x != ""]
+        for i, name in enumerate(names):
+            path = current.rstrip("/") + "/" + name
+            node = fs.resolve(path)
+            if node is None:
+                if i < len(names) - 1 and not args.parents:
+                    raise FileNotFoundError(path)
+                operations.append(("mkdir", current, name))
+            elif isinstance(node, FCB) or (i == len(names) - 1 and not args.parents):
+                raise FileExistsError(path)
+            current = path
+        if operations:
+            fs.apply_batch(operations)
+    elif args.command == "rm":
+        node = _lookup(fs, args.path)
+        if isinstance(node, FCB):
+            fs.apply_batch([("rm", args.path)])
+        elif node is fs.file_tree.root:
+            raise PermissionError("cannot remove the root folder")
+        elif not args.recursive:
+            raise IsADirectoryError(args.path)
+        else:
+            fs.apply_batch([("rmdir", args.path)])
+    elif args.command == "mv":
+        node = _lookup(fs, args.path)
+        parent, _ = split_path(args.path)
+        new_parent, new_name = split_path(args.new_name) if "/" in args.new_name else (parent, args.new_name)
+        if new_parent.rstrip("/") != parent.rstrip("/"):
+            raise ValueError("only renaming within the same folder is supported")
+        if fs.resolve(parent.rstrip("/") + "/" + new_name) is not None:
+            raise FileExistsError(new_name)
+        fs.apply_batch([("mv" if isinstance(node, FCB) else "mvdir", args.path, new_name)])
+    elif args.command == "stat":
+        node = _lookup(fs, args.path)
+        info = {"path": fs.path_of(node)}
+        if isinstance(node, FCB):
+            info.update(type="file", size=node.length, blocks=fs.block_count(node),
+                        start=node.start_address, compression=node.compression or "none")
+        else:
+            stats = fs.dir_stats(node)
+            latest = stats["modified"] and _format_time(stats["modified"])
+            info.update(type="folder", files=stats["files"], size=stats["bytes"], latest_file=latest)
+        info.update(created=_format_time(node.create_time), modified=_format_time(node.modify_time))
+        return "".join("%s: %s\n" % item for item in info.items()).encode("utf-8")
+    elif args.command == "fsck":
+        from file_system_fsck import fsck
+        report = fsck(fs, repair=args.repair)
+        if args.repair and report["errors"] and fs.journal is not None:
+            # 修复不写日志 直接写检查点
+            fs.checkpoint()
+        return "".join("%s: %s\n" % item for item in report.items()).encode("utf-8")
+    elif args.command == "snapshot":
+        if args.delete:
+            fs.delete_snapshot(args.name)
+        else:
+            fs.create_snapshot(args.name)
+    elif args.command == "snapshots":
+        return "".join("%s  %s  copied %d  held %d\n" % (item["name"], _format_time(item["time"]),
+                                                          item["copied_blocks"], item["held_blocks"])
+                       for item in fs.list_snapshots()).encode("utf-8")
+    elif args.command == "rollback":
+        fs.rollback(args.name)
+    elif args.command == "diff":
+        return "".join(" ".join(entry) + "\n" for entry in fs.diff_snapshots(args.old, args.new)).encode("utf-8")
+    else:
+        raise ValueError("unsupported command: %s" % args.command)
+    return b""
+
+
+# 执行命令 返回(退出码, 输出, 错误信息)
+def run_command(fs, argv, data=None):
+    try:
+        args = build_parser().parse_args(argv)
+    except SystemExit:
+        return 2, b"", "invalid command: %s\n" % " ".join(argv)
+    try:
+        return 0, execute(fs, args, data), ""
+    except (OSError, ValueError, AssertionError) as e:
+        return 1, b"", "%s: %s\n" % (type(e).__name__, e)
+
+
+# ---- 守护进程 ----
+# 协议: 每个连接一条请求一条响应 均为一行JSON
+#   请求 {"argv": [...], "input": 内容或null}   响应 {"status": 退出码, "output": 输出, "error": 错误信息}
+# 内容与输出为bytes 按latin-1映射为字符串传输
+
+def serve(image, socket_path, **kwargs):
+    import socketserver
+    import threading
+
+    fs = open_volume(image, journal=True, **kwargs)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request = json.loads(self.rfile.readline())
+            argv = request["argv"]
+            data = request.get("input")
+            if argv == ["stop"]:
+                status, output, error = 0, b"", ""
+                threading.Thread(target=server.shutdown).start()
+            else:
+                status, output, error = run_command(fs, argv, None if data is None else data.encode("latin-1"))
+            response = {"status": status, "output": output.decode("latin-1"), "error": error}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    # 连上套接字即可任意读写卷 只允许本用户访问 创建时即为0600 不留可被连接的间隙
+    mask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    finally:
+        os.umask(mask)
+    server.daemon_threads = True
+    print("serving %s on %s" % (image, socket_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        fs.save(image)
+        fs.close()
+
+
+# 把一条命令发给守护进程 返回(退出码, 输出, 错误信息)
+def request(socket_path, argv, data=None):
+    message = {"argv": argv, "input": None if data is None else data.decode("latin-1")}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+        with sock.makefile("rb") as f:
+            response = json.loads(f.readline())
+    return response["status"], response["output"].encode("latin-1"), response["error"]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = build_parser()
+    # bench的参数原样交给file_system_bench
+    args, extra = parser.parse_known_args(argv)
+    if args.command == "bench":
+        from file_system_bench import main as bench_main
+        return bench_main(extra + args.args)
+    if extra:
+        parser.error("unrecognized arguments: %s" % " ".join(extra))
+    if args.command == "serve":
+        if not args.socket:
+            parser.error("serve needs --socket")
+        serve(args.image, args.socket, cache_blocks=args.cache_blocks)
+        return 0
+    # 去掉全局选项 守护进程只接收命令本身
+    command = command_argv(argv)
+    data = None
+    if args.command == "write" and args.text is None:
+        data = sys.stdin.buffer.read()
+    if args.socket and os.path.exists(args.socket):
+        status, output, error = request(args.socket, command, data)
+    elif args.command == "stop":
+        parser.error("no daemon is running")
+    elif args.command in SNAPSHOT_COMMANDS:
+        parser.error("snapshots are kept in memory, %s needs a running daemon" % args.command)
+    else:
+        # 文件系统的提示信息不混入命令的输出
+        from contextlib import redirect_stdout
+        with redirect_stdout(sys.stderr):
+            # 守护进程异常退出时留下的日志在此重放
+            fs = open_volume(args.image, journal=os.path.exists(args.image + ".journal"))
+            try:
+                status, output, error = run_command(fs, command, data)
+                if status == 0 and (args.command in MODIFYING or args.command == "fsck" and args.repair):
+                    fs.save(args.image)
+            finally:
+                fs.close()
+    sys.stdout.buffer.write(output)
+    sys.stdout.flush()
+    sys.stderr.write(error)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,24 @@
+import logging
+import lzma
+import mmap
 import pickle
-from datetime import datetime
+import threading
+import zlib
+from array import array
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta
 from bitarray import bitarray
 
+from file_system_lock import LockTable, RWLock
+
+logger = logging.getLogger(__name__)
+
+# 默认磁盘参数 可在创建FileSystem时指定 并随存档保存
+SYSTEM_INFO = "file_system_info"  # 默认镜像文件
+
 BLOCK_NUM = 2 ** 10  # 块数
-BLOCK_SIZE = 4  # 每块的大小
+BLOCK_SIZE = 4  # 每块的字节数
 
 FAT_FREE = -2  # 表示FAT表中此块未被使用
 FAT_END = -1  # 表示为FAT表中链表结尾
@@ -11,51 +26,424 @@ FAT_END = -1  # 表示为FAT表中链表结尾
 SPACE_OCCUPY = 1  # 磁盘被占用
 SPACE_FREE = 0  # 未被占用
 
+GROUP_BLOCKS = 1024  # FAT/bitmap按组记录脏页 保存时只写回被修改的组
+
+# 按文件压缩 内容按FRAME_SIZE字节分帧 每帧单独压缩并从块边界开始存放 随机读取时只解压涉及的帧
+FRAME_SIZE = 4096
+COMPRESSORS = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+
+# 时间统一保存为距EPOCH的微秒数 可精确还原datetime
+def encode_time(time: datetime):
+    return (time - EPOCH) // timedelta(microseconds=1)
 
+
+def decode_time(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+def _stamp(time):
+    return time if isinstance(time, int) else encode_time(time)
+
+
+# FCB与文件夹结点使用__slots__ 不带__dict__
+# 时间以整数微秒保存在*_stamp中 通过create_time/modify_time读写时才与datetime互相转换
 class FCB:
+    __slots__ = ("file_name", "create_stamp", "modify_stamp", "length", "start_address", "parent",
+                 "compression", "frames", "epoch", "__weakref__")
+
     def __init__(self, file_name, create_time, length, start_address=None):
         self.file_name = file_name
-        self.create_time = create_time
-        self.modify_time = create_time
-        self.length = length
+        self.create_stamp = self.modify_stamp = _stamp(create_time)
+        self.length = length  # UTF-8编码后的字节数 压缩文件为解压后的字节数
         self.start_address = start_address
+        self.parent = None  # 所在文件夹
+        self.compression = None  # None或COMPRESSORS中的算法名
+        self.frames = ()  # 压缩文件每帧压缩后的字节数
+        self.epoch = 0  # FAT链被重写或截断时加一 使句柄缓存的链失效 不保存
+
+    # 实际存放在块中的字节数 不含帧尾对齐的填充
+    @property
+    def stored_length(self):
+        return sum(self.frames) if self.compression else self.length
+
+    @property
+    def create_time(self):
+        return decode_time(self.create_stamp)
+
+    @create_time.setter
+    def create_time(self, value):
+        self.create_stamp = _stamp(value)
+
+    @property
+    def modify_time(self):
+        return decode_time(self.modify_stamp)
+
+    @modify_time.setter
+    def modify_time(self, value):
+        self.modify_stamp = _stamp(value)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__[:-2]}
+
+    def __setstate__(self, state):
+        # 兼容旧版存档 旧FCB以datetime保存时间且没有parent与压缩信息
+        state.setdefault("parent", None)
+        state.setdefault("compression", None)
+        state.setdefault("frames", ())
+        state["epoch"] = 0
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+# 日志与apply_batch中内容以latin-1逐字节映射为str 以下为各操作内容参数的位置
+DATA_FIELDS = {"write": 2, "pwrite": 3}
+
+
+def encode_op(op):
+    op = list(op)
+    index = DATA_FIELDS.get(op[0])
+    if index is not None:
+        data = op[index].encode("utf-8") if isinstance(op[index], str) else op[index]
+        op[index] = bytes(data).decode("latin-1")
+    return op
+
+
+def decode_op(op):
+    op = list(op)
+    index = DATA_FIELDS.get(op[0])
+    if index is not None:
+        op[index] = op[index].encode("latin-1")
+    return op
+
 
+# 被两个及以上表项指向的块 -> 指向它的表项数
+# 去重后多个文件可以共用相同的链尾 共用的块由此得知 不需要单独保存
+def count_refs(table):
+    return {index: n for index, n in Counter(table).items() if index >= 0 and n > 1}
 
+
+# 表项以array('i')连续保存 每项4字节
 class FAT:
-    def __init__(self):
-        self.block_num = BLOCK_NUM
-        self.table = []
-        for i in range(BLOCK_NUM):
-            self.table.append(FAT_FREE)
+    def __init__(self, block_num=BLOCK_NUM):
+        self.block_num = block_num
+        self.table = array("i", [FAT_FREE]) * block_num
+        # 新建的表全部视为脏
+        self.dirty_groups = set(range((block_num + GROUP_BLOCKS - 1) // GROUP_BLOCKS))
+        self.snapshot = None  # 最新的快照 修改表项前把原值存入其中
 
+    def __setstate__(self, state):
+        state.setdefault("dirty_groups", set(range((state["block_num"] + GROUP_BLOCKS - 1) // GROUP_BLOCKS)))
+        state.setdefault("snapshot", None)
+        # 旧版存档的表为list
+        state["table"] = array("i", state["table"])
+        self.__dict__.update(state)
+
+    # 修改表项需经过set 以便记录脏组
+    def set(self, index, value):
+        if self.snapshot is not None:
+            self.snapshot.preserve_fat(index, self.table[index])
+        self.table[index] = value
+        self.dirty_groups.add(index // GROUP_BLOCKS)
+
+    def grow(self, extra_num):
+        self.table.extend(array("i", [FAT_FREE]) * extra_num)
+        self.dirty_groups.update(range(self.block_num // GROUP_BLOCKS,
+                                       (self.block_num + extra_num + GROUP_BLOCKS - 1) // GROUP_BLOCKS))
+        self.block_num += extra_num
+
+
+# 磁盘 一段连续的字节缓冲区(bytearray或mmap) 按block_size划分为定长槽位
+class Disk:
+    def __init__(self, block_num=BLOCK_NUM, block_size=BLOCK_SIZE, buffer=None):
+        self.block_num = block_num
+        self.block_size = block_size
+        self.buffer = buffer if buffer is not None else bytearray(block_num * block_size)
+        self.dirty = set()  # 上次保存后被写过的块
+
+    # 将文件中从offset开始的区域映射为磁盘 ACCESS_COPY时写入只修改内存中的副本
+    @classmethod
+    def map_file(cls, fileno, block_num, block_size, offset=0, access=mmap.ACCESS_WRITE):
+        return cls(block_num, block_size, mmap.mmap(fileno, block_num * block_size, offset=offset, access=access))
+
+    # 返回整个磁盘的memoryview 用于无中间拷贝的读写
+    def view(self):
+        return memoryview(self.buffer)
+
+    def read_block(self, index, length=None):
+        offset = index * self.block_size
+        return bytes(self.buffer[offset:offset + (self.block_size if length is None else length)])
+
+    # 从块内offset处写入data
+    def write_block(self, index, data, offset=0):
+        offset += index * self.block_size
+        self.buffer[offset:offset + len(data)] = data
+        self.dirty.add(index)
+
+    def grow(self, extra_num):
+        if isinstance(self.buffer, mmap.mmap):
+            try:
+                self.buffer.resize((self.block_num + extra_num) * self.block_size)
+            except TypeError:
+                # 私有映射不能扩展 读入内存后再扩展
+                self.buffer = bytearray(self.buffer) + bytes(extra_num * self.block_size)
+        else:
+            self.buffer.extend(bytes(extra_num * self.block_size))
+        self.block_num += extra_num
 
-# 磁盘
-class Disk(list):
-    def __init__(self):
-        super(Disk, self).__init__()
-        for i in range(BLOCK_NUM):
-            self.append("")
+
+# 旧版存档中的磁盘 每块保存一个str
+class LegacyDisk(list):
+    pass
+
+
+# 读取旧版pickle存档 旧存档的类路径为__main__ 统一映射到本模块
+class LegacyUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if name == "Disk":
+            return LegacyDisk
+        if module in ("__main__", __name__):
+            return globals()[name]
+        return super().find_class(module, name)
 
 
 # 空闲空间bitmap
 class FreeSpace:
-    def __init__(self):
-        self.bitmap = bitarray(BLOCK_NUM)
+    def __init__(self, block_num=BLOCK_NUM):
+        self.bitmap = bitarray(block_num)
         self.bitmap.setall(0)
+        self.dirty_groups = set(range((block_num + GROUP_BLOCKS - 1) // GROUP_BLOCKS))
+
+    def __setstate__(self, state):
+        state.setdefault("dirty_groups", set(range((len(state["bitmap"]) + GROUP_BLOCKS - 1) // GROUP_BLOCKS)))
+        self.__dict__.update(state)
+
+    # 记录[start, start + length)所在的脏组
+    def mark_dirty(self, start, length=1):
+        self.dirty_groups.update(range(start // GROUP_BLOCKS, (start + length - 1) // GROUP_BLOCKS + 1))
+
+    def grow(self, extra_num):
+        self.mark_dirty(len(self.bitmap), extra_num)
+        self.bitmap.extend([SPACE_FREE] * extra_num)
+
+
+# 空闲块分配器 在bitmap上按连续空闲区间(extent)成段分配
+# bitmap仍是唯一的空闲信息来源 区间查找交给bitarray的find在C层完成
+class Allocator:
+    def __init__(self, free_space: FreeSpace):
+        self.free_space = free_space
+        self.cursor = 0  # next-fit游标 从上次分配结束处继续查找
+        self.free_num = free_space.bitmap.count(SPACE_FREE)
+        # 延迟释放 挂载镜像后 释放的块在下次保存提交前不可复用 保证已提交的镜像不被覆盖
+        self.defer = False
+        self.deferred = []
+        # 挂载镜像后 上次提交的镜像中已占用且之后未重新分配的块 不能原地改写 未挂载时为None
+        self.committed = None
+        # 最新的快照 记录其后分配的块 释放快照之前已在用的块时留给快照
+        self.snapshot = None
+        self.lock = threading.RLock()  # 保护bitmap与空闲计数
+
+    # 从pos开始(不回绕)找到下一段空闲区间 返回(start, length) 无则返回None
+    def __next_extent(self, pos, stop):
+        bitmap = self.free_space.bitmap
+        start = bitmap.find(SPACE_FREE, pos, stop)
+        if start == -1:
+            return None
+        end = bitmap.find(SPACE_OCCUPY, start, stop)
+        if end == -1:
+            end = stop
+        return start, end - start
+
+    # 分配count块 返回若干(start, length)区间 空间不足时不做任何分配
+    # 空闲块不够而有延迟释放的块时 提前复用这些块并记一条警告
+    # 它们可能仍被上次提交的镜像引用 此后到下次保存完成前 崩溃可能使上一代镜像读出新内容 即下次保存不再是崩溃安全的
+    def allocate_extents(self, count):
+        with self.lock:
+            return self.__allocate_extents(count)
+
+    def __allocate_extents(self, count):
+        if count > self.free_num and self.deferred:
+            logger.warning("reusing %d blocks freed since last save; the image is not crash-safe until the next save",
+                           len(self.deferred))
+            self.flush_deferred()
+        if count > self.free_num:
+            raise AssertionError("don't have enough space!!")
+        bitmap = self.free_space.bitmap
+        extents = []
+        pos, stop = self.cursor, len(bitmap)
+        wrapped = False
+        while count > 0:
+            extent = self.__next_extent(pos, stop)
+            if extent is None:
+                # 游标之后已无空闲 回绕到开头
+                assert not wrapped
+                pos, stop, wrapped = 0, self.cursor, True
+                continue
+            start, length = extent
+            length = min(length, count)
+            bitmap[start:start + length] = SPACE_OCCUPY
+            self.free_space.mark_dirty(start, length)
+            extents.append((start, length))
+            count -= length
+            pos = start + length
+        self.free_num -= sum(length for _, length in extents)
+        self.cursor = pos % len(bitmap)
+        if self.committed is not None:
+            for start, length in extents:
+                self.committed[start:start + length] = SPACE_FREE
+        if self.snapshot is not None:
+            for start, length in extents:
+                self.snapshot.fresh.update(range(start, start + length))
+        return extents
+
+    # 从磁盘开头找第一段不短于count的空闲区间(首次适应) 只接受起点小于before的区间
+    # 找到则整段分配并返回起点 否则返回None
+    def allocate_run(self, count, before=None):
+        with self.lock:
+            bitmap = self.free_space.bitmap
+            stop = len(bitmap) if before is None else min(before + count - 1, len(bitmap))
+            pos = 0
+            while True:
+                extent = self.__next_extent(pos, stop)
+                if extent is None:
+                    return None
+                start, length = extent
+                if length >= count:
+                    bitmap[start:start + count] = SPACE_OCCUPY
+                    self.free_space.mark_dirty(start, count)
+                    self.free_num -= count
+                    if self.committed is not None:
+                        self.committed[start:start + count] = SPACE_FREE
+                    if self.snapshot is not None:
+                        self.snapshot.fresh.update(range(start, start + count))
+                    return start
+                pos = start + length
+
+    # 分配count块 按分配顺序返回块号列表
+    def allocate(self, count):
+        blocks = []
+        for start, length in self.allocate_extents(count):
+            blocks.extend(range(start, start + length))
+        return blocks
+
+    # 磁盘扩容后新增的块均为空闲
+    def grow(self, extra_num):
+        with self.lock:
+            self.free_num += extra_num
+
+    def release(self, blocks):
+        with self.lock:
+            if self.snapshot is not None:
+                held, blocks = self.snapshot.hold(blocks)
+                # 留给快照的块在镜像中记为空闲 见FileSystem.image_bitmap
+                for index in held:
+                    self.free_space.mark_dirty(index)
+            if self.defer:
+                self.deferred.extend(blocks)
+                return
+            bitmap = self.free_space.bitmap
+            for index in blocks:
+                bitmap[index] = SPACE_FREE
+                self.free_space.mark_dirty(index)
+            self.free_num += len(blocks)
+
+    def is_committed(self, index):
+        return self.committed is not None and index < len(self.committed) and self.committed[index] == SPACE_OCCUPY
+
+    # 真正释放延迟的块 在保存时调用
+    def flush_deferred(self):
+        with self.lock:
+            deferred, self.deferred = self.deferred, []
+            defer, self.defer = self.defer, False
+            self.release(deferred)
+            self.defer = defer
 
 
 # 多级目录中的文件夹结点
 # 多级目录中 文件结点直接为FCB 且一定为叶节点
+# 子文件夹与文件分别以 名称->结点 的哈希表保存 查找/删除均为O(1)
 class FileTreeNode:  # dir
+    __slots__ = ("dir_index", "file_index", "parent", "dir_name", "create_stamp", "modify_stamp",
+                 "file_count", "total_length", "max_stamp", "__weakref__")
+
     def __init__(self, name: str, create_time):
-        self.tree_node_children = []
-        self.leaf_node_children = []
+        self.dir_index = {}  # 子文件夹名 -> FileTreeNode
+        self.file_index = {}  # 文件名 -> FCB
+        self.parent = None  # 父文件夹 根目录为None
         self.dir_name = name
-        self.create_time = create_time
-        self.modify_time = create_time
+        self.create_stamp = self.modify_stamp = _stamp(create_time)
+        # 整棵子树的文件数/总长度/最大修改时间 建立元数据索引后才开始维护 见FileSystem.metadata_index
+        self.file_count = 0
+        self.total_length = 0
+        self.max_stamp = 0
+
+    @property
+    def create_time(self):
+        return decode_time(self.create_stamp)
+
+    @create_time.setter
+    def create_time(self, value):
+        self.create_stamp = _stamp(value)
+
+    @property
+    def modify_time(self):
+        return decode_time(self.modify_stamp)
+
+    @modify_time.setter
+    def modify_time(self, value):
+        self.modify_stamp = _stamp(value)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in FileTreeNode.__slots__[:-1]}
+
+    def __setstate__(self, state):
+        # 兼容旧版存档 旧版子结点以list保存 时间为datetime
+        dirs = state.pop("tree_node_children", None)
+        files = state.pop("leaf_node_children", None)
+        state.setdefault("dir_index", {})
+        state.setdefault("file_index", {})
+        state.setdefault("parent", None)
+        for name in ("file_count", "total_length", "max_stamp"):
+            state.setdefault(name, 0)
+        for name, value in state.items():
+            setattr(self, name, value)
+        for node in dirs or []:
+            self.add_dir(node)
+        for fcb in files or []:
+            self.add_file(fcb)
+
+    # 按插入顺序返回子文件夹/文件 供UI展示
+    @property
+    def tree_node_children(self):
+        return list(self.dir_index.values())
+
+    @property
+    def leaf_node_children(self):
+        return list(self.file_index.values())
+
+    def add_dir(self, node):
+        node.parent = self
+        self.dir_index[node.dir_name] = node
+
+    def add_file(self, fcb: FCB):
+        fcb.parent = self
+        self.file_index[fcb.file_name] = fcb
+
+    def remove_dir(self, node):
+        del self.dir_index[node.dir_name]
+        node.parent = None
+
+    def remove_file(self, fcb: FCB):
+        del self.file_index[fcb.file_name]
+        fcb.parent = None
 
     def size(self):
-        return len(self.tree_node_children) + len(self.leaf_node_children)
+        return len(self.dir_index) + len(self.file_index)
 
 
 class FileTree:
@@ -64,141 +452,1497 @@ class FileTree:
         self.root = FileTreeNode("/", datetime.now())
 
 
+# 文件句柄 按字节定位读写 并缓存已走过的FAT链(块序号 -> 块号)
+# mode: "r"只读 "r+"读写 "w"截断为空 "a"追加
+class FileHandle:
+    MODES = ("r", "r+", "w", "a")
+
+    def __init__(self, file_system, fcb: FCB, mode="r"):
+        if mode not in self.MODES:
+            raise ValueError("invalid mode: %r" % (mode,))
+        self.file_system = file_system
+        self.fcb = fcb
+        self.mode = mode
+        self.position = 0
+        self.chain = []
+        self.epoch = None  # 缓存的链对应的(卷, 文件)版本 见FileSystem.__block_of
+        self.frame = None  # 压缩文件最近解压的帧 (frames, 帧号, 内容)
+        if mode == "w":
+            file_system.truncate_file(fcb, 0, self)
+        elif mode == "a":
+            self.position = fcb.length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __check_writable(self):
+        if self.mode == "r":
+            raise IOError("file not open for writing")
+
+    def read(self, size=-1):
+        data = self.file_system.pread(self.fcb, self.position, size, self)
+        self.position += len(data)
+        return data
+
+    # 按块读取的生成器 从当前位置开始
+    def chunks(self, chunk_size=None):
+        chunk_size = chunk_size or self.file_system.block_size
+        while True:
+            data = self.read(chunk_size)
+            if not data:
+                return
+            yield data
+
+    def write(self, data):
+        self.__check_writable()
+        if self.mode == "a":
+            self.position = self.fcb.length
+        n = self.file_system.pwrite(self.fcb, self.position, data, self)
+        self.position += n
+        return n
+
+    def append(self, data):
+        self.__check_writable()
+        n = self.file_system.append_file(self.fcb, data, self)
+        self.position = self.fcb.length
+        return n
+
+    # whence: 0从文件头 1从当前位置 2从文件尾
+    def seek(self, offset, whence=0):
+        base = (0, self.position, self.fcb.length)[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def truncate(self, size=None):
+        self.__check_writable()
+        self.file_system.truncate_file(self.fcb, self.position if size is None else size, self)
+
+    def close(self):
+        self.chain = []
+        self.frame = None
+
+
 class FileSystem:
-    def __init__(self, system_info_file=None):
+    def __init__(self, system_info_file=None, block_size=BLOCK_SIZE, block_num=BLOCK_NUM, journal=False,
+                 lazy=False, cache_blocks=0, cache_policy="lru", check=False, dedup=False, demo=True):
         import os
+        from file_system_image import ImageFile, is_image
+        self.image = None  # 当前挂载的镜像文件
+        self.journal = None  # 预写日志 journal=True时启用
+        self.__replay_time = None  # 重放日志时 操作时间取自日志记录
+        self.cache = None  # 块缓存 cache_blocks为0时直接读写磁盘
+        self.chain_epoch = 0  # 整卷的FAT被替换时(回滚/格式化/修复)加一 单个文件的链变化只改FCB.epoch
+        # 并发控制 普通操作持有卷读锁 保存/格式化/扩容持有卷写锁
+        self.volume_lock = RWLock()
+        self.dir_locks = LockTable(RWLock)  # 每个文件夹一把读写锁 保护其子结点索引
+        self.file_locks = LockTable(RWLock)  # 每个文件一把读写锁 保护FCB与其FAT链
+        self.journal_lock = threading.Lock()
+        self.__checkpoint_due = False
+        self.listeners = []  # 目录树变化的回调 见add_listener
+        self.metadata = None  # 元数据索引 见metadata_index
+        self.stats = None  # 性能统计 见enable_stats
+        # 块级去重 以(块内容, 下一块)为键把相同的链尾合并为一条
+        # 文件的首块从不共用 因此引用计数只需统计FAT中的指针 见count_refs
+        self.dedup = dedup
+        self.dedup_index = {}  # (内容, 下一块) -> 块号 只包含内容未再修改过的块
+        self.block_keys = {}  # 块号 -> 索引键
+        self.refs = {}  # 共用块 -> 引用数
+        self.dedup_hits = 0
+        # 快照 按创建顺序排列 只保存在内存中 见create_snapshot
+        self.snapshots = []
+        self.__snapshot = None  # 最新的快照 修改前的状态存入其中
         # 存在文件则直接读取
         if system_info_file and os.path.exists(system_info_file):
-            with open(system_info_file, "rb") as f:
-                self.file_tree = pickle.load(f)
-                self.free_space = pickle.load(f)
-                self.disk = pickle.load(f)
-                self.fat = pickle.load(f)
-        else: # 否则手动创建
-            print("file loss")
+            if is_image(system_info_file):
+                # lazy=True时只读取超级块/FAT/bitmap和根目录 其余按需载入
+                self.image = ImageFile(system_info_file)
+                self.image.load(self, lazy)
+            else:
+                self.__load_pickle(system_info_file)
+        else: # 否则手动创建 demo=False时为空卷
+            self.block_size = block_size
+            self.block_num = block_num
             self.file_tree = FileTree()
-            self.free_space = FreeSpace()
-            self.disk = Disk()
-            self.fat = FAT()
-            self.create_dir(self.file_tree.root, "文件夹1", datetime.now())
-            self.create_dir(self.file_tree.root.tree_node_children[0], "文件夹2", datetime.now())
-            self.create_dir(self.file_tree.root.tree_node_children[0].tree_node_children[0], "文件夹3", datetime.now())
-            self.create_file("文件1", self.file_tree.root)
-            self.create_file("文件2", self.file_tree.root.tree_node_children[0])
-            self.create_file("文件3", self.file_tree.root.tree_node_children[0])
+            self.free_space = FreeSpace(block_num)
+            self.disk = Disk(block_num, block_size)
+            self.fat = FAT(block_num)
+            if demo:
+                print("file loss")
+                dir1 = self.create_dir(self.file_tree.root, "文件夹1", datetime.now())
+                dir2 = self.create_dir(dir1, "文件夹2", datetime.now())
+                self.create_dir(dir2, "文件夹3", datetime.now())
+                self.create_file("文件1", self.file_tree.root)
+                self.create_file("文件2", dir1)
+                self.create_file("文件3", dir1)
+        self.allocator = Allocator(self.free_space)
+        self.allocator.defer = self.image is not None
+        if self.image is not None:
+            self.allocator.committed = self.free_space.bitmap.copy()
+        self.refs = count_refs(self.fat.table)
+        if cache_blocks:
+            from file_system_cache import BlockCache
+            self.cache = BlockCache(self.disk, self.fat, cache_blocks, cache_policy)
+        if journal and system_info_file:
+            self.__open_journal(system_info_file)
+        if check:
+            # 启动时检查并修复FAT/bitmap/目录树的一致性 惰性模式下会载入全部文件夹
+            from file_system_fsck import fsck
+            report = fsck(self, repair=True)
+            if report["errors"]:
+                print("fsck repaired %d errors" % report["errors"])
+
+    # 打开日志并重放上次检查点之后的操作
+    def __open_journal(self, system_info_file):
+        from file_system_journal import Journal
+        if self.image is None:
+            # 日志以已提交的镜像为基准 先写出一份镜像
+            self.save(system_info_file)
+        self.journal = Journal(system_info_file + ".journal")
+        for record in self.journal.open(self.image.super["generation"]):
+            self.__replay(record)
+
+    def __replay(self, record):
+        op = record[0]
+        self.__replay_time = decode_time(record[-1])
+        try:
+            if op == "batch":
+                for entry in record[1]:
+                    self.__apply(*decode_op(entry))
+            elif op == "import":
+                entries = [(path, None if data is None else data.encode("latin-1"), stamp)
+                           for path, data, stamp in record[2]]
+                self.__bulk_import(self.resolve(record[1]), entries)
+            elif op == "format":
+                self.format()
+            elif op == "grow":
+                self.grow(record[1])
+            else:
+                self.__apply(*decode_op(record[:-1]))
+        finally:
+            self.__replay_time = None
+
+    def __lookup(self, path):
+        node = self.resolve(path)
+        if node is None:
+            raise FileNotFoundError(path)
+        return node
+
+    # 执行一条以路径表示的操作 内容均为bytes 与日志记录一一对应
+    def __apply(self, op, *args):
+        if op == "mkdir":
+            return self.create_dir(self.__lookup(args[0]), args[1], self.__now())
+        elif op == "rmdir":
+            return self.delete_dir(self.__lookup(args[0]))
+        elif op == "mvdir":
+            return self.rename_dir(self.__lookup(args[0]), args[1])
+        elif op == "create":
+            return self.create_file(args[1], self.__lookup(args[0]))
+        elif op == "mv":
+            fcb = self.__lookup(args[0])
+            return self.rename_file(fcb, args[1], fcb.parent)
+        elif op == "write":
+            return self.write_and_close_file(args[1], self.__lookup(args[0]))
+        elif op == "pwrite":
+            return self.pwrite(self.__lookup(args[0]), args[1], args[2])
+        elif op == "truncate":
+            return self.truncate_file(self.__lookup(args[0]), args[1])
+        elif op == "compress":
+            return self.set_compression(self.__lookup(args[0]), args[1])
+        elif op == "rm":
+            return self.delete_file(self.__lookup(args[0]))
+        raise ValueError("unknown operation: %s" % op)
+
+    # 批处理期间与重放相同 时间固定为time 其中的操作不再单独记录日志
+    @contextmanager
+    def __batch(self, time):
+        previous, self.__replay_time = self.__replay_time, time
+        try:
+            yield
+        finally:
+            self.__replay_time = previous
+
+    # 按顺序执行一组以路径表示的操作 返回各操作的返回值 期间独占整个卷
+    #   ("mkdir", 父路径, 名称)  ("create", 父路径, 名称)  ("write", 路径, 内容)  ("pwrite", 路径, 偏移, 内容)
+    #   ("truncate", 路径, 长度)  ("mv"/"mvdir", 路径, 新名称)  ("rm"/"rmdir", 路径)  ("compress", 路径, 算法)
+    # 内容可以是str(按UTF-8编码)或bytes 全部操作只写一条日志并立即落盘
+    # 某一操作失败时 其前的操作仍然生效并记入日志 异常继续抛出
+    def apply_batch(self, operations):
+        operations = [encode_op(op) for op in operations]
+        results = []
+        with self.__exclusive():
+            now = self.__now()
+            try:
+                with self.__batch(now):
+                    for op in operations:
+                        results.append(self.__apply(*decode_op(op)))
+            finally:
+                if results:
+                    self.__log("batch", operations[:len(results)], time=now)
+                    self.__commit_journal()
+        return results
+
+    def __commit_journal(self):
+        if self.journal is not None and self.__replay_time is None:
+            with self.journal_lock:
+                self.journal.commit()
+
+    # 批量导入 entries为(相对路径, 内容, 修改时间)的序列 内容为None表示文件夹 修改时间为datetime/微秒数/None
+    # 路径开头的/与其中的.忽略 含..时抛出ValueError
+    # 缺少的上级文件夹自动创建 同名文件夹合并 同名文件覆盖
+    # 名称检查一次完成 新文件所需的块一次分配 整个导入只写一条日志 返回导入的文件数
+    def bulk_import(self, node: FileTreeNode, entries):
+        entries = [(path, data.encode("utf-8") if isinstance(data, str) else data,
+                    None if stamp is None else _stamp(stamp)) for path, data, stamp in entries]
+        with self.__exclusive():
+            self.__check_alive(node)
+            now = self.__now()
+            with self.__batch(now):
+                count = self.__bulk_import(node, entries)
+            self.__log("import", self.path_of(node),
+                       [[path, None if data is None else bytes(data).decode("latin-1"), stamp]
+                        for path, data, stamp in entries], time=now)
+            self.__commit_journal()
+        return count
+
+    def __bulk_import(self, node: FileTreeNode, entries):
+        now = self.__now()
+        # 名称检查 相同路径以最后一项为准
+        dirs = {}
+        files = {}
+        for path, data, stamp in entries:
+            parts = tuple(part for part in path.split("/") if part not in ("", "."))
+            if not parts:
+                continue
+            if ".." in parts:
+                raise ValueError("invalid path: %s" % path)
+            for i in range(1, len(parts)):
+                dirs.setdefault(parts[:i], None)
+            if data is None:
+                dirs[parts] = stamp
+                files.pop(parts, None)
+            else:
+                files[parts] = (data, stamp)
+        # 文件与文件夹不能同名 有冲突时不做任何修改
+        for parts in dirs:
+            parent = self.__walk(node, parts[:-1])
+            if parts in files or parent is not None and parts[-1] in parent.file_index:
+                raise FileExistsError("/".join(parts))
+        new_files = []
+        old_files = []
+        for parts, (data, stamp) in files.items():
+            parent = self.__walk(node, parts[:-1])
+            if parent is not None and parts[-1] in parent.dir_index:
+                raise FileExistsError("/".join(parts))
+            fcb = parent.file_index.get(parts[-1]) if parent is not None else None
+            (new_files if fcb is None else old_files).append((parts, data, stamp, fcb))
+
+        # 空间不足时不做任何修改 新文件的块一次分配
+        block_size = self.block_size
+        new_blocks = sum((len(data) + block_size - 1) // block_size for _, data, _, _ in new_files)
+        # 覆盖已有文件时沿用原链 去重写入则先建新链再释放旧链
+        extra = sum(max(0, (len(data) + block_size - 1) // block_size - (0 if self.dedup else self.block_count(fcb)))
+                    for _, data, _, fcb in old_files)
+        with self.allocator.lock:
+            if new_blocks + extra > self.allocator.free_num + len(self.allocator.deferred):
+                raise AssertionError("don't have enough space!!")
+            blocks = [] if self.dedup else self.allocator.allocate(new_blocks)
+
+        for parts in sorted(dirs, key=len):
+            parent = self.__walk(node, parts[:-1])
+            if parts[-1] not in parent.dir_index:
+                self.create_dir(parent, parts[-1], now if dirs[parts] is None else decode_time(dirs[parts]))
+
+        pos = 0
+        for parts, data, stamp, _ in new_files:
+            parent = self.__walk(node, parts[:-1])
+            self.__preserve(parent)
+            fcb = FCB(parts[-1], now if stamp is None else stamp, len(data))
+            if self.dedup:
+                # 去重时逐个文件写入 以便与已有内容共用
+                self.__store(fcb, data, None)
+            else:
+                count = (len(data) + block_size - 1) // block_size
+                chain = blocks[pos:pos + count]
+                pos += count
+                for i, index in enumerate(chain):
+                    self.fat.set(index, chain[i + 1] if i + 1 < count else FAT_END)
+                self.__write_blocks(chain, data)
+                fcb.start_address = chain[0] if chain else None
+            parent.add_file(fcb)
+            self.__notify("file_added", parent, fcb)
+        for parts, data, stamp, fcb in old_files:
+            with self.file_locks[fcb].write():
+                self.__preserve(fcb)
+                self.__store(fcb, data, fcb.compression)
+                fcb.length = len(data)
+                fcb.modify_time = now if stamp is None else stamp
+            self.__notify("file_changed", fcb)
+        return len(files)
+
+    # 沿名称序列找到子文件夹 不存在返回None
+    @staticmethod
+    def __walk(node: FileTreeNode, parts):
+        for part in parts:
+            node = node.dir_index.get(part)
+            if node is None:
+                return None
+        return node
+
+    # 记录一次操作及其时间 重放时不再记录
+    def __log(self, *record, time=None):
+        if self.journal is None or self.__replay_time is not None:
+            return
+        with self.journal_lock:
+            self.journal.append(list(record) + [encode_time(time or datetime.now())])
+            if self.journal.records >= self.journal.checkpoint_interval:
+                # 持有卷读锁时无法保存 待操作结束后再写检查点
+                self.__checkpoint_due = True
+
+    # 注册目录树变化的回调 callback(event, *args) 在修改完成后、释放锁之前调用
+    #   ("dir_added", parent, node)   ("dir_removed", parent, node)   ("dir_renamed", node)
+    #   ("file_added", parent, fcb)   ("file_removed", parent, fcb)   ("file_renamed", fcb)
+    #   ("file_changed", fcb)         ("reset",)
+    # 回调在执行操作的线程中调用 不应再调用会修改文件系统的方法
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self.listeners.remove(callback)
+
+    def __notify(self, event, *args):
+        for callback in self.listeners:
+            callback(event, *args)
+
+    # 一次普通操作 持有卷读锁
+    @contextmanager
+    def __operation(self):
+        with self.volume_lock.read():
+            yield
+        if self.__checkpoint_due and not self.volume_lock.is_held():
+            self.checkpoint()
+
+    # 独占整个文件系统的操作 持有卷写锁
+    @contextmanager
+    def __exclusive(self):
+        with self.volume_lock.write():
+            yield
+        if self.__checkpoint_due and not self.volume_lock.is_held():
+            self.checkpoint()
+
+    # 按父到子的顺序对若干文件夹/文件加写锁
+    def __lock_write(self, stack: ExitStack, *nodes):
+        for node in nodes:
+            table = self.file_locks if isinstance(node, FCB) else self.dir_locks
+            stack.enter_context(table[node].write())
+
+    # 结点可能在等待锁时已被其他线程删除 此时不再属于目录树
+    def __check_alive(self, node):
+        if node.parent is None and node is not self.file_tree.root:
+            raise FileNotFoundError(node.file_name if isinstance(node, FCB) else node.dir_name)
+
+    def __now(self):
+        return self.__replay_time if self.__replay_time is not None else datetime.now()
+
+    # 修改结点前调用 把结点及其到根的路径上尚未保存的结点存入最新的快照
+    # 同时告知镜像这条路径上的文件夹需要在下次保存时重新编码
+    def __preserve(self, node):
+        if self.image is not None:
+            self.image.mark_dirty(node)
+        if self.__snapshot is not None:
+            self.__snapshot.preserve(node)
+
+    # 原地改写块前调用 快照之前已在用的块先复制一份留给快照
+    def __preserve_block(self, index):
+        snapshot = self.__snapshot
+        if not snapshot.needs_copy(index):
+            return
+        with self.allocator.lock:
+            copy = self.allocator.allocate(1)[0]
+            # 副本只属于快照 不是之后新分配给文件的块
+            snapshot.fresh.discard(copy)
+            data = self.__read_block(index)
+            if self.cache is not None:
+                self.cache.write_block(copy, data)
+            else:
+                self.disk.write_block(copy, data)
+            snapshot.moved[index] = copy
+
+    # 之后的修改存入snapshot None表示不再记录
+    def __track(self, snapshot):
+        self.__snapshot = snapshot
+        self.fat.snapshot = snapshot
+        self.allocator.snapshot = snapshot
+
+    # 读取旧版pickle存档
+    def __load_pickle(self, system_info_file):
+        with open(system_info_file, "rb") as f:
+            unpickler = LegacyUnpickler(f)
+            self.file_tree = unpickler.load()
+            self.free_space = unpickler.load()
+            disk = unpickler.load()
+            self.fat = unpickler.load()
+            try:
+                geometry = unpickler.load()
+            except EOFError:
+                # 旧版存档未保存磁盘参数 使用当时的默认块大小
+                geometry = {"block_size": BLOCK_SIZE}
+        self.block_size = geometry["block_size"]
+        self.block_num = self.fat.block_num
+        if isinstance(disk, LegacyDisk):
+            self.__migrate_legacy_disk(disk)
+        else:
+            self.disk = Disk(self.block_num, self.block_size, disk)
+
+    # 旧版磁盘按字符分块 FCB长度为字符数 读出全部文件后按字节重新写入
+    def __migrate_legacy_disk(self, legacy_disk: LegacyDisk):
+        files = []
+        queue = [self.file_tree.root]
+        while queue:
+            node = queue.pop()
+            queue.extend(node.tree_node_children)
+            for fcb in node.leaf_node_children:
+                data = ""
+                cursor = fcb.start_address
+                while cursor is not None and cursor != FAT_END:
+                    data += legacy_disk[cursor]
+                    cursor = self.fat.table[cursor]
+                files.append((fcb, data))
+
+        self.free_space = FreeSpace(self.block_num)
+        self.disk = Disk(self.block_num, self.block_size)
+        self.fat = FAT(self.block_num)
+        self.allocator = Allocator(self.free_space)
+        need_num = sum((len(data.encode("utf-8")) + self.block_size - 1) // self.block_size for _, data in files)
+        if need_num > self.block_num:
+            self.grow(need_num - self.block_num)
+        for fcb, data in files:
+            # 旧链属于已丢弃的FAT 从空文件开始重写
+            fcb.start_address = None
+            fcb.length = 0
+            modify_time = fcb.modify_time
+            self.write_and_close_file(data, fcb)
+            fcb.modify_time = modify_time
 
     # 找到并返回空闲空间的index
     def find_free_index(self):
         # 0 -> free
         return self.free_space.bitmap.find(0)
 
+    # 按绝对路径查找文件夹或文件 如"/a/b/c" 代价为O(深度)
+    # 每一步只持有当前文件夹的读锁
+    def resolve(self, path: str):
+        cursor = self.file_tree.root
+        names = [x for x in path.split("/") if x != ""]
+        for i, name in enumerate(names):
+            with self.dir_locks[cursor].read():
+                if name in cursor.dir_index:
+                    next_node = cursor.dir_index[name]
+                elif i == len(names) - 1 and name in cursor.file_index:
+                    return cursor.file_index[name]
+                else:
+                    return None
+            cursor = next_node
+        return cursor
+
+    # 返回文件夹或文件的绝对路径
+    def path_of(self, node):
+        names = []
+        cursor = node
+        while cursor is not None and cursor.parent is not None:
+            names.append(cursor.file_name if isinstance(cursor, FCB) else cursor.dir_name)
+            cursor = cursor.parent
+        return "/" + "/".join(reversed(names))
+
     def create_dir(self, file_tree_node: FileTreeNode, name, create_time):
-        for node in file_tree_node.tree_node_children:
-            if node.dir_name == name:
-                print("dir name exists")
+        with self.__operation(), self.dir_locks[file_tree_node].write():
+            self.__check_alive(file_tree_node)
+            # 同一文件夹中文件与文件夹也不能同名 否则按路径无法区分
+            if name in file_tree_node.dir_index or name in file_tree_node.file_index:
+                print("name exists")
                 return
+            self.__preserve(file_tree_node)
 
-        file_tree_node.tree_node_children.append(FileTreeNode(name, create_time))
-        file_tree_node.modify_time = create_time
+            node = FileTreeNode(name, create_time)
+            file_tree_node.add_dir(node)
+            file_tree_node.modify_time = create_time
+            self.__log("mkdir", self.path_of(file_tree_node), name, time=create_time)
+            self.__notify("dir_added", file_tree_node, node)
+            return node
 
-    # 清空文件夹内全部内容
+    # 清空文件夹内全部内容 调用者已持有整棵子树的写锁
+    # 其中每个被删除的文件/文件夹都产生一次事件 文件夹在其内容之后
     def __clear_dir(self, node: FileTreeNode):
+        self.__preserve(node)
         for leaf in node.leaf_node_children:
-            self.delete_file(leaf)
+            with self.file_locks[leaf].write():
+                self.__delete_file(leaf)
+            self.__notify("file_removed", node, leaf)
         for dir in node.tree_node_children:
             self.__clear_dir(dir)
+            # 子文件夹也脱离目录树 其他线程手中的结点随之失效
+            node.remove_dir(dir)
+            self.__notify("dir_removed", node, dir)
 
     def delete_dir(self, delete_node: FileTreeNode):
-        self.__clear_dir(delete_node)
-        # 广度优先删除
-        cursor = self.file_tree.root
-        queue = [cursor]
-        while delete_node not in cursor.tree_node_children and queue != []:
-            cursor = queue.pop(0)
-            queue.extend(cursor.tree_node_children)
-        cursor.tree_node_children.remove(delete_node)
+        with self.__operation(), ExitStack() as stack:
+            # 先锁父结点 再自上而下锁住整棵子树
+            parent = delete_node.parent
+            self.__check_alive(delete_node)
+            self.__lock_write(stack, parent)
+            if delete_node.parent is not parent:
+                raise FileNotFoundError(delete_node.dir_name)
+            pending = [delete_node]
+            while pending:
+                node = pending.pop()
+                self.__lock_write(stack, node)
+                pending.extend(node.tree_node_children)
+            path = self.path_of(delete_node)
+            self.__clear_dir(delete_node)
+            # 通过父结点指针直接删除
+            delete_node.parent.remove_dir(delete_node)
+            self.__log("rmdir", path)
+            self.__notify("dir_removed", parent, delete_node)
 
     def rename_dir(self, file_tree_node: FileTreeNode, new_name):
-        file_tree_node.dir_name = new_name
-        file_tree_node.modify_time = datetime.now() # 修改时间变更
+        with self.__operation(), ExitStack() as stack:
+            parent = file_tree_node.parent
+            self.__lock_write(stack, *[x for x in (parent, file_tree_node) if x is not None])
+            self.__check_alive(file_tree_node)
+            if file_tree_node.parent is not parent:
+                raise FileNotFoundError(file_tree_node.dir_name)
+            # 不覆盖同名的文件夹 也不与文件同名
+            if parent is not None and (parent.dir_index.get(new_name, file_tree_node) is not file_tree_node
+                                       or new_name in parent.file_index):
+                raise FileExistsError(new_name)
+            self.__preserve(file_tree_node)
+            path = self.path_of(file_tree_node)
+            if parent is not None:
+                parent.remove_dir(file_tree_node)
+            file_tree_node.dir_name = new_name
+            if parent is not None:
+                parent.add_dir(file_tree_node)
+            file_tree_node.modify_time = self.__now() # 修改时间变更
+            self.__log("mvdir", path, new_name, time=file_tree_node.modify_time)
+            self.__notify("dir_renamed", file_tree_node)
 
     def create_file(self, name, file_tree_node: FileTreeNode):
-        if name not in file_tree_node.leaf_node_children:
-            file_tree_node.leaf_node_children.append(FCB(name, datetime.now(), 0))
+        with self.__operation(), self.dir_locks[file_tree_node].write():
+            self.__check_alive(file_tree_node)
+            if name not in file_tree_node.file_index and name not in file_tree_node.dir_index:
+                self.__preserve(file_tree_node)
+                fcb = FCB(name, self.__now(), 0)
+                file_tree_node.add_file(fcb)
+                self.__log("create", self.path_of(file_tree_node), name, time=fcb.create_time)
+                self.__notify("file_added", file_tree_node, fcb)
+                return fcb
 
     def rename_file(self, fcb: FCB, new_name: str, parent_node: FileTreeNode):
-        fcb.file_name = new_name
-        fcb.modify_time = datetime.now()
-        parent_node.modify_time = datetime.now()
+        with self.__operation(), ExitStack() as stack:
+            self.__lock_write(stack, parent_node, fcb)
+            if fcb.parent is not parent_node:
+                raise FileNotFoundError(fcb.file_name)
+            if parent_node.file_index.get(new_name, fcb) is not fcb or new_name in parent_node.dir_index:
+                raise FileExistsError(new_name)
+            self.__preserve(fcb)
+            path = self.path_of(fcb)
+            parent_node.remove_file(fcb)
+            fcb.file_name = new_name
+            parent_node.add_file(fcb)
+            fcb.modify_time = self.__now()
+            parent_node.modify_time = fcb.modify_time
+            self.__log("mv", path, new_name, time=fcb.modify_time)
+            self.__notify("file_renamed", fcb)
 
-    # 打开并读取返回文件数据
-    def open_and_read_file(self, fcb: FCB):
+    # 从start开始沿FAT链读取length字节到预先分配好的缓冲区
+    def __read_chain(self, start, length):
+        data = bytearray(length)
+        block_size = self.block_size
+        if self.stats is not None:
+            self.stats.blocks_read += (length + block_size - 1) // block_size
+        cursor = start
+        pos = 0
+        with memoryview(data) as dst:
+            if self.cache is not None:
+                while cursor != FAT_END and pos < length:
+                    n = min(block_size, length - pos)
+                    dst[pos:pos + n] = self.cache.read_block(cursor)[:n]
+                    pos += n
+                    cursor = self.fat.table[cursor]
+                return data
+            with self.disk.view() as src:
+                while cursor != FAT_END and pos < length:
+                    n = min(block_size, length - pos)
+                    offset = cursor * block_size
+                    dst[pos:pos + n] = src[offset:offset + n]
+                    pos += n
+                    cursor = self.fat.table[cursor]
+        return data
+
+    # 将data按块写入blocks positions为需要写入的块序号 默认全部写入
+    def __write_blocks(self, blocks, data, positions=None):
+        block_size = self.block_size
+        if positions is None:
+            positions = range(len(blocks))
+        if self.stats is not None:
+            self.stats.blocks_written += len(positions)
+        if self.__snapshot is not None:
+            for i in positions:
+                self.__preserve_block(blocks[i])
+        with memoryview(data) as src:
+            if self.cache is not None:
+                for i in positions:
+                    self.cache.write_block(blocks[i], src[i * block_size:(i + 1) * block_size])
+                return
+            with self.disk.view() as dst:
+                for i in positions:
+                    index = blocks[i]
+                    chunk = src[i * block_size:(i + 1) * block_size]
+                    dst[index * block_size:index * block_size + len(chunk)] = chunk
+                    self.disk.dirty.add(index)
+
+    # 比较已有块与新数据 返回内容有变化的块序号
+    # 原长度之外的部分视为已变化 块尾的旧数据无需比较
+    def __changed_blocks(self, blocks, data, old_length):
+        block_size = self.block_size
+        changed = []
+        with memoryview(data) as src:
+            for i, index in enumerate(blocks):
+                begin = i * block_size
+                chunk = src[begin:begin + block_size]
+                if begin + len(chunk) > old_length or self.__read_block(index)[:len(chunk)] != chunk:
+                    changed.append(i)
+        return changed
+
+    # 沿FAT链将文件内容读入预先分配好的缓冲区 返回bytearray
+    def open_and_read_bytes(self, fcb: FCB):
+        with self.__operation(), self.file_locks[fcb].read():
+            self.__check_alive(fcb)
+            return self.__read_all(fcb)
+
+    def __read_all(self, fcb: FCB):
         if fcb.start_address is None:
-            return ""
-        cursor = fcb.start_address
-        data = ""
-        while cursor != FAT_END:
-            data += self.disk[cursor]
-            cursor = self.fat.table[cursor]
+            return bytearray(fcb.length)
+        if not fcb.compression:
+            return self.__read_chain(fcb.start_address, fcb.length)
+        stored = self.__read_chain(fcb.start_address, self.block_count(fcb) * self.block_size)
+        return self.__decompress(stored, fcb.compression, fcb.frames)
+
+    # 逐帧解压 每帧从块边界开始
+    def __decompress(self, stored, compression, frames):
+        block_size = self.block_size
+        decompress = COMPRESSORS[compression][1]
+        data = bytearray()
+        pos = 0
+        with memoryview(stored) as src:
+            for size in frames:
+                data += decompress(src[pos:pos + size])
+                pos += (size + block_size - 1) // block_size * block_size
         return data
 
-    # 写入并保存数据
+    # 文件链应有的块数 压缩文件的每帧各自按块对齐
+    def block_count(self, fcb: FCB):
+        block_size = self.block_size
+        if fcb.compression:
+            return sum((size + block_size - 1) // block_size for size in fcb.frames)
+        return (fcb.length + block_size - 1) // block_size
+
+    # 分帧压缩 每帧补零到块边界 返回(存放的数据, 每帧压缩后的字节数)
+    def __compress(self, data, compression):
+        compress = COMPRESSORS[compression][0]
+        block_size = self.block_size
+        stored = bytearray()
+        frames = []
+        with memoryview(data) as src:
+            for begin in range(0, len(data), FRAME_SIZE):
+                frame = compress(src[begin:begin + FRAME_SIZE])
+                frames.append(len(frame))
+                stored += frame
+                stored += bytes(-len(stored) % block_size)
+        return stored, tuple(frames)
+
+    # 按compression写入文件的全部内容 不修改长度与时间
+    def __store(self, fcb: FCB, data, compression):
+        # 压缩文件的块都已整块写入 原始文件只有length之内的部分有效
+        old_length = self.block_count(fcb) * self.block_size if fcb.compression else fcb.length
+        frames = ()
+        if compression:
+            data, frames = self.__compress(data, compression)
+        if self.dedup:
+            self.__write_dedup(fcb, data)
+        else:
+            self.__rewrite_chain(fcb, data, old_length)
+        fcb.compression = compression
+        fcb.frames = frames
+
+    # 设置文件的压缩算法 None表示不压缩 已有内容按新方式重写
+    def set_compression(self, fcb: FCB, compression):
+        if compression is not None and compression not in COMPRESSORS:
+            raise ValueError("unknown compression: %s" % compression)
+        with self.__operation(), self.file_locks[fcb].write():
+            self.__check_alive(fcb)
+            if compression != fcb.compression:
+                self.__preserve(fcb)
+                self.__store(fcb, self.__read_all(fcb), compression)
+            self.__log("compress", self.path_of(fcb), compression)
+            self.__notify("file_changed", fcb)
+
+    # 打开并读取返回文件数据
+    def open_and_read_file(self, fcb: FCB):
+        return self.open_and_read_bytes(fcb).decode("utf-8")
+
+    # 写入并保存数据 data可以是str或bytes
     def write_and_close_file(self, data, fcb: FCB):
-        cur_index = FAT_END
-        fcb.length = len(data)
-        fcb.modify_time = datetime.now()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self.__operation(), self.file_locks[fcb].write():
+            self.__check_alive(fcb)
+            self.__preserve(fcb)
+            self.__store(fcb, data, fcb.compression)
+            fcb.length = len(data)
+            fcb.modify_time = self.__now()
+            # bytes按latin-1逐字节映射为str写入日志
+            self.__log("write", self.path_of(fcb), bytes(data).decode("latin-1"), time=fcb.modify_time)
+            self.__notify("file_changed", fcb)
 
-        while data != "":
-            next_index = self.find_free_index()
-            if next_index == -1:
-                raise AssertionError("don't have enough space!!")
-            if cur_index == FAT_END:
-                fcb.start_address = next_index
-            else:
-                self.fat.table[cur_index] = next_index
+    # 沿用原有的链 只改写内容变化的块 old_length为原链中有效的字节数
+    def __rewrite_chain(self, fcb: FCB, data, old_length):
+        self.__unshare(fcb)
+        block_size = self.block_size
+        block_count = (len(data) + block_size - 1) // block_size
+
+        blocks = []
+        cursor = fcb.start_address
+        while cursor is not None and cursor != FAT_END and len(blocks) < block_count:
+            blocks.append(cursor)
+            cursor = self.fat.table[cursor]
+        changed = self.__changed_blocks(blocks, data, old_length)
+        self.__redirect_committed(fcb, blocks, changed)
 
-            self.disk[next_index] = data[:BLOCK_SIZE]
-            data = data[BLOCK_SIZE:]
-            self.free_space.bitmap[next_index] = SPACE_OCCUPY
+        if len(blocks) < block_count:
+            # 链不够长 一次分配剩余所需的全部块接在链尾
+            extra = self.allocator.allocate(block_count - len(blocks))
+            if blocks:
+                self.fat.set(blocks[-1], extra[0])
+            for i, index in enumerate(extra):
+                self.fat.set(index, extra[i + 1] if i + 1 < len(extra) else FAT_END)
+            changed += range(len(blocks), block_count)
+            blocks += extra
+        elif cursor is not None and cursor != FAT_END:
+            # 链过长 截断并释放多余的块
+            if blocks:
+                self.fat.set(blocks[-1], FAT_END)
+            self.__free_chain(fcb, cursor)
 
-            cur_index = next_index
-            self.fat.table[cur_index] = FAT_END
+        fcb.start_address = blocks[0] if blocks else None
+        self.__write_blocks(blocks, data, changed)
+
+    # 挂载镜像时 保存先写数据块再提交超级块 原地改写上次提交的镜像仍引用的块会使提交前崩溃时上一代镜像读出新内容
+    # 因此把blocks中positions处这样的块换成新分配的块接回链中 旧块与其他释放的块一样延迟到下次保存后才可复用
+    # blocks为文件中连续的若干块 previous为blocks[0]的前一块 None表示blocks[0]是首块
+    # keep中的块只改写一部分 先复制原内容 返回是否换过块
+    def __redirect_committed(self, fcb: FCB, blocks, positions, previous=None, keep=()):
+        allocator = self.allocator
+        if allocator.committed is None:
+            return False
+        moving = [i for i in positions if allocator.is_committed(blocks[i])]
+        if not moving:
+            return False
+        with allocator.lock:
+            old = [blocks[i] for i in moving]
+            for i, index in zip(moving, allocator.allocate(len(moving))):
+                if i in keep:
+                    self.__write_block(index, self.__read_block(blocks[i]))
+                self.fat.set(index, self.fat.table[blocks[i]])
+                if i > 0:
+                    self.fat.set(blocks[i - 1], index)
+                elif previous is not None:
+                    self.fat.set(previous, index)
+                else:
+                    fcb.start_address = index
+                self.__unindex(blocks[i])
+                self.fat.set(blocks[i], FAT_FREE)
+                blocks[i] = index
+            allocator.release(old)
+            fcb.epoch += 1
+        return True
 
     def delete_file(self, fcb: FCB):
-        cursor = fcb.start_address
-        if cursor is not None:
-            while cursor != FAT_END:
-                self.disk[cursor] = ""
-                self.free_space.bitmap[cursor] = SPACE_FREE
+        with self.__operation(), ExitStack() as stack:
+            parent = fcb.parent
+            self.__check_alive(fcb)
+            self.__lock_write(stack, parent, fcb)
+            if fcb.parent is not parent:
+                raise FileNotFoundError(fcb.file_name)
+            path = self.path_of(fcb)
+            self.__delete_file(fcb)
+            self.__log("rm", path)
+            self.__notify("file_removed", parent, fcb)
+
+    # 释放fcb的链中从start开始的部分
+    def __free_chain(self, fcb: FCB, start):
+        # 块内容无需清零 读取时以FCB长度为准
+        # 遇到共用的块时只去掉一个引用 其后的块仍属于其他文件
+        with self.allocator.lock:
+            cursor = start
+            blocks = []
+            while cursor is not None and cursor != FAT_END:
+                if cursor in self.refs:
+                    self.__decref(cursor)
+                    break
+                blocks.append(cursor)
+                self.__unindex(cursor)
 
                 next_position = self.fat.table[cursor]
-                self.fat.table[cursor] = SPACE_FREE
+                self.fat.set(cursor, FAT_FREE)
 
                 cursor = next_position
+            self.allocator.release(blocks)
+            fcb.epoch += 1
+
+    def __incref(self, index):
+        self.refs[index] = self.refs.get(index, 1) + 1
+
+    def __decref(self, index):
+        if self.refs[index] == 2:
+            del self.refs[index]
+        else:
+            self.refs[index] -= 1
 
-        self.__delete_file_recursively(fcb, self.file_tree.root)
+    def __unindex(self, index):
+        key = self.block_keys.pop(index, None)
+        if key is not None:
+            del self.dedup_index[key]
 
-    def __delete_file_recursively(self, fcb: FCB, file_tree_node: FileTreeNode):
-        if fcb in file_tree_node.leaf_node_children:
-            file_tree_node.leaf_node_children.remove(fcb)
+    # 修改文件前调用 保证整条链只属于这个文件
+    # 私有部分移出去重索引 以免被其他文件共用 从第一个共用的块开始复制出一条新的链尾(写时复制)
+    def __unshare(self, fcb: FCB):
+        if not self.refs and not self.block_keys:
             return
+        with self.allocator.lock:
+            previous = None
+            cursor = fcb.start_address
+            while cursor is not None and cursor != FAT_END and cursor not in self.refs:
+                self.__unindex(cursor)
+                previous = cursor
+                cursor = self.fat.table[cursor]
+            if cursor is None or cursor == FAT_END:
+                return
+            shared = []
+            while cursor != FAT_END:
+                shared.append(cursor)
+                cursor = self.fat.table[cursor]
+            copies = self.allocator.allocate(len(shared))
+            for i, index in enumerate(copies):
+                self.__write_block(index, self.__read_block(shared[i]))
+                self.fat.set(index, copies[i + 1] if i + 1 < len(copies) else FAT_END)
+            # 首块从不共用 previous一定存在
+            self.fat.set(previous, copies[0])
+            self.__decref(shared[0])
+            fcb.epoch += 1
+
+    # 以去重方式写入整个文件 从链尾向前查找(内容, 下一块)相同的已有块
+    # 一旦某块未命中 其前面的块指向新块 不可能命中 于是剩余的块一次分配
+    def __write_dedup(self, fcb: FCB, data):
+        block_size = self.block_size
+        block_count = (len(data) + block_size - 1) // block_size
+        old_start = fcb.start_address
+        with self.allocator.lock, memoryview(data) as src:
+            next_index = FAT_END
+            reused = block_count
+            while reused > 1:
+                key = (bytes(src[(reused - 1) * block_size:reused * block_size]), next_index)
+                index = self.dedup_index.get(key)
+                if index is None:
+                    break
+                next_index = index
+                reused -= 1
+            self.dedup_hits += block_count - reused
+            if reused < block_count:
+                # 新块指向已有的链尾
+                self.__incref(next_index)
+            blocks = self.allocator.allocate(reused)
+            for i in range(reused - 1, -1, -1):
+                chunk = src[i * block_size:(i + 1) * block_size]
+                self.__write_block(blocks[i], chunk)
+                self.fat.set(blocks[i], next_index)
+                if i > 0:
+                    key = (bytes(chunk), next_index)
+                    self.dedup_index[key] = blocks[i]
+                    self.block_keys[blocks[i]] = key
+                next_index = blocks[i]
+            fcb.start_address = blocks[0] if blocks else None
+        # 新链建好后再释放旧链 旧链中被新链共用的部分只会减少引用
+        if old_start is not None:
+            self.__free_chain(fcb, old_start)
+
+    def __delete_file(self, fcb: FCB):
+        self.__preserve(fcb)
+        self.__free_chain(fcb, fcb.start_address)
+        fcb.start_address = None
+        fcb.length = 0
+
+        # 通过父结点指针直接删除
+        if fcb.parent is not None:
+            fcb.parent.remove_file(fcb)
+
+    # 开启按操作的性能统计 返回OperationStats 可导出为JSON 见file_system_stats
+    def enable_stats(self, profile=False, trace_memory=False):
+        if self.stats is None:
+            from file_system_stats import OperationStats
+            self.stats = OperationStats(self, profile, trace_memory)
+            self.stats.attach()
+        return self.stats
+
+    # 关闭统计 返回统计结果
+    def disable_stats(self):
+        stats, self.stats = self.stats, None
+        if stats is not None:
+            stats.close()
+        return stats
+
+    # 元数据索引 第一次使用时建立 之后由监听回调增量维护 见file_system_index
+    # 惰性模式下会载入全部文件夹并停止换出 否则换出后重新载入的结点不在索引中
+    def metadata_index(self):
+        if self.metadata is None:
+            from file_system_index import MetadataIndex
+            with self.__exclusive():
+                if self.metadata is None:
+                    if self.image is not None and self.image.lazy:
+                        self.image.load_all(self.file_tree.root)
+                    self.metadata = MetadataIndex(self)
+        return self.metadata
+
+    # 按文件名(可含通配符)/修改时间范围/所在子树查找文件
+    def find_files(self, name=None, modified_after=None, modified_before=None, under=None):
+        return self.metadata_index().find(name, modified_after, modified_before, under)
+
+    # 文件夹整棵子树的文件数/总字节数/最近修改时间 即du
+    def dir_stats(self, node: FileTreeNode):
+        self.metadata_index()
+        return {
+            "files": node.file_count,
+            "bytes": node.total_length,
+            "modified": decode_time(node.max_stamp) if node.max_stamp else None,
+        }
+
+    # 去重效果 logical为各文件链长之和 physical为实际占用的块数
+    def dedup_stats(self):
+        with self.volume_lock.read():
+            logical = 0
+            stack = [self.file_tree.root]
+            while stack:
+                node = stack.pop()
+                stack.extend(node.tree_node_children)
+                for fcb in node.leaf_node_children:
+                    logical += self.block_count(fcb)
+            physical = self.block_num - self.fat.table.count(FAT_FREE)
+            return {
+                "logical_blocks": logical,
+                "physical_blocks": physical,
+                "dedup_ratio": logical / physical if physical else 1.0,
+                "shared_blocks": len(self.refs),
+                "indexed_blocks": len(self.dedup_index),
+                "hits": self.dedup_hits,
+            }
+
+    # ---- 快照 ----
+    # 创建时只记下时间 之后的修改在改动前把原状态存入最新的快照 见file_system_snapshot
+    # 快照只保存在内存中 保存镜像时其专用的块记为空闲 重新载入后快照不再存在
+
+    def create_snapshot(self, name):
+        from file_system_snapshot import Snapshot
+        with self.__exclusive():
+            if any(snapshot.name == name for snapshot in self.snapshots):
+                raise FileExistsError(name)
+            snapshot = Snapshot(name, datetime.now())
+            self.snapshots.append(snapshot)
+            self.__track(snapshot)
+            if self.image is not None and self.image.lazy:
+                # 快照引用的结点换出后再载入会成为另一个对象 此后不再换出
+                self.image.resident_num = float("inf")
+            return snapshot
+
+    def list_snapshots(self):
+        with self.volume_lock.read():
+            return [snapshot.stats() for snapshot in self.snapshots]
+
+    def __snapshot_index(self, name):
+        for i, snapshot in enumerate(self.snapshots):
+            if snapshot.name == name:
+                return i
+        raise FileNotFoundError(name)
+
+    # 只属于快照的块 在bitmap中占用 在FAT中空闲
+    def snapshot_blocks(self):
+        owned = set()
+        for snapshot in self.snapshots:
+            owned |= snapshot.owned_blocks()
+        return owned
+
+    # 写入镜像的bitmap 快照专用的块记为空闲
+    def image_bitmap(self):
+        owned = self.snapshot_blocks()
+        if not owned:
+            return self.free_space.bitmap
+        bitmap = self.free_space.bitmap.copy()
+        for index in owned:
+            bitmap[index] = SPACE_FREE
+        return bitmap
+
+    # 删除快照 前一个快照仍需要的原状态交给它 其余专用的块释放
+    def delete_snapshot(self, name):
+        with self.__exclusive(), self.allocator.lock:
+            i = self.__snapshot_index(name)
+            snapshot = self.snapshots.pop(i)
+            blocks = snapshot.merge_into(self.snapshots[i - 1] if i > 0 else None)
+            self.__track(None)
+            self.allocator.release(blocks)
+            self.__track(self.snapshots[-1] if self.snapshots else None)
+
+    # 把整个卷恢复到快照时的状态 其后的快照一并删除 该快照保留 卷的大小不回退
+    # 目录树中的结点就地恢复 快照之后创建的结点脱离目录树 完成后通知("reset",)
+    def rollback(self, name):
+        with self.__exclusive(), self.allocator.lock:
+            i = self.__snapshot_index(name)
+            chain = self.snapshots[i:]
+            del self.snapshots[i:]
+            self.__track(None)
+            # 较早的快照保存的原状态优先
+            nodes, fat, moved = {}, {}, {}
+            for snapshot in reversed(chain):
+                nodes.update(snapshot.nodes)
+                fat.update(snapshot.fat)
+                moved.update(snapshot.moved)
+            fresh = set().union(*(snapshot.fresh for snapshot in chain))
+            held = set().union(*(snapshot.held for snapshot in chain))
+
+            removed = []
+            for node, record in nodes.items():
+                if isinstance(node, FCB):
+                    (node.file_name, node.modify_stamp, node.length, node.start_address,
+                     node.compression, node.frames) = record
+                    continue
+                name_, stamp, dirs, files = record
+                kept = set(dirs.values()) | set(files.values())
+                removed += [child for child in node.tree_node_children + node.leaf_node_children
+                            if child not in kept]
+                node.dir_name = name_
+                node.modify_stamp = stamp
+                node.dir_index = dict(dirs)
+                node.file_index = dict(files)
+                for child in kept:
+                    child.parent = node
+            # 快照之后创建的结点连同子树脱离目录树
+            while removed:
+                child = removed.pop()
+                child.parent = None
+                if isinstance(child, FileTreeNode):
+                    removed += child.tree_node_children + child.leaf_node_children
+
+            # 快照之后分配的块在快照时都是空闲的
+            for index, value in fat.items():
+                if index not in fresh:
+                    self.fat.set(index, value)
+            # 原内容原地写回 挂载镜像时这些块可能已被保存 回滚后应尽快保存 开启日志时即刻写检查点
+            for index, copy in moved.items():
+                if index not in fresh:
+                    self.__write_block(index, self.__read_block(copy))
+            # 同一块可能在多个快照中各有副本 全部释放
+            free = fresh.union(*(snapshot.moved.values() for snapshot in chain))
+            for index in free:
+                if self.fat.table[index] != FAT_FREE:
+                    self.fat.set(index, FAT_FREE)
+            # 留给快照的块重新属于文件
+            # 快照时已延迟释放、之后保存时才真正释放的块也被留下 它们在恢复的FAT中空闲 一并释放
+            for index in held - fresh:
+                if self.fat.table[index] == FAT_FREE:
+                    free.add(index)
+                else:
+                    self.free_space.mark_dirty(index)
+            self.allocator.release(sorted(free))
+
+            from file_system_snapshot import Snapshot
+            self.snapshots.append(Snapshot(chain[0].name, chain[0].time))
+            self.__track(self.snapshots[-1])
+            self.refs = count_refs(self.fat.table)
+            self.dedup_index.clear()
+            self.block_keys.clear()
+            self.chain_epoch += 1
+            if self.image is not None:
+                self.image.forget()
+            self.__notify("reset")
+            if self.journal is not None:
+                # 恢复不写日志 直接写检查点
+                self.checkpoint()
+
+    # 比较两个快照 new为None时与当前状态比较 只访问两者之间被修改过的路径
+    # 返回[(变化, 路径)] 变化为added/removed/modified 重命名为("renamed", 原路径, 新路径)
+    def diff_snapshots(self, old, new=None):
+        from collections import ChainMap
+        from file_system_snapshot import SnapshotView, diff_views
+        with self.__exclusive():
+            i = self.__snapshot_index(old)
+            j = len(self.snapshots) if new is None else self.__snapshot_index(new)
+            if j < i:
+                raise ValueError("snapshot %s is older than %s" % (new, old))
+            changed = ChainMap(*(snapshot.nodes for snapshot in self.snapshots[i:j]))
+            return diff_views(SnapshotView(self, self.snapshots[i:]), SnapshotView(self, self.snapshots[j:]), changed)
+
+    # 读取快照中的文件 返回bytearray
+    def read_snapshot_file(self, name, path):
+        from file_system_snapshot import SnapshotView
+        with self.__exclusive():
+            view = SnapshotView(self, self.snapshots[self.__snapshot_index(name):])
+            fcb = view.resolve(path)
+            if not isinstance(fcb, FCB):
+                raise FileNotFoundError(path)
+            _, _, length, start, compression, frames = view.record(fcb)
+            block_size = self.block_size
+            if compression:
+                count = sum((size + block_size - 1) // block_size for size in frames)
+            else:
+                count = (length + block_size - 1) // block_size
+            stored = bytearray()
+            for index in view.blocks(start, count):
+                stored += self.__read_block(index)
+            if compression:
+                return self.__decompress(stored, compression, frames)
+            del stored[length:]
+            return stored
+
+    # 返回文件占用的全部块号
+    def chain_of(self, fcb: FCB):
+        blocks = []
+        cursor = fcb.start_address
+        while cursor is not None and cursor != FAT_END:
+            blocks.append(cursor)
+            cursor = self.fat.table[cursor]
+        return blocks
+
+    # 将文件整条链搬到一段连续的空闲区间 内容不变 不写日志
+    # 已连续的文件只在能搬到更靠前的位置时才移动 用于压缩 成功返回True
+    def relocate_file(self, fcb: FCB):
+        with self.__operation(), self.file_locks[fcb].write():
+            self.__check_alive(fcb)
+            blocks = self.chain_of(fcb)
+            count = len(blocks)
+            # 含共用块的链不搬动 否则会复制出多份相同的内容
+            if count == 0 or any(index in self.refs for index in blocks):
+                return False
+            self.__preserve(fcb)
+            contiguous = blocks == list(range(blocks[0], blocks[0] + count))
+            start = self.allocator.allocate_run(count, blocks[0] if contiguous else None)
+            if start is None:
+                return False
+            for i, index in enumerate(blocks):
+                self.__write_block(start + i, self.__read_block(index))
+                self.fat.set(start + i, start + i + 1 if i + 1 < count else FAT_END)
+            fcb.start_address = start
+            self.__free_chain(fcb, blocks[0])
+            return True
+
+    # 按路径打开文件 返回FileHandle
+    # mode: "r"只读 "r+"读写 "w"截断为空(不存在则创建) "a"追加(不存在则创建)
+    def open(self, path, mode="r"):
+        if mode not in FileHandle.MODES:
+            raise ValueError("invalid mode: %r" % (mode,))
+        fcb = self.resolve(path)
+        if fcb is None and mode in ("w", "a"):
+            parent_path, _, name = path.rstrip("/").rpartition("/")
+            parent = self.resolve(parent_path)
+            if isinstance(parent, FileTreeNode):
+                # 其他线程可能同时创建了同名文件
+                fcb = self.create_file(name, parent) or parent.file_index.get(name)
+        if not isinstance(fcb, FCB):
+            raise FileNotFoundError(path)
+        return FileHandle(self, fcb, mode)
+
+    # 文件第k块的块号 沿句柄缓存的链继续向后走 顺序访问每块只需O(1)
+    # 只有这个文件的链变化(或整卷的FAT被替换)时才丢弃缓存 其他文件的修改不影响
+    def __block_of(self, fcb: FCB, k, handle):
+        epoch = (self.chain_epoch, fcb.epoch)
+        if handle.epoch != epoch or (handle.chain and handle.chain[0] != fcb.start_address):
+            handle.chain = []
+            handle.epoch = epoch
+        chain = handle.chain
+        if not chain:
+            chain.append(fcb.start_address)
+        while len(chain) <= k:
+            chain.append(self.fat.table[chain[-1]])
+        return chain[k]
+
+    def __read_block(self, index):
+        if self.stats is not None:
+            self.stats.blocks_read += 1
+        if self.cache is not None:
+            return self.cache.read_block(index)
+        return self.disk.read_block(index)
+
+    def __write_block(self, index, data, offset=0):
+        if self.__snapshot is not None:
+            self.__preserve_block(index)
+        if self.stats is not None:
+            self.stats.blocks_written += 1
+        if self.cache is not None:
+            self.cache.write_block(index, data, offset)
+        else:
+            self.disk.write_block(index, data, offset)
+
+    # 读取[offset, offset + size)范围内的数据 只访问涉及的块
+    def pread(self, fcb: FCB, offset, size=-1, handle=None):
+        with self.__operation(), self.file_locks[fcb].read():
+            self.__check_alive(fcb)
+            handle = handle or FileHandle(self, fcb)
+            end = fcb.length if size < 0 else min(fcb.length, offset + size)
+            if offset >= end:
+                return b""
+            if fcb.compression:
+                return self.__pread_frames(fcb, offset, end, handle)
+            block_size = self.block_size
+            data = bytearray(end - offset)
+            pos = offset
+            k = offset // block_size
+            while pos < end:
+                inner = pos - k * block_size
+                n = min(block_size - inner, end - pos)
+                data[pos - offset:pos - offset + n] = self.__read_block(self.__block_of(fcb, k, handle))[inner:inner + n]
+                pos += n
+                k += 1
+            return bytes(data)
+
+    # 压缩文件的随机读取 只解压[offset, end)涉及的帧
+    def __pread_frames(self, fcb: FCB, offset, end, handle):
+        data = bytearray(end - offset)
+        pos = offset
+        while pos < end:
+            i = pos // FRAME_SIZE
+            frame = self.__read_frame(fcb, i, handle)
+            inner = pos - i * FRAME_SIZE
+            n = min(len(frame) - inner, end - pos)
+            data[pos - offset:pos - offset + n] = frame[inner:inner + n]
+            pos += n
+        return bytes(data)
+
+    # 解压第i帧 句柄缓存最近解压的一帧 顺序小块读取时每帧只解压一次
+    def __read_frame(self, fcb: FCB, i, handle):
+        # 每次写入都会生成新的frames 以此判断缓存是否过期
+        if handle.frame is not None and handle.frame[0] is fcb.frames and handle.frame[1] == i:
+            return handle.frame[2]
+        block_size = self.block_size
+        k = sum((size + block_size - 1) // block_size for size in fcb.frames[:i])
+        size = fcb.frames[i]
+        stored = bytearray()
+        for j in range((size + block_size - 1) // block_size):
+            stored += self.__read_block(self.__block_of(fcb, k + j, handle))
+        frame = COMPRESSORS[fcb.compression][1](bytes(stored[:size]))
+        handle.frame = (fcb.frames, i, frame)
+        return frame
+
+    # 按块读取文件的生成器
+    def read_chunks(self, fcb: FCB, chunk_size=None):
+        handle = FileHandle(self, fcb)
+        chunk_size = chunk_size or self.block_size
+        offset = 0
+        while offset < fcb.length:
+            data = self.pread(fcb, offset, chunk_size, handle)
+            offset += len(data)
+            yield data
+
+    # 保证文件至少有count块 新块接在链尾
+    def __ensure_blocks(self, fcb: FCB, count, handle):
+        block_size = self.block_size
+        current = (fcb.length + block_size - 1) // block_size
+        if count <= current:
+            return
+        blocks = self.allocator.allocate(count - current)
+        for i, index in enumerate(blocks):
+            self.fat.set(index, blocks[i + 1] if i + 1 < len(blocks) else FAT_END)
+        if current == 0:
+            fcb.start_address = blocks[0]
+            handle.chain = list(blocks)
+            handle.epoch = (self.chain_epoch, fcb.epoch)
         else:
-            for node in file_tree_node.tree_node_children:
-                self.__delete_file_recursively(fcb, node)
+            self.fat.set(self.__block_of(fcb, current - 1, handle), blocks[0])
+            handle.chain.extend(blocks)
+
+    def __pwrite(self, fcb: FCB, offset, data, handle):
+        if offset > fcb.length:
+            # 写入位置超过文件末尾时 中间补零
+            self.__pwrite(fcb, fcb.length, bytes(offset - fcb.length), handle)
+        block_size = self.block_size
+        end = offset + len(data)
+        self.__ensure_blocks(fcb, (end + block_size - 1) // block_size, handle)
+        if self.allocator.committed is not None and end > offset:
+            first = offset // block_size
+            blocks = [self.__block_of(fcb, k, handle) for k in range(first, (end - 1) // block_size + 1)]
+            # 块中写入范围之外还有有效内容时保留原内容
+            keep = [k - first for k in range(first, first + len(blocks)) if k * block_size < fcb.length
+                    and (k * block_size < offset or min((k + 1) * block_size, fcb.length) > end)]
+            previous = self.__block_of(fcb, first - 1, handle) if first else None
+            if self.__redirect_committed(fcb, blocks, range(len(blocks)), previous, keep):
+                handle.chain[first:first + len(blocks)] = blocks
+                handle.epoch = (self.chain_epoch, fcb.epoch)
+        with memoryview(data) as src:
+            pos = offset
+            k = offset // block_size
+            while pos < end:
+                inner = pos - k * block_size
+                n = min(block_size - inner, end - pos)
+                self.__write_block(self.__block_of(fcb, k, handle), src[pos - offset:pos - offset + n], inner)
+                pos += n
+                k += 1
+        fcb.length = max(fcb.length, end)
+        fcb.modify_time = self.__now()
+
+    # 从offset处写入data 只改写涉及的块 必要时在链尾追加新块
+    def pwrite(self, fcb: FCB, offset, data, handle=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self.__operation(), self.file_locks[fcb].write():
+            self.__check_alive(fcb)
+            self.__preserve(fcb)
+            if fcb.compression:
+                self.__rewrite_compressed(fcb, offset, data)
+            else:
+                self.__unshare(fcb)
+                self.__pwrite(fcb, offset, data, handle or FileHandle(self, fcb))
+            self.__log("pwrite", self.path_of(fcb), offset, bytes(data).decode("latin-1"), time=fcb.modify_time)
+            self.__notify("file_changed", fcb)
+            return len(data)
+
+    # 压缩文件不能原地改写 解压后修改 再整体重新压缩 未变化的块不会重写
+    # size不为None时先截断或补零到size字节
+    def __rewrite_compressed(self, fcb: FCB, offset, data, size=None):
+        content = self.__read_all(fcb)
+        if size is not None:
+            del content[size:]
+        end = max(offset, len(content) if size is None else size)
+        content += bytes(end - len(content))
+        content[offset:offset + len(data)] = data
+        self.__store(fcb, content, fcb.compression)
+        fcb.length = len(content)
+        fcb.modify_time = self.__now()
+
+    def append_file(self, fcb: FCB, data, handle=None):
+        return self.pwrite(fcb, fcb.length, data, handle)
+
+    # 将文件截断或补零到size字节 截断时释放多余的块
+    def truncate_file(self, fcb: FCB, size, handle=None):
+        with self.__operation(), self.file_locks[fcb].write():
+            self.__check_alive(fcb)
+            self.__preserve(fcb)
+            handle = handle or FileHandle(self, fcb)
+            if fcb.compression:
+                if size != fcb.length:
+                    self.__rewrite_compressed(fcb, size, b"", size)
+            elif size > fcb.length:
+                self.__unshare(fcb)
+                self.__pwrite(fcb, fcb.length, bytes(size - fcb.length), handle)
+            elif size < fcb.length:
+                self.__unshare(fcb)
+                keep = (size + self.block_size - 1) // self.block_size
+                if keep == 0:
+                    self.__free_chain(fcb, fcb.start_address)
+                    fcb.start_address = None
+                else:
+                    last = self.__block_of(fcb, keep - 1, handle)
+                    tail = self.fat.table[last]
+                    self.fat.set(last, FAT_END)
+                    if tail != FAT_END:
+                        self.__free_chain(fcb, tail)
+                fcb.length = size
+                fcb.modify_time = self.__now()
+            self.__log("truncate", self.path_of(fcb), size, time=fcb.modify_time)
+            self.__notify("file_changed", fcb)
+
     # 格式化
     def format(self):
-        print("formatting..")
-        self.file_tree.root.tree_node_children = []
-        self.file_tree.root.leaf_node_children = []
-        self.free_space = FreeSpace()
-        self.disk = Disk()
-        self.fat = FAT()
+        with self.__exclusive():
+            print("formatting..")
+            self.__preserve(self.file_tree.root)
+            # 所有结点脱离目录树 其他线程或碎片整理手中的旧结点随之失效
+            # 快照中保存每个文件夹 回滚时据此重新接回整棵树
+            stack = [self.file_tree.root]
+            while stack:
+                node = stack.pop()
+                for child in node.tree_node_children + node.leaf_node_children:
+                    if isinstance(child, FileTreeNode):
+                        self.__preserve(child)
+                        stack.append(child)
+                    child.parent = None
+            self.file_tree.root.dir_index = {}
+            self.file_tree.root.file_index = {}
+            if self.__snapshot is not None:
+                self.__snapshot.preserve_table(self.fat.table, FAT_FREE)
+            # 已占用的块统一交给分配器释放 挂载镜像时会延迟到下次保存 快照专用的块除外
+            owned = self.snapshot_blocks()
+            self.allocator.release([index for index in self.free_space.bitmap.search(SPACE_OCCUPY) if index not in owned])
+            self.fat = FAT(self.block_num)
+            self.fat.snapshot = self.__snapshot
+            if self.cache is not None:
+                self.cache.fat = self.fat
+            self.refs.clear()
+            self.dedup_index.clear()
+            self.block_keys.clear()
+            self.chain_epoch += 1
+            self.__log("format")
+            self.__notify("reset")
+
+    # 在线扩容 在磁盘末尾追加extra_num个空闲块
+    def grow(self, extra_num):
+        with self.__exclusive():
+            self.fat.grow(extra_num)
+            self.disk.grow(extra_num)
+            self.free_space.grow(extra_num)
+            self.allocator.grow(extra_num)
+            self.block_num += extra_num
+            self.__log("grow", extra_num)
 
+    # 保存到镜像文件 同一镜像只写回上次保存后修改过的部分
     def save(self, system_info_file: str):
-        # save all data in local position
-        print("saving")
-        with open(system_info_file, "wb") as f:
-            pickle.dump(self.file_tree, f)
-            pickle.dump(self.free_space, f)
-            pickle.dump(self.disk, f)
-            pickle.dump(self.fat, f)
+        from file_system_image import ImageFile
+        with self.__exclusive():
+            print("saving")
+            if self.cache is not None:
+                self.cache.flush()
+            if self.image is None or self.image.path != system_info_file:
+                if self.image is not None and self.image.lazy:
+                    self.image.load_all(self.file_tree.root)
+                self.image = ImageFile(system_info_file)
+            self.image.save(self)
+            self.allocator.defer = True
+            self.allocator.committed = self.image_bitmap().copy()
+            if self.journal is not None:
+                # 镜像已包含日志中的全部操作
+                self.journal.reset(self.image.super["generation"])
+                self.__checkpoint_due = False
+
+    # 检查点 将日志中的操作写入镜像并清空日志
+    def checkpoint(self):
+        self.save(self.image.path)
+
+    # 将缓存的日志记录落盘
+    def sync(self):
+        with self.journal_lock:
+            if self.journal is not None:
+                self.journal.commit()
+
+    def close(self):
+        with self.__exclusive(), self.journal_lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+
+    # 用线程池并行执行一批互不依赖的操作 operations为(方法名, 参数...)元组
+    # 按原顺序返回各操作的结果 任一操作抛出的异常在此重新抛出
+    def run_batch(self, operations, max_workers=None):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers) as pool:
+            futures = [pool.submit(getattr(self, name), *args) for name, *args in operations]
+            return [future.result() for future in futures]
@@ -0,0 +1,105 @@
+import time
+
+from file_system_components import FCB, SPACE_FREE, SPACE_OCCUPY, FileSystem
+
+TIME_SLICE = 0.005  # 每次step最多占用的秒数
+
+
+# 统计碎片情况
+#   extents: 全部文件的连续段总数 文件连续时每个文件只有一段
+#   fragmented_files: 多于一段的文件数
+#   free_extents/largest_free: 空闲区间数与最大空闲区间长度
+def fragmentation(fs: FileSystem):
+    files = fragmented = extents = used = 0
+    stack = [fs.file_tree.root]
+    while stack:
+        node = stack.pop()
+        stack.extend(node.tree_node_children)
+        for fcb in node.leaf_node_children:
+            blocks = fs.chain_of(fcb)
+            if not blocks:
+                continue
+            runs = 1 + sum(1 for a, b in zip(blocks, blocks[1:]) if b != a + 1)
+            files += 1
+            used += len(blocks)
+            extents += runs
+            fragmented += runs > 1
+
+    bitmap = fs.free_space.bitmap
+    free_extents = largest_free = 0
+    pos = bitmap.find(SPACE_FREE)
+    while pos != -1:
+        end = bitmap.find(SPACE_OCCUPY, pos)
+        if end == -1:
+            end = len(bitmap)
+        free_extents += 1
+        largest_free = max(largest_free, end - pos)
+        pos = bitmap.find(SPACE_FREE, end)
+    return {
+        "files": files,
+        "fragmented_files": fragmented,
+        "extents": extents,
+        "blocks": used,
+        # 0表示所有文件都连续
+        "fragmentation": (extents - files) / max(used - files, 1),
+        "free_extents": free_extents,
+        "largest_free": largest_free,
+    }
+
+
+# 增量碎片整理 按起始块从前到后逐个搬动文件
+# 碎片化的文件搬到第一段足够长的空闲区间 连续的文件能前移时也前移 使空闲空间向磁盘末尾集中
+# 先搬走的文件不会再前移 一遍整理后仍可能留有空洞 可再运行一遍
+# 每次step只运行一个时间片 可由UI定时器反复调用而不阻塞界面
+# 挂载镜像时被搬走的旧块在下次保存后才释放 整理后应保存一次
+# 只记下文件的路径 处理时再查找 惰性模式下文件夹被换出后原有的FCB不再属于目录树
+class Defragmenter:
+    def __init__(self, fs: FileSystem):
+        self.fs = fs
+        self.before = fragmentation(fs)
+        self.after = None
+        self.moved = 0
+        self.skipped = 0
+        files = []
+        stack = [("", fs.file_tree.root)]
+        while stack:
+            path, node = stack.pop()
+            stack.extend((path + "/" + child.dir_name, child) for child in node.tree_node_children)
+            files.extend((fcb.start_address, path + "/" + fcb.file_name)
+                         for fcb in node.leaf_node_children if fcb.start_address is not None)
+        files.sort(reverse=True)
+        self.pending = files  # 从末尾取出 即起始块最小的先处理
+
+    def done(self):
+        return not self.pending
+
+    # 运行一个时间片 全部完成时返回True
+    def step(self, time_slice=TIME_SLICE):
+        deadline = time.perf_counter() + time_slice
+        while self.pending:
+            _, path = self.pending.pop()
+            fcb = self.fs.resolve(path)
+            if not isinstance(fcb, FCB):
+                # 整理期间文件已被删除或改名
+                continue
+            try:
+                if self.fs.relocate_file(fcb):
+                    self.moved += 1
+                else:
+                    self.skipped += 1
+            except FileNotFoundError:
+                # 整理期间文件已被删除
+                pass
+            if time.perf_counter() >= deadline:
+                break
+        if not self.pending and self.after is None:
+            self.after = fragmentation(self.fs)
+        return self.done()
+
+    def run(self):
+        while not self.step():
+            pass
+        return self.report()
+
+    def report(self):
+        return {"before": self.before, "after": self.after, "moved": self.moved, "skipped": self.skipped}
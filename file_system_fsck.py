@@ -0,0 +1,157 @@
+from array import array
+
+from bitarray import bitarray
+
+from file_system_components import FAT_END, FAT_FREE, FRAME_SIZE, SPACE_OCCUPY, FileSystem, count_refs
+
+# 一致性检查
+#
+# 1. 沿每个FCB的链走一遍 记录每块的归属(owned) 同时发现
+#    交叉链接(块已属于其他文件) 环(块已属于本文件) 非法指针(越界或指向空闲块) 长度不符
+#    去重共用的链尾(从FAT中有多个表项指向的块开始)不算交叉链接 但仍按长度走完 以免越界或成环
+# 2. 由FAT得到FAT认为在用的块 与owned按位比较得到孤立块
+# 3. 期望的bitmap = owned | 延迟释放的块 | 快照专用的块 与实际bitmap按位异或得到不一致的块
+# 4. 按FAT重新统计的引用计数与fs.refs比较
+# 第2/3步没有逐项的Python循环 见_fat_used 第1步沿链逐块走 是主要的耗时 整个检查对块数为线性
+#
+# repair=True时就地修复: 出错的链在出错处截断 长度改为链的实际容量(压缩文件保留完整的帧)
+#   多余的块与孤立块释放 bitmap与引用计数重建 修复前删除全部快照
+
+
+# FAT_FREE按本机字节序的各字节 _DIFFER[i]把表项第i个字节映射为 与FAT_FREE的第i个字节不同时非0
+_FREE_BYTES = array("i", [FAT_FREE]).tobytes()
+_DIFFER = [bytes(byte != value for byte in range(256)) for value in _FREE_BYTES]
+
+
+# FAT中不为FAT_FREE的表项 按字节位置分别取出、translate、pack成bitarray后按位或 均在C层完成
+def _fat_used(table):
+    raw = table.tobytes()
+    size = table.itemsize
+    used = bitarray()
+    used.pack(raw[0::size].translate(_DIFFER[0]))
+    for i in range(1, size):
+        differ = bitarray()
+        differ.pack(raw[i::size].translate(_DIFFER[i]))
+        used |= differ
+    return used
+
+
+def _walk(fs: FileSystem):
+    root = fs.file_tree.root
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        stack.extend(node.tree_node_children)
+        yield from node.leaf_node_children
+
+
+def fsck(fs: FileSystem, repair=False):
+    with fs.volume_lock.write():
+        # 修复直接改动FCB与FAT 快照无法记录
+        while repair and fs.snapshots:
+            fs.delete_snapshot(fs.snapshots[0].name)
+        return _check(fs, repair)
+
+
+def _check(fs: FileSystem, repair):
+    table = fs.fat.table
+    block_num = fs.block_num
+    block_size = fs.block_size
+    owned = bitarray(block_num)
+    owned.setall(0)
+    report = {
+        "files": 0,
+        "cross_linked": [],
+        "cycles": [],
+        "bad_pointers": [],
+        "length_mismatch": [],
+        "orphan_blocks": 0,
+        "bitmap_mismatch": 0,
+        "disk_size_ok": len(fs.disk.buffer) >= block_num * block_size,
+    }
+    # 引用计数以FAT为准
+    refs = count_refs(table)
+    report["refs_mismatch"] = len(set(refs.items()) ^ set(fs.refs.items()))
+
+    for fcb in _walk(fs):
+        report["files"] += 1
+        need = fs.block_count(fcb)
+        chain = []
+        cursor = fcb.start_address
+        error = None
+        shared = False
+        while cursor is not None and cursor != FAT_END and len(chain) < need:
+            shared = shared or cursor in refs
+            if not 0 <= cursor < block_num or table[cursor] == FAT_FREE:
+                error = "bad_pointers"
+            elif owned[cursor]:
+                if cursor in chain:
+                    error = "cycles"
+                elif not shared:
+                    error = "cross_linked"
+            if error is not None:
+                report[error].append(fs.path_of(fcb))
+                break
+            owned[cursor] = 1
+            chain.append(cursor)
+            cursor = table[cursor]
+
+        # 链尾之后仍有块 说明链比长度长 多余的块留作孤立块
+        too_long = error is None and cursor is not None and cursor != FAT_END
+        if error is None and (len(chain) < need or too_long):
+            report["length_mismatch"].append(fs.path_of(fcb))
+        if not repair:
+            continue
+        if len(chain) < need and fcb.compression:
+            # 压缩文件只保留完整的帧 其后的块留作孤立块
+            frames = []
+            kept = 0
+            for size in fcb.frames:
+                count = (size + block_size - 1) // block_size
+                if kept + count > len(chain):
+                    break
+                frames.append(size)
+                kept += count
+            for index in chain[kept:]:
+                owned[index] = 0
+            del chain[kept:]
+            fcb.frames = tuple(frames)
+            fcb.length = min(fcb.length, len(frames) * FRAME_SIZE)
+        elif len(chain) < need:
+            fcb.length = len(chain) * block_size
+        if chain and table[chain[-1]] != FAT_END:
+            fs.fat.set(chain[-1], FAT_END)
+        fcb.start_address = chain[0] if chain else None
+
+    # FAT中在用但不属于任何文件的块
+    fat_used = _fat_used(table)
+    orphans = fat_used & ~owned
+    report["orphan_blocks"] = orphans.count()
+
+    expected = owned.copy()
+    for index in fs.allocator.deferred:
+        expected[index] = SPACE_OCCUPY
+    for index in fs.snapshot_blocks():
+        expected[index] = SPACE_OCCUPY
+    diff = fs.free_space.bitmap ^ expected
+    report["bitmap_mismatch"] = diff.count()
+
+    if repair:
+        for index in orphans.search(1):
+            fs.fat.set(index, FAT_FREE)
+        for index in diff.search(1):
+            fs.free_space.mark_dirty(index)
+        fs.free_space.bitmap[:] = expected
+        fs.allocator.free_num = expected.count(0)
+        # 链可能被截断 去重索引不再可信
+        fs.refs = count_refs(table)
+        fs.dedup_index.clear()
+        fs.block_keys.clear()
+        fs.chain_epoch += 1
+        # FCB未经FileSystem修改 镜像需重新编码整棵树
+        if fs.image is not None:
+            fs.image.forget()
+    report["errors"] = sum(len(report[key]) for key in ("cross_linked", "cycles", "bad_pointers", "length_mismatch")) \
+        + report["orphan_blocks"] + report["bitmap_mismatch"] + report["refs_mismatch"] + (not report["disk_size_ok"])
+    report["repaired"] = repair and report["errors"] > 0
+    return report
@@ -0,0 +1,591 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import weakref
+import zlib
+from array import array
+from collections import OrderedDict
+
+from bitarray import bitarray
+
+from file_system_components import FCB, FAT, Disk, FreeSpace, FileTree, FileTreeNode, GROUP_BLOCKS
+
+# 镜像文件格式
+#
+#   | 超级块0 | 超级块1 | FAT副本0 | FAT副本1 | bitmap副本0 | bitmap副本1 | 数据区 | 元数据副本0 | 元数据副本1 |
+#
+# FAT/bitmap/元数据各有两份 第generation次保存写入副本generation % 2 最后写入同号的超级块
+# 超级块带校验和 读取时取校验通过且generation最大的一份 因此保存中途崩溃时仍能读到上一次的完整镜像
+# 数据区只有一份 已提交镜像引用的块在下次提交前不会被复用(见Allocator.defer) 所以可以原地写入
+
+MAGIC = b"FSIMAGE\0"
+VERSION = 2
+
+PAGE_SIZE = 4096
+SUPER_SIZE = PAGE_SIZE
+SUPER_FORMAT = "<8sIQIQQQQQQQQQQ"
+SUPER_FIELDS = ("magic", "version", "generation", "block_size", "block_num",
+                "fat_offset", "fat_span", "bitmap_offset", "bitmap_span",
+                "data_offset", "meta_offset", "meta_capacity", "meta_len", "root_offset")
+
+RESIDENT_NUM = 1024  # 惰性模式下常驻内存的文件夹数上限
+
+
+def is_image(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _align(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+
+# 元数据区由文件夹记录组成 每条记录为 4字节长度 + 4字节子树跨度 + JSON
+# 记录按后序排列 子文件夹在父文件夹之前 根目录为最后一条
+# 子树跨度为该文件夹全部后代记录的字节数 即子树占据[记录偏移 - 跨度, 记录结尾)
+# 子文件夹以相对父记录的偏移引用 因此任一子树的记录连续且与位置无关 可以整段拷贝
+RECORD_HEADER = "<II"
+
+
+# 压缩文件在末尾追加 算法名与每帧压缩后的字节数
+def encode_fcb(fcb: FCB):
+    entry = [fcb.file_name, fcb.create_stamp, fcb.modify_stamp, fcb.length,
+             -1 if fcb.start_address is None else fcb.start_address]
+    if fcb.compression:
+        entry += [fcb.compression, list(fcb.frames)]
+    return entry
+
+
+def decode_fcb(entry):
+    name, create_time, modify_time, length, start_address = entry[:5]
+    fcb = FCB(name, create_time, length, None if start_address == -1 else start_address)
+    fcb.modify_stamp = modify_time
+    if len(entry) > 5:
+        fcb.compression = entry[5]
+        fcb.frames = tuple(entry[6])
+    return fcb
+
+
+def encode_dir_record(record, span):
+    data = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return struct.pack(RECORD_HEADER, len(data), span) + data
+
+
+def read_record_header(buffer, offset):
+    return struct.unpack_from(RECORD_HEADER, buffer, offset)
+
+
+def decode_dir_record(buffer, offset):
+    length, span = read_record_header(buffer, offset)
+    start = offset + struct.calcsize(RECORD_HEADER)
+    return json.loads(bytes(buffer[start:start + length]).decode("utf-8"))
+
+
+# 记录中与位置无关的部分 用于判断文件夹在载入后是否被修改
+def logical_record(record):
+    return {"n": record["n"], "c": record["c"], "m": record["m"], "f": record["f"],
+            "d": [entry[:3] for entry in record["d"]]}
+
+
+# 按当前内存中的结点生成记录 子文件夹位置由调用者补全
+def _node_record(node: FileTreeNode):
+    return {
+        "n": node.dir_name,
+        "c": node.create_stamp,
+        "m": node.modify_stamp,
+        "f": [encode_fcb(fcb) for fcb in node.leaf_node_children],
+        "d": [[child.dir_name, child.create_stamp, child.modify_stamp] for child in node.tree_node_children],
+    }
+
+
+# 将buffer中记录位于offset的整棵子树拷贝到out末尾 返回(新记录偏移, 记录长度, 子树跨度)
+def copy_subtree(buffer, offset, out):
+    length, span = read_record_header(buffer, offset)
+    length += struct.calcsize(RECORD_HEADER)
+    new_offset = len(out) + span
+    out += buffer[offset - span:offset + length]
+    return new_offset, length, span
+
+
+# 序列化整棵目录树 返回(元数据, 根记录偏移, [(惰性结点, 新偏移, 逻辑记录)])
+# 未载入的惰性文件夹不展开 直接从其所在镜像整段拷贝子树记录
+# previous为(上次写入的元数据, 其中根记录的偏移, 文件夹 -> 相对父记录的偏移, 此后修改过的文件夹)
+# 给出时未修改的子树同样从上次的元数据整段拷贝 只重新编码修改过的文件夹 即它们到根的路径
+# rels不为None时记下本次重新编码的文件夹中各子文件夹的相对偏移 拷贝的子树内部的相对偏移不变
+def encode_tree(root: FileTreeNode, previous=None, rels=None):
+    out = bytearray()
+    placed = {}  # id(node) -> (记录偏移, 记录长度, 子树起始)
+    positions = []
+    buffer, root_offset, old_rels, dirty = previous or (None, None, {}, ())
+    stack = [(root, False, root_offset)]
+    while stack:
+        node, visited, old_offset = stack.pop()
+        if isinstance(node, LazyFileTreeNode) and not node.loaded:
+            offset, length, span = node.image.copy_subtree(node, out)
+            placed[id(node)] = (offset, length, offset - span)
+            positions.append((node, offset, None))
+            continue
+        if not visited and old_offset is not None and node not in dirty:
+            offset, length, span = copy_subtree(buffer, old_offset, out)
+            placed[id(node)] = (offset, length, offset - span)
+            continue
+        if not visited:
+            stack.append((node, True, old_offset))
+            for child in reversed(node.tree_node_children):
+                rel = old_rels.get(child) if old_offset is not None else None
+                stack.append((child, False, None if rel is None else old_offset - rel))
+            continue
+        offset = len(out)
+        record = _node_record(node)
+        subtree_start = offset
+        for entry, child in zip(record["d"], node.tree_node_children):
+            child_offset, child_len, child_start = placed.pop(id(child))
+            subtree_start = min(subtree_start, child_start)
+            entry.extend([offset - child_offset, child_len])
+            if rels is not None:
+                rels[child] = offset - child_offset
+        data = encode_dir_record(record, offset - subtree_start)
+        out += data
+        placed[id(node)] = (offset, len(data), subtree_start)
+        if isinstance(node, LazyFileTreeNode):
+            positions.append((node, offset, logical_record(record)))
+    return out, placed[id(root)][0], positions
+
+
+# rels不为None时记下各子文件夹相对父记录的偏移 供下次encode_tree拷贝未修改的子树
+def decode_tree(buffer, root_offset, rels=None):
+    record = decode_dir_record(buffer, root_offset)
+    root = FileTreeNode(record["n"], record["c"])
+    root.modify_stamp = record["m"]
+    stack = [(root, root_offset, record)]
+    while stack:
+        node, offset, record = stack.pop()
+        for entry in record["f"]:
+            node.add_file(decode_fcb(entry))
+        # 子文件夹的名称和时间以父记录中的为准
+        for name, create_time, modify_time, rel, _ in record["d"]:
+            child_offset = offset - rel
+            child = FileTreeNode(name, create_time)
+            child.modify_stamp = modify_time
+            node.add_dir(child)
+            if rels is not None:
+                rels[child] = rel
+            stack.append((child, child_offset, decode_dir_record(buffer, child_offset)))
+    tree = FileTree()
+    tree.root = root
+    return tree
+
+
+# 惰性载入的文件夹 首次访问子结点时才从镜像读取自身记录
+class LazyFileTreeNode(FileTreeNode):
+    __slots__ = ("_dir_index", "_file_index", "image", "offset", "loaded", "record", "loaded_dirs")
+
+    def __init__(self, name, create_time, image, offset):
+        super().__init__(name, create_time)
+        self.image = image
+        self.offset = offset  # 记录在当前元数据副本中的偏移
+        self.loaded = False
+        self.record = None  # 载入或保存时的逻辑记录
+        self.loaded_dirs = 0  # 已载入的子文件夹数 不为0时不可换出
+
+    @property
+    def dir_index(self):
+        self.image.touch(self)
+        return self._dir_index
+
+    @dir_index.setter
+    def dir_index(self, value):
+        self._dir_index = value
+
+    @property
+    def file_index(self):
+        self.image.touch(self)
+        return self._file_index
+
+    @file_index.setter
+    def file_index(self, value):
+        self._file_index = value
+
+    # 已载入的子文件夹移入/移出时同步换出用的计数 重命名时先移出再移入
+    def add_dir(self, node):
+        super().add_dir(node)
+        if isinstance(node, LazyFileTreeNode) and node.loaded:
+            self.image.attach(node, self)
+
+    def remove_dir(self, node):
+        super().remove_dir(node)
+        if isinstance(node, LazyFileTreeNode):
+            self.image.detach(node, self)
+
+
+def _pages(data):
+    return [bytes(data[i:i + PAGE_SIZE]) for i in range(0, len(data), PAGE_SIZE)]
+
+
+def _fat_bytes(table, start, stop):
+    entries = table[start:stop]
+    if sys.byteorder == "big":
+        entries.byteswap()
+    return entries.tobytes()
+
+
+class ImageFile:
+    def __init__(self, path):
+        self.path = path
+        self.super = None  # 当前生效的超级块 未写过时为None
+        # 每份副本待写回的FAT/bitmap组 以及副本中元数据的各页内容(未知为None)
+        self.fat_pending = [set(), set()]
+        self.bitmap_pending = [set(), set()]
+        self.meta_pages = [None, None]
+        # 惰性模式 元数据通过只读映射按需读取 已载入的文件夹按LRU换出
+        self.lazy = False
+        self.map = None
+        self.meta_base = 0  # 当前元数据副本在镜像中的起始位置
+        self.resident = OrderedDict()
+        self.resident_num = RESIDENT_NUM
+        self.lock = threading.RLock()  # 多线程同时访问惰性文件夹时串行载入与换出
+        # 非惰性模式下 当前元数据副本中各文件夹相对父记录的偏移 以及此后修改过的文件夹(连同到根的路径)
+        # 保存时未修改的子树直接从当前副本拷贝 见encode_tree
+        self.rels = weakref.WeakKeyDictionary()
+        self.root = None  # rels对应的根结点
+        self.dirty = set()
+
+    @staticmethod
+    def layout(block_size, block_num, meta_capacity):
+        fat_span = _align(block_num * 4, PAGE_SIZE)
+        bitmap_span = _align((block_num + 7) // 8, PAGE_SIZE)
+        fat_offset = 2 * SUPER_SIZE
+        bitmap_offset = fat_offset + 2 * fat_span
+        # 数据区按mmap粒度对齐 便于直接映射
+        data_offset = _align(bitmap_offset + 2 * bitmap_span, mmap.ALLOCATIONGRANULARITY)
+        meta_offset = _align(data_offset + block_num * block_size, PAGE_SIZE)
+        return {
+            "block_size": block_size, "block_num": block_num,
+            "fat_offset": fat_offset, "fat_span": fat_span,
+            "bitmap_offset": bitmap_offset, "bitmap_span": bitmap_span,
+            "data_offset": data_offset, "meta_offset": meta_offset, "meta_capacity": meta_capacity,
+        }
+
+    @staticmethod
+    def __pack_super(sb):
+        data = struct.pack(SUPER_FORMAT, *(sb[field] for field in SUPER_FIELDS))
+        return data + struct.pack("<I", zlib.crc32(data))
+
+    # 读取两份超级块 返回校验通过且generation最大的一份
+    @staticmethod
+    def read_super(f):
+        size = struct.calcsize(SUPER_FORMAT)
+        best = None
+        for slot in range(2):
+            f.seek(slot * SUPER_SIZE)
+            raw = f.read(size + 4)
+            if len(raw) < size + 4 or zlib.crc32(raw[:size]) != struct.unpack("<I", raw[size:])[0]:
+                continue
+            sb = dict(zip(SUPER_FIELDS, struct.unpack(SUPER_FORMAT, raw[:size])))
+            if sb["magic"] != MAGIC or sb["version"] != VERSION:
+                continue
+            if best is None or sb["generation"] > best["generation"]:
+                best = sb
+        if best is None:
+            raise IOError("no valid superblock in " + f.name)
+        return best
+
+    def load(self, fs, lazy=False, resident_num=RESIDENT_NUM):
+        self.lazy = lazy
+        self.resident_num = resident_num
+        with open(self.path, "rb") as f:
+            sb = self.read_super(f)
+            copy = sb["generation"] % 2
+            block_num = sb["block_num"]
+            fs.block_size = sb["block_size"]
+            fs.block_num = block_num
+
+            f.seek(sb["fat_offset"] + copy * sb["fat_span"])
+            entries = array("i")
+            entries.frombytes(f.read(block_num * 4))
+            if sys.byteorder == "big":
+                entries.byteswap()
+            fs.fat = FAT(block_num)
+            fs.fat.table = entries
+            fs.fat.dirty_groups.clear()
+
+            f.seek(sb["bitmap_offset"] + copy * sb["bitmap_span"])
+            bitmap = bitarray()
+            bitmap.frombytes(f.read((block_num + 7) // 8))
+            del bitmap[block_num:]
+            fs.free_space = FreeSpace(block_num)
+            fs.free_space.bitmap = bitmap
+            fs.free_space.dirty_groups.clear()
+
+            if lazy:
+                # 数据区私有映射 读取时才调入 写入不影响镜像文件
+                fs.disk = Disk.map_file(f.fileno(), block_num, sb["block_size"], sb["data_offset"], mmap.ACCESS_COPY)
+            else:
+                f.seek(sb["data_offset"])
+                buffer = bytearray(block_num * sb["block_size"])
+                f.readinto(buffer)
+                fs.disk = Disk(block_num, sb["block_size"], buffer)
+
+            self.meta_base = sb["meta_offset"] + copy * sb["meta_capacity"]
+            if lazy:
+                meta = None
+                self.__open_map()
+                root = LazyFileTreeNode("", 0, self, sb["root_offset"])
+                self.fault(root)
+                root.dir_name = root.record["n"]
+                root.create_stamp = root.record["c"]
+                root.modify_stamp = root.record["m"]
+                fs.file_tree = FileTree()
+                fs.file_tree.root = root
+            else:
+                f.seek(self.meta_base)
+                meta = f.read(sb["meta_len"])
+                self.forget()
+                fs.file_tree = decode_tree(meta, sb["root_offset"], self.rels)
+                self.root = fs.file_tree.root
+
+        self.super = sb
+        # 另一份副本的内容未知 下次写入它时整体重写
+        groups = set(range((block_num + GROUP_BLOCKS - 1) // GROUP_BLOCKS))
+        self.fat_pending = [set(), set()]
+        self.bitmap_pending = [set(), set()]
+        self.fat_pending[1 - copy] = groups
+        self.bitmap_pending[1 - copy] = set(groups)
+        self.meta_pages = [None, None]
+        if meta is not None:
+            self.meta_pages[copy] = _pages(meta)
+
+    def __open_map(self):
+        if self.map is not None:
+            self.map.close()
+        with open(self.path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    # 文件夹或其中的文件将被修改 由FileSystem在修改结点前调用 node可以是FCB
+    def mark_dirty(self, node):
+        node = node if isinstance(node, FileTreeNode) else node.parent
+        while node is not None and node not in self.dirty:
+            self.dirty.add(node)
+            node = node.parent
+
+    # 结点未经mark_dirty被修改(回滚/修复)后调用 下次保存时重新编码整棵树
+    def forget(self):
+        self.rels = weakref.WeakKeyDictionary()
+        self.root = None
+        self.dirty = set()
+
+    # 上次保存或载入的元数据 惰性模式或结构已改变时为None
+    def __previous(self, root):
+        if self.lazy or self.super is None or root is not self.root:
+            return None
+        pages = self.meta_pages[self.super["generation"] % 2]
+        if pages is None:
+            return None
+        return b"".join(pages), self.super["root_offset"], self.rels, self.dirty
+
+    # 访问惰性文件夹 未载入则读取记录 已载入则更新LRU顺序
+    def touch(self, node: LazyFileTreeNode):
+        with self.lock:
+            if node.loaded:
+                if node in self.resident:
+                    self.resident.move_to_end(node)
+            else:
+                self.fault(node)
+
+    def fault(self, node: LazyFileTreeNode):
+        record = decode_dir_record(self.map, self.meta_base + node.offset)
+        node.loaded = True
+        node.record = logical_record(record)
+        for entry in record["f"]:
+            node.add_file(decode_fcb(entry))
+        for name, create_time, modify_time, rel, _ in record["d"]:
+            child = LazyFileTreeNode(name, create_time, self, node.offset - rel)
+            child.modify_stamp = modify_time
+            node.add_dir(child)
+        if isinstance(node.parent, LazyFileTreeNode):
+            self.attach(node, node.parent)
+        self.__evict(node)
+
+    # 已载入的文件夹加入换出队列
+    def attach(self, node: LazyFileTreeNode, parent: LazyFileTreeNode):
+        with self.lock:
+            if node not in self.resident:
+                self.resident[node] = None
+                parent.loaded_dirs += 1
+
+    # 文件夹被删除 不再换出
+    def detach(self, node: LazyFileTreeNode, parent: LazyFileTreeNode):
+        with self.lock:
+            if node in self.resident:
+                del self.resident[node]
+                parent.loaded_dirs -= 1
+
+    # 换出最久未访问的文件夹 只换出没有已载入子文件夹且载入后未被修改的结点
+    # 换出后原有的子结点脱离目录树 手中的旧结点再用于修改时抛出FileNotFoundError 应按路径重新查找
+    def __evict(self, keep):
+        if len(self.resident) <= self.resident_num:
+            return
+        for node in list(self.resident):
+            if len(self.resident) <= self.resident_num:
+                break
+            if node.parent is None:
+                # 格式化或回滚时整体脱离目录树的文件夹
+                del self.resident[node]
+            elif node is not keep and node.loaded_dirs == 0 \
+                    and logical_record(self.__current_record(node)) == node.record:
+                del self.resident[node]
+                for child in list(node._dir_index.values()) + list(node._file_index.values()):
+                    child.parent = None
+                node.dir_index = {}
+                node.file_index = {}
+                node.loaded = False
+                node.record = None
+                node.parent.loaded_dirs -= 1
+
+    @staticmethod
+    def __current_record(node: LazyFileTreeNode):
+        return {
+            "n": node.dir_name, "c": node.create_stamp, "m": node.modify_stamp,
+            "f": [encode_fcb(fcb) for fcb in node._file_index.values()],
+            "d": [[child.dir_name, child.create_stamp, child.modify_stamp] for child in node._dir_index.values()],
+        }
+
+    # 将未载入文件夹的整棵子树记录拷贝到out末尾 返回(新记录偏移, 记录长度, 子树跨度)
+    def copy_subtree(self, node: LazyFileTreeNode, out):
+        return copy_subtree(self.map, self.meta_base + node.offset, out)
+
+    # 载入全部文件夹并停止换出 另存为其他镜像前调用
+    def load_all(self, root):
+        self.resident_num = float("inf")
+        stack = [root]
+        while stack:
+            stack.extend(stack.pop().tree_node_children)
+
+    def save(self, fs):
+        # 上次提交后释放的块到此才可复用
+        fs.allocator.flush_deferred()
+        root = fs.file_tree.root
+        rels = None if self.lazy else {}
+        meta, root_offset, positions = encode_tree(root, self.__previous(root), rels)
+        sb = self.super
+        if sb is None or sb["block_num"] != fs.block_num or sb["block_size"] != fs.block_size \
+                or len(meta) > sb["meta_capacity"]:
+            self.__save_full(fs, meta, root_offset)
+        else:
+            self.__save_incremental(fs, meta, root_offset)
+        # 提交成功后才更新相对偏移 否则下次保存仍以上一份元数据为准
+        if rels is not None:
+            if root is not self.root:
+                self.forget()
+                self.root = root
+            self.rels.update(rels)
+        self.dirty = set()
+        # 惰性文件夹的记录已移动到新的元数据副本
+        self.meta_base = self.super["meta_offset"] + self.super["generation"] % 2 * self.super["meta_capacity"]
+        for node, offset, record in positions:
+            node.offset = offset
+            if record is not None:
+                node.record = record
+        if self.lazy and self.map is None:
+            self.__open_map()
+
+    # 整体写入新文件后替换 用于首次保存/磁盘参数变化/元数据区不足
+    def __save_full(self, fs, meta, root_offset):
+        generation = self.super["generation"] + 1 if self.super is not None else 1
+        meta_capacity = _align(max(2 * len(meta), PAGE_SIZE), PAGE_SIZE)
+        sb = self.layout(fs.block_size, fs.block_num, meta_capacity)
+        sb.update(magic=MAGIC, version=VERSION, meta_len=len(meta), root_offset=root_offset)
+
+        fat_data = _fat_bytes(fs.fat.table, 0, fs.block_num)
+        bitmap_data = fs.image_bitmap().tobytes()
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            for slot in range(2):
+                f.seek(slot * SUPER_SIZE)
+                # 两份超级块内容相同 generation相差1
+                f.write(self.__pack_super(dict(sb, generation=generation - (generation + slot) % 2)))
+                f.seek(sb["fat_offset"] + slot * sb["fat_span"])
+                f.write(fat_data)
+                f.seek(sb["bitmap_offset"] + slot * sb["bitmap_span"])
+                f.write(bitmap_data)
+                f.seek(sb["meta_offset"] + slot * meta_capacity)
+                f.write(meta)
+            f.seek(sb["data_offset"])
+            f.write(fs.disk.buffer)
+            f.truncate(sb["meta_offset"] + 2 * meta_capacity)
+            f.flush()
+            os.fsync(f.fileno())
+        self.close()
+        os.replace(temp_path, self.path)
+
+        self.super = dict(sb, generation=generation)
+        self.fat_pending = [set(), set()]
+        self.bitmap_pending = [set(), set()]
+        self.meta_pages = [_pages(meta), _pages(meta)]
+        fs.fat.dirty_groups.clear()
+        fs.free_space.dirty_groups.clear()
+        fs.disk.dirty.clear()
+
+    # 只写回脏数据块 以及目标副本中过期的FAT/bitmap组和元数据页 最后提交超级块
+    def __save_incremental(self, fs, meta, root_offset):
+        sb = dict(self.super)
+        sb.update(generation=sb["generation"] + 1, meta_len=len(meta), root_offset=root_offset)
+        copy = sb["generation"] % 2
+        for pending in self.fat_pending:
+            pending |= fs.fat.dirty_groups
+        for pending in self.bitmap_pending:
+            pending |= fs.free_space.dirty_groups
+        fs.fat.dirty_groups.clear()
+        fs.free_space.dirty_groups.clear()
+
+        block_size = fs.block_size
+        with open(self.path, "r+b") as f:
+            # 数据块 相邻的块合并为一次写入
+            blocks = sorted(fs.disk.dirty)
+            with fs.disk.view() as view:
+                i = 0
+                while i < len(blocks):
+                    j = i
+                    while j + 1 < len(blocks) and blocks[j + 1] == blocks[j] + 1:
+                        j += 1
+                    f.seek(sb["data_offset"] + blocks[i] * block_size)
+                    f.write(view[blocks[i] * block_size:(blocks[j] + 1) * block_size])
+                    i = j + 1
+            fs.disk.dirty.clear()
+
+            for group in sorted(self.fat_pending[copy]):
+                start = group * GROUP_BLOCKS
+                f.seek(sb["fat_offset"] + copy * sb["fat_span"] + start * 4)
+                f.write(_fat_bytes(fs.fat.table, start, min(start + GROUP_BLOCKS, fs.block_num)))
+            self.fat_pending[copy].clear()
+
+            bitmap = fs.image_bitmap()
+            for group in sorted(self.bitmap_pending[copy]):
+                start = group * GROUP_BLOCKS
+                f.seek(sb["bitmap_offset"] + copy * sb["bitmap_span"] + start // 8)
+                f.write(bitmap[start:start + GROUP_BLOCKS].tobytes())
+            self.bitmap_pending[copy].clear()
+
+            pages = _pages(meta)
+            old_pages = self.meta_pages[copy] or []
+            for i, page in enumerate(pages):
+                if i >= len(old_pages) or old_pages[i] != page:
+                    f.seek(sb["meta_offset"] + copy * sb["meta_capacity"] + i * PAGE_SIZE)
+                    f.write(page)
+            self.meta_pages[copy] = pages
+
+            f.flush()
+            os.fsync(f.fileno())
+            f.seek(copy * SUPER_SIZE)
+            f.write(self.__pack_super(sb))
+            f.flush()
+            os.fsync(f.fileno())
+        self.super = sb
@@ -0,0 +1,200 @@
+import threading
+from bisect import bisect_left, bisect_right
+from fnmatch import fnmatchcase
+from itertools import count
+
+from file_system_components import FCB, FileSystem, FileTreeNode, _stamp
+
+WILDCARDS = "*?["
+BULK_SIZE = 64  # 一次加入的文件数达到此值时整体重排 而不是逐个插入
+
+
+# 元数据索引 通过FileSystem的监听回调增量维护
+#   names: 文件名 -> FCB集合 按名称精确查找为O(1) 通配符只需遍历不同的文件名
+#   keys/fcbs: 按(修改时间, 序号)排序的两个平行列表 按时间范围查找为O(log n)
+#   每个FileTreeNode上的file_count/total_length/max_stamp为整棵子树的汇总
+#   文件变化时只沿父结点链向上更新 du为O(1) 最大修改时间只在原最大值被删除时才按子结点重新计算
+# 回调在执行操作的线程中调用 不同文件夹的修改可能并发 索引自带一把锁 不再调用文件系统的方法
+class MetadataIndex:
+    def __init__(self, fs: FileSystem):
+        self.fs = fs
+        self.lock = threading.Lock()
+        self.seq = count()
+        self.names = {}
+        self.keys = []
+        self.fcbs = []
+        self.records = {}  # FCB -> [文件名, 长度, 修改时间, 序号] 即索引中记录的旧值
+        self.rebuild()
+        fs.add_listener(self.on_changed)
+
+    def close(self):
+        self.fs.remove_listener(self.on_changed)
+
+    def rebuild(self):
+        with self.lock:
+            self.__rebuild()
+
+    def __rebuild(self):
+        self.names.clear()
+        self.keys.clear()
+        self.fcbs.clear()
+        self.records.clear()
+        self.__add_dir(self.fs.file_tree.root)
+
+    # ---- 查询 ----
+
+    # 查找文件 各条件同时满足 name可含通配符 时间为datetime或微秒数 under限定在某文件夹的子树中
+    # 有时间条件时结果按修改时间排序
+    def find(self, name=None, modified_after=None, modified_before=None, under=None):
+        with self.lock:
+            candidates = None
+            if name is not None:
+                if any(c in name for c in WILDCARDS):
+                    candidates = {fcb for key in self.names if fnmatchcase(key, name) for fcb in self.names[key]}
+                else:
+                    candidates = self.names.get(name, set())
+            if modified_after is not None or modified_before is not None:
+                lo = 0 if modified_after is None else bisect_right(self.keys, (_stamp(modified_after), float("inf")))
+                hi = len(self.keys) if modified_before is None else bisect_left(self.keys, (_stamp(modified_before),))
+                if candidates is None or hi - lo <= len(candidates):
+                    result = [fcb for fcb in self.fcbs[lo:hi] if candidates is None or fcb in candidates]
+                else:
+                    low = -1 if modified_after is None else _stamp(modified_after)
+                    high = float("inf") if modified_before is None else _stamp(modified_before)
+                    result = sorted((fcb for fcb in candidates if low < self.records[fcb][2] < high),
+                                    key=lambda fcb: self.records[fcb][2:])
+            else:
+                result = list(self.fcbs if candidates is None else candidates)
+        if under is not None and under is not self.fs.file_tree.root:
+            result = [fcb for fcb in result if self.__is_under(fcb, under)]
+        return result
+
+    @staticmethod
+    def __is_under(fcb: FCB, node: FileTreeNode):
+        parent = fcb.parent
+        while parent is not None:
+            if parent is node:
+                return True
+            parent = parent.parent
+        return False
+
+    # ---- 维护 ----
+
+    def on_changed(self, event, *args):
+        with self.lock:
+            if event == "reset":
+                self.__rebuild()
+            elif event == "file_added":
+                self.__add_file(*args)
+            elif event == "file_removed":
+                self.__remove_file(*args)
+            elif event in ("file_changed", "file_renamed"):
+                self.__update_file(args[0])
+            elif event == "dir_added":
+                # 新建的文件夹为空 通知送达前其中新建的文件已各自产生file_added并计入汇总 不再重新统计
+                pass
+            elif event == "dir_removed":
+                # 子树中的文件已逐个产生file_removed 此时子树为空
+                parent, node = args
+                self.__propagate(parent, -node.file_count, -node.total_length, None, node.max_stamp)
+
+    # 重新统计整棵子树 并把其中尚未索引的文件加入索引 自下而上计算汇总值 只在重建索引时调用
+    def __add_dir(self, root: FileTreeNode):
+        order = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(node.tree_node_children)
+        added = []
+        for node in reversed(order):
+            files = node.leaf_node_children
+            dirs = node.tree_node_children
+            added += [fcb for fcb in files if fcb not in self.records]
+            node.file_count = len(files) + sum(child.file_count for child in dirs)
+            node.total_length = sum(fcb.length for fcb in files) + sum(child.total_length for child in dirs)
+            node.max_stamp = max([fcb.modify_stamp for fcb in files] + [child.max_stamp for child in dirs] + [0])
+        if len(added) < BULK_SIZE:
+            for fcb in added:
+                self.__index(fcb)
+            return
+        # 文件较多时整体排序一次 避免逐个插入有序列表
+        pairs = list(zip(self.keys, self.fcbs))
+        for fcb in added:
+            pairs.append(((fcb.modify_stamp, self.__record(fcb)[3]), fcb))
+        pairs.sort(key=lambda pair: pair[0])
+        self.keys[:] = [key for key, _ in pairs]
+        self.fcbs[:] = [fcb for _, fcb in pairs]
+
+    def __record(self, fcb: FCB):
+        record = [fcb.file_name, fcb.length, fcb.modify_stamp, next(self.seq)]
+        self.records[fcb] = record
+        self.names.setdefault(record[0], set()).add(fcb)
+        return record
+
+    def __index(self, fcb: FCB):
+        record = self.__record(fcb)
+        key = (record[2], record[3])
+        i = bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.fcbs.insert(i, fcb)
+
+    def __unindex(self, fcb: FCB):
+        name, length, stamp, seq = self.records.pop(fcb)
+        fcbs = self.names[name]
+        fcbs.discard(fcb)
+        if not fcbs:
+            del self.names[name]
+        i = bisect_left(self.keys, (stamp, seq))
+        del self.keys[i]
+        del self.fcbs[i]
+        return length, stamp
+
+    def __add_file(self, parent: FileTreeNode, fcb: FCB):
+        self.__index(fcb)
+        self.__propagate(parent, 1, fcb.length, fcb.modify_stamp)
+
+    def __remove_file(self, parent: FileTreeNode, fcb: FCB):
+        if fcb not in self.records:
+            return
+        length, stamp = self.__unindex(fcb)
+        self.__propagate(parent, -1, -length, None, stamp)
+
+    def __update_file(self, fcb: FCB):
+        record = self.records.get(fcb)
+        if record is None or fcb.parent is None:
+            return
+        name, length, stamp, seq = record
+        if name != fcb.file_name:
+            self.names[name].discard(fcb)
+            if not self.names[name]:
+                del self.names[name]
+            self.names.setdefault(fcb.file_name, set()).add(fcb)
+            record[0] = fcb.file_name
+        if stamp != fcb.modify_stamp:
+            i = bisect_left(self.keys, (stamp, seq))
+            del self.keys[i]
+            del self.fcbs[i]
+            record[2] = fcb.modify_stamp
+            i = bisect_right(self.keys, (record[2], seq))
+            self.keys.insert(i, (record[2], seq))
+            self.fcbs.insert(i, fcb)
+        record[1] = fcb.length
+        self.__propagate(fcb.parent, 0, fcb.length - length, fcb.modify_stamp,
+                         stamp if fcb.modify_stamp < stamp else None)
+
+    # 沿父结点链向上更新汇总值 removed_stamp为被移除(或变小)的修改时间
+    # 只有等于某结点原最大值时 才需要按其直接子结点重新计算
+    def __propagate(self, node, files, length, stamp=None, removed_stamp=None):
+        while node is not None:
+            node.file_count += files
+            node.total_length += length
+            if removed_stamp is not None and removed_stamp >= node.max_stamp:
+                old = node.max_stamp
+                node.max_stamp = max([fcb.modify_stamp for fcb in node.file_index.values()]
+                                     + [child.max_stamp for child in node.dir_index.values()] + [0])
+                if node.max_stamp == old:
+                    removed_stamp = None
+            if stamp is not None and stamp > node.max_stamp:
+                node.max_stamp = stamp
+            node = node.parent
@@ -0,0 +1,108 @@
+import json
+import os
+import struct
+import zlib
+
+# 预写日志
+#
+#   | 头部: MAGIC + 基准generation | 记录 | 记录 | ...
+#
+# 每条记录为 4字节长度 + 4字节CRC + JSON 内容是一次文件操作的参数
+# 基准generation为日志开始时镜像的generation 与镜像不一致说明日志已被检查点吸收 直接丢弃
+# 记录先缓存在内存中 攒够group_size条再统一写入并fsync(组提交)
+
+MAGIC = b"FSJRNL\0\0"
+HEADER_FORMAT = "<8sQ"
+FRAME_FORMAT = "<II"
+
+GROUP_SIZE = 8  # 每次组提交的记录数
+CHECKPOINT_INTERVAL = 1024  # 累计多少条记录后写一次检查点
+
+
+class Journal:
+    def __init__(self, path, group_size=GROUP_SIZE, checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.group_size = group_size
+        self.checkpoint_interval = checkpoint_interval
+        self.buffer = bytearray()
+        self.buffered = 0  # 尚未落盘的记录数
+        self.records = 0  # 上次检查点之后的记录数
+        self.file = None
+
+    # 打开日志 返回需要重放的记录 之后的记录接在其后追加
+    def open(self, base_generation):
+        records = []
+        end = struct.calcsize(HEADER_FORMAT)
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                data = f.read()
+            if len(data) >= end:
+                magic, generation = struct.unpack_from(HEADER_FORMAT, data)
+                if magic == MAGIC and generation == base_generation:
+                    records, end = self.__parse(data, end)
+                else:
+                    end = None
+            else:
+                end = None
+        else:
+            end = None
+
+        if end is None:
+            self.reset(base_generation)
+        else:
+            # 截掉末尾写了一半的记录
+            self.file = open(self.path, "r+b")
+            self.file.truncate(end)
+            self.file.seek(end)
+        self.records = len(records)
+        return records
+
+    @staticmethod
+    def __parse(data, pos):
+        records = []
+        frame_size = struct.calcsize(FRAME_FORMAT)
+        while pos + frame_size <= len(data):
+            length, crc = struct.unpack_from(FRAME_FORMAT, data, pos)
+            payload = data[pos + frame_size:pos + frame_size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            records.append(json.loads(payload.decode("utf-8")))
+            pos += frame_size + length
+        return records, pos
+
+    def append(self, record):
+        payload = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.buffer += struct.pack(FRAME_FORMAT, len(payload), zlib.crc32(payload))
+        self.buffer += payload
+        self.buffered += 1
+        self.records += 1
+        if self.buffered >= self.group_size:
+            self.commit()
+
+    # 组提交 将缓存的记录写入并落盘
+    def commit(self):
+        if self.buffered == 0:
+            return
+        self.file.write(self.buffer)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.buffer = bytearray()
+        self.buffered = 0
+
+    # 检查点完成后清空日志 以新的generation为基准
+    def reset(self, base_generation):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.path, "wb")
+        self.file.write(struct.pack(HEADER_FORMAT, MAGIC, base_generation))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.buffer = bytearray()
+        self.buffered = 0
+        self.records = 0
+
+    def close(self):
+        if self.file is not None:
+            self.commit()
+            self.file.close()
+            self.file = None
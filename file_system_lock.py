@@ -0,0 +1,102 @@
+import threading
+import weakref
+from contextlib import contextmanager
+
+# 加锁顺序(避免死锁):
+#   卷锁 -> 文件夹锁(从父到子) -> 文件锁 -> 分配器锁 -> 缓存/日志/镜像锁
+# 同一线程可重入 持有写锁时可再取读锁 但持有读锁时不能升级为写锁
+
+
+# 读写锁 写者优先 同一线程可重入
+class RWLock:
+    def __init__(self):
+        self.__cond = threading.Condition(threading.Lock())
+        self.__readers = {}  # 线程id -> 重入次数
+        self.__writer = None
+        self.__writer_count = 0
+        self.__waiting_writers = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self.__cond:
+            if self.__writer != me and me not in self.__readers:
+                while self.__writer is not None or self.__waiting_writers:
+                    self.__cond.wait()
+            self.__readers[me] = self.__readers.get(me, 0) + 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self.__cond:
+            if self.__readers[me] == 1:
+                del self.__readers[me]
+                if not self.__readers:
+                    self.__cond.notify_all()
+            else:
+                self.__readers[me] -= 1
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self.__cond:
+            if self.__writer == me:
+                self.__writer_count += 1
+                return
+            if me in self.__readers:
+                raise RuntimeError("cannot upgrade a read lock to a write lock")
+            self.__waiting_writers += 1
+            try:
+                while self.__writer is not None or self.__readers:
+                    self.__cond.wait()
+            finally:
+                self.__waiting_writers -= 1
+            self.__writer = me
+            self.__writer_count = 1
+
+    def release_write(self):
+        with self.__cond:
+            self.__writer_count -= 1
+            if self.__writer_count == 0:
+                self.__writer = None
+                self.__cond.notify_all()
+
+    # 当前线程是否持有写锁
+    def is_writer(self):
+        return self.__writer == threading.get_ident()
+
+    # 当前线程是否持有任意一种锁
+    def is_held(self):
+        me = threading.get_ident()
+        return self.__writer == me or me in self.__readers
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+# 以对象为键的锁表 对象被回收后对应的锁自动移除
+class LockTable:
+    def __init__(self, factory=RWLock):
+        self.factory = factory
+        self.__mutex = threading.Lock()
+        self.__locks = weakref.WeakKeyDictionary()
+
+    def __getitem__(self, key):
+        with self.__mutex:
+            lock = self.__locks.get(key)
+            if lock is None:
+                lock = self.__locks[key] = self.factory()
+            return lock
+
+    def __len__(self):
+        return len(self.__locks)
@@ -2,18 +2,18 @@ import sys
 
 # pyqt5
 from PyQt5 import QtCore
-from PyQt5.QtGui import QIcon, QStandardItemModel, QStandardItem, QTextOption, QCursor
-from PyQt5.QtCore import QRect, QModelIndex
+from PyQt5.QtGui import QIcon, QTextOption, QCursor
+from PyQt5.QtCore import QRect, QModelIndex, QTimer
 from PyQt5.QtWidgets import QWidget, QPushButton, QApplication, QLabel, QVBoxLayout, QHBoxLayout, \
     QPlainTextEdit, QMainWindow, QMessageBox, QInputDialog, QTreeView, QAbstractItemView, QMenu
 
 from file_system_components import *
+from file_system_defrag import Defragmenter
+from file_system_model import FileTreeModel
 
 # QSS样式
 from qt_material import apply_stylesheet
 
-SYSTEM_INFO = "file_system_info"
-
 
 class FileSystemUI(QMainWindow):
     def __init__(self):
@@ -23,8 +23,10 @@ class FileSystemUI(QMainWindow):
         self.cur_selected_file = None
         self.cur_selected_dir = None
 
-        self.fake_root = FileTreeNode("", datetime.now())
-        self.fake_root.tree_node_children.append(self.file_system.file_tree.root)
+        # 碎片整理在定时器中分片执行 不阻塞界面
+        self.defragmenter = None
+        self.defrag_timer = QTimer(self)
+        self.defrag_timer.timeout.connect(self.defragment_step)
         self.setup_ui()
 
     def setup_ui(self):
@@ -38,6 +40,7 @@ class FileSystemUI(QMainWindow):
         fileMenu = menuBar.addMenu("文件")
         fileMenu.addAction(QIcon('imgs/format.png'), "格式化", self.format)
         fileMenu.addAction(QIcon('imgs/save.png'), "保存", self.save)
+        fileMenu.addAction(QIcon('imgs/format.png'), "碎片整理", self.defragment)
 
         createMenu = menuBar.addMenu("创建")
         createMenu.addAction(QIcon('imgs/create_file.png'), "创建文件", self.create_file)
@@ -68,8 +71,7 @@ class FileSystemUI(QMainWindow):
 
         # 左侧文件树
         self.treeView = QTreeView()
-        self.update_file_tree_model()
-        self.treeView.expandAll()
+        self.setup_file_tree_view()
 
         h1 = QHBoxLayout()
         h1.addWidget(self.treeView)
@@ -98,29 +100,19 @@ class FileSystemUI(QMainWindow):
 
     # 鼠标点击左侧条目时，更新选中的文件夹/文件，同时更新各部分组件
     def click_item(self, cur: QModelIndex, pre: QModelIndex):
-        reverse_cur_path = []
-        file_order = cur.row()  # 保存原有文件位置索引
-
-        while cur.data() is not None:
-            reverse_cur_path.append(cur.data())
-            cur = cur.parent()
-
-        self.cur_path = list(reversed(reverse_cur_path))
-
-        # update selected file
-        cursor = self.fake_root  # 类似虚拟头结点 以便遍历到对应文件夹
-        for i in range(len(self.cur_path) - 1):
-            cursor = next((x for x in cursor.tree_node_children if x.dir_name == self.cur_path[i]))
-
-        # 最后一项可能是文件夹或文件 通过索引判断 位置在前为文件 在后为文件夹
-        if len(cursor.tree_node_children) - 1 < file_order:
-            self.cur_selected_file = cursor.leaf_node_children[file_order - len(cursor.tree_node_children)]
+        # 模型的每一项直接指向FileTreeNode或FCB
+        node = self.model.node(cur)
+        if node is None:
+            return
+        if isinstance(node, FCB):
+            self.cur_selected_file = node
             print("file ", self.cur_selected_file.file_name)
-            self.cur_selected_dir = cursor  # 同时获得所在文件夹
+            self.cur_selected_dir = node.parent  # 同时获得所在文件夹
         else:
-            self.cur_selected_dir = cursor.tree_node_children[file_order]
+            self.cur_selected_dir = node
             print("dir ", self.cur_selected_dir.dir_name)
             self.cur_selected_file = None
+        self.update_cur_path()
 
         # update path label
         self.update_path_label()
@@ -135,34 +127,27 @@ class FileSystemUI(QMainWindow):
         else:
             self.save_button.setEnabled(False)
 
-    # 构建tree model所需函数
-    def __append_items_recursively(self, model, file_tree_node: FileTreeNode):
-        for node in file_tree_node.tree_node_children:
-            child_item = QStandardItem(node.dir_name)
-            self.__append_items_recursively(child_item, node)
-            model.appendRow(child_item)
-        for leaf_node in file_tree_node.leaf_node_children:
-            model.appendRow(QStandardItem(leaf_node.file_name))
-
-    # 构建tree model
-    def build_file_tree_model(self) -> QStandardItemModel:
-        model = QStandardItemModel()
-        model.setHorizontalHeaderLabels(['名称'])
-        root_item = QStandardItem(self.file_system.file_tree.root.dir_name)
-        model.appendRow(root_item)
-        self.__append_items_recursively(root_item, self.file_system.file_tree.root)
-        return model
-
     # 更新所有部件
+    # 文件树模型随文件系统的修改自行增删行 无需重建
     def update_all_components(self):
-        self.update_file_tree_model()
+        self.update_cur_path()
         self.update_footer()
         self.update_path_label()
         self.update_text_edit()
 
-    def update_file_tree_model(self):
-        self.treeView.setModel(self.build_file_tree_model())
-        self.treeView.expandAll()
+    # 选中项的路径 选中的文件/文件夹被删除后路径随之清空
+    def update_cur_path(self):
+        node = self.cur_selected_file or self.cur_selected_dir
+        names = []
+        while node is not None:
+            names.append(node.file_name if isinstance(node, FCB) else node.dir_name)
+            node = node.parent
+        self.cur_path = list(reversed(names))
+
+    def setup_file_tree_view(self):
+        self.model = FileTreeModel(self.file_system, self)
+        self.treeView.setModel(self.model)
+        self.treeView.expand(self.model.index_of(self.file_system.file_tree.root))
         # 增加点击事件
         self.treeView.selectionModel().currentChanged.connect(self.click_item)
         # 增加右击点击事件
@@ -191,8 +176,10 @@ class FileSystemUI(QMainWindow):
 
     def update_footer(self):
         if self.cur_selected_dir is not None:
+            stats = self.file_system.dir_stats(self.cur_selected_dir)
             self.footer.setText("(selected dir) " + self.cur_selected_dir.dir_name + "   |   contains " + str(
-                self.cur_selected_dir.size()) + " items\n" +
+                self.cur_selected_dir.size()) + " items, " + str(stats["files"]) + " files (" + str(
+                stats["bytes"]) + " bytes) in total\n" +
                                 "created in " + str(self.cur_selected_dir.create_time) + ", modified in " + str(
                 self.cur_selected_dir.modify_time))
             if self.cur_selected_file is not None:
@@ -256,8 +243,32 @@ class FileSystemUI(QMainWindow):
             self.cur_selected_file = None
             self.cur_selected_dir = self.file_system.file_tree.root
             self.cur_path = [self.cur_selected_dir.dir_name]
+            # 格式化会重置模型 重新展开根目录
+            self.treeView.expand(self.model.index_of(self.cur_selected_dir))
             self.update_all_components()
 
+    def defragment(self):
+        if self.defragmenter is not None:
+            QMessageBox.warning(self, "警告", "碎片整理正在进行！")
+            return
+        self.defragmenter = Defragmenter(self.file_system)
+        self.defrag_timer.start(10)
+
+    def defragment_step(self):
+        if not self.defragmenter.step():
+            return
+        self.defrag_timer.stop()
+        report = self.defragmenter.report()
+        self.defragmenter = None
+        before, after = report["before"], report["after"]
+        QMessageBox.about(self, '碎片整理', '移动文件数：%d\n'
+                                        '碎片文件数：%d -> %d\n'
+                                        '连续段数：%d -> %d\n'
+                                        '最大空闲区间：%d -> %d块'
+                          % (report["moved"], before["fragmented_files"], after["fragmented_files"],
+                             before["extents"], after["extents"], before["largest_free"], after["largest_free"]))
+        self.update_footer()
+
     def save(self):
         ans = QMessageBox.question(self, '确认', "保存到本地文件？", QMessageBox.Yes | QMessageBox.No)
         if ans == QMessageBox.Yes:
@@ -270,11 +281,10 @@ class FileSystemUI(QMainWindow):
                 QMessageBox.warning(self, "警告", "文件名为空！")
             elif self.cur_selected_dir is None:
                 QMessageBox.warning(self, "警告", "请先在左侧选中创建文件所在的文件夹！")
-            elif len([x for x in self.cur_selected_dir.leaf_node_children if x.file_name == new_file_name]) > 0:
-                QMessageBox.warning(self, "警告", "已有重复文件名！")
+            elif new_file_name in self.cur_selected_dir.file_index or new_file_name in self.cur_selected_dir.dir_index:
+                QMessageBox.warning(self, "警告", "已有同名的文件或文件夹！")
             else:
                 self.file_system.create_file(new_file_name, self.cur_selected_dir)
-                self.update_file_tree_model()
                 self.update_all_components()
 
     def create_dir(self):
@@ -284,8 +294,8 @@ class FileSystemUI(QMainWindow):
                 QMessageBox.warning(self, "警告", "文件夹名为空！")
             elif self.cur_selected_dir is None:
                 QMessageBox.warning(self, "警告", "请先在左侧选中创建文件夹所在的文件夹！")
-            elif len([x for x in self.cur_selected_dir.tree_node_children if x.dir_name == new_dir_name]) > 0:
-                QMessageBox.warning(self, "警告", "已有重复文件夹名！")
+            elif new_dir_name in self.cur_selected_dir.dir_index or new_dir_name in self.cur_selected_dir.file_index:
+                QMessageBox.warning(self, "警告", "已有同名的文件或文件夹！")
             else:
                 self.file_system.create_dir(self.cur_selected_dir, new_dir_name, datetime.now())
                 self.update_all_components()
@@ -323,8 +333,8 @@ class FileSystemUI(QMainWindow):
             if ok:
                 if new_file_name == "":
                     QMessageBox.warning(self, "警告", "文件名为空！")
-                elif len([x for x in self.cur_selected_dir.leaf_node_children if x.file_name == new_file_name]) > 0:
-                    QMessageBox.warning(self, "警告", "已有重复文件名！")
+                elif new_file_name in self.cur_selected_dir.file_index or new_file_name in self.cur_selected_dir.dir_index:
+                    QMessageBox.warning(self, "警告", "已有同名的文件或文件夹！")
                 else:
                     self.file_system.rename_file(self.cur_selected_file, new_file_name, self.cur_selected_dir)
                     self.update_all_components()
@@ -337,8 +347,9 @@ class FileSystemUI(QMainWindow):
             if ok:
                 if new_dir_name == "":
                     QMessageBox.warning(self, "警告", "文件夹名为空！")
-                elif len([x for x in self.cur_selected_dir.tree_node_children if x.dir_name == new_dir_name]) > 0:
-                    QMessageBox.warning(self, "警告", "已有重复文件夹名！")
+                elif self.cur_selected_dir.parent is not None and (new_dir_name in self.cur_selected_dir.parent.dir_index
+                                                                   or new_dir_name in self.cur_selected_dir.parent.file_index):
+                    QMessageBox.warning(self, "警告", "已有同名的文件或文件夹！")
                 else:
                     self.file_system.rename_dir(self.cur_selected_dir, new_dir_name)
                     self.update_all_components()
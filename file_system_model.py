@@ -0,0 +1,165 @@
+from PyQt5.QtCore import QAbstractItemModel, QModelIndex, Qt
+
+from file_system_components import FCB, FileSystem, FileTreeNode
+
+FETCH_SIZE = 256  # 每次fetchMore向视图暴露的行数
+
+
+# 直接建立在FileTreeNode/FCB之上的树模型 不复制整棵树
+# 文件夹第一次展开时才取出子结点快照(子文件夹在前 文件在后) 并按FETCH_SIZE分批交给视图
+# 通过FileSystem的监听回调得知增删改 只发出对应行的插入/删除/修改信号 视图的展开状态因此得以保留
+# 回调在执行操作的线程中调用 所有修改应在GUI线程中进行
+class FileTreeModel(QAbstractItemModel):
+    def __init__(self, file_system: FileSystem, parent=None):
+        super().__init__(parent)
+        self.file_system = file_system
+        self.children = {}  # 已展开的文件夹 -> 子结点快照
+        self.visible = {}  # 已展开的文件夹 -> 已暴露给视图的行数
+        self.rows = {}  # 文件夹 -> {子结点: 行号} 快照变化后重建
+        file_system.add_listener(self.on_changed)
+
+    def node(self, index: QModelIndex):
+        return index.internalPointer() if index.isValid() else None
+
+    def index_of(self, node):
+        if node is self.file_system.file_tree.root:
+            return self.createIndex(0, 0, node)
+        parent = node.parent
+        if parent is None or parent not in self.children:
+            return QModelIndex()
+        row = self.__row(parent, node)
+        if row is None or row >= self.visible[parent]:
+            return QModelIndex()
+        return self.createIndex(row, 0, node)
+
+    def __row(self, parent, node):
+        rows = self.rows.get(parent)
+        if rows is None:
+            rows = self.rows[parent] = {child: i for i, child in enumerate(self.children[parent])}
+        return rows.get(node)
+
+    # ---- QAbstractItemModel ----
+
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, self.file_system.file_tree.root)
+        return self.createIndex(row, column, self.children[self.node(parent)][row])
+
+    def parent(self, index):
+        node = self.node(index)
+        if node is None or node is self.file_system.file_tree.root or node.parent is None:
+            return QModelIndex()
+        return self.index_of(node.parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        if not parent.isValid():
+            return 1
+        return self.visible.get(self.node(parent), 0)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self.node(parent)
+        if node is None:
+            return True
+        return isinstance(node, FileTreeNode) and node.size() > 0
+
+    def canFetchMore(self, parent):
+        node = self.node(parent)
+        if not isinstance(node, FileTreeNode):
+            return False
+        return node not in self.children or self.visible[node] < len(self.children[node])
+
+    def fetchMore(self, parent):
+        node = self.node(parent)
+        if node not in self.children:
+            self.children[node] = node.tree_node_children + node.leaf_node_children
+            self.visible[node] = 0
+        start = self.visible[node]
+        end = min(start + FETCH_SIZE, len(self.children[node]))
+        if end > start:
+            self.beginInsertRows(parent, start, end - 1)
+            self.visible[node] = end
+            self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        node = self.node(index)
+        if node is None or role != Qt.DisplayRole:
+            return None
+        return node.file_name if isinstance(node, FCB) else node.dir_name
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return '名称'
+        return None
+
+    # ---- 文件系统事件 ----
+
+    def on_changed(self, event, *args):
+        if event == "reset":
+            self.beginResetModel()
+            self.children.clear()
+            self.visible.clear()
+            self.rows.clear()
+            self.endResetModel()
+        elif event in ("dir_added", "file_added"):
+            self.__insert(*args)
+        elif event in ("dir_removed", "file_removed"):
+            self.__remove(*args)
+        else:
+            # 改名或内容变化 行不动 只刷新显示
+            index = self.index_of(args[0])
+            if index.isValid():
+                self.dataChanged.emit(index, index)
+
+    def __insert(self, parent, node):
+        parent_index = self.index_of(parent)
+        if parent not in self.children:
+            # 尚未展开 展开时自然会取到 只需通知视图可能出现展开标记
+            if parent_index.isValid():
+                self.dataChanged.emit(parent_index, parent_index)
+            return
+        children = self.children[parent]
+        if isinstance(node, FileTreeNode):
+            row = sum(1 for child in children if isinstance(child, FileTreeNode))
+        else:
+            row = len(children)
+        if row > self.visible[parent] or not parent_index.isValid():
+            # 落在尚未暴露的部分 下次fetchMore时再交给视图
+            children.insert(row, node)
+            self.rows.pop(parent, None)
+            return
+        self.beginInsertRows(parent_index, row, row)
+        children.insert(row, node)
+        self.rows.pop(parent, None)
+        self.visible[parent] += 1
+        self.endInsertRows()
+
+    def __remove(self, parent, node):
+        if parent in self.children:
+            row = self.__row(parent, node)
+            if row is not None:
+                parent_index = self.index_of(parent)
+                if row < self.visible[parent] and parent_index.isValid():
+                    self.beginRemoveRows(parent_index, row, row)
+                    del self.children[parent][row]
+                    self.rows.pop(parent, None)
+                    self.visible[parent] -= 1
+                    self.endRemoveRows()
+                else:
+                    del self.children[parent][row]
+                    self.rows.pop(parent, None)
+                    if row < self.visible[parent]:
+                        self.visible[parent] -= 1
+        # 丢弃被删除子树的快照
+        stack = [node]
+        while stack:
+            removed = stack.pop()
+            stack.extend(child for child in self.children.pop(removed, []) if isinstance(child, FileTreeNode))
+            self.visible.pop(removed, None)
+            self.rows.pop(removed, None)
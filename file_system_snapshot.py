@@ -0,0 +1,178 @@
+import threading
+from collections import ChainMap
+
+from file_system_components import FAT_END, FCB
+
+# 整个卷的快照 写时复制 快照只保存在内存中
+#
+# 创建快照不复制任何东西 只记下时间 之后的修改在改动前把原状态存入最新的快照:
+#   nodes: 结点 -> 修改前的记录 修改某个结点时连同它到根的路径一起保存 未保存的结点及其子树自快照以来没有变化
+#   fat: 块号 -> 修改前的FAT表项
+#   moved: 块号 -> 存放其原内容的副本块 原地改写快照前已在用的块时先复制一份
+#   held: 快照前已在用、之后被释放的块 留给快照 不再分配
+#   fresh: 快照之后分配的块 这些块的FAT表项与内容无需保存 释放时直接归还
+# 较早的快照k看到的状态: 依次查快照k, k+1, ..., 最新的快照中保存的原状态 都没有则为当前状态
+# 每个修改只需存入最新的快照 因为在它之前的快照里未保存的项目在两个快照之间没有变化
+
+# 文件记录 (文件名, 修改时间, 长度, 首块, 压缩算法, 帧)
+# 文件夹记录 (文件夹名, 修改时间, 子文件夹, 文件)
+def record_of(node):
+    if isinstance(node, FCB):
+        return node.file_name, node.modify_stamp, node.length, node.start_address, node.compression, node.frames
+    return node.dir_name, node.modify_stamp, dict(node.dir_index), dict(node.file_index)
+
+
+class Snapshot:
+    def __init__(self, name, time):
+        self.name = name
+        self.time = time
+        self.lock = threading.Lock()
+        self.nodes = {}
+        self.fat = {}
+        self.moved = {}
+        self.held = set()
+        self.fresh = set()
+
+    # 保存结点及其路径上尚未保存的结点
+    def preserve(self, node):
+        with self.lock:
+            while node is not None and node not in self.nodes:
+                self.nodes[node] = record_of(node)
+                node = node.parent
+
+    def preserve_fat(self, index, value):
+        if index not in self.fresh and index not in self.fat:
+            self.fat[index] = value
+
+    # 保存整张FAT 格式化时调用
+    def preserve_table(self, table, free):
+        for index, value in enumerate(table):
+            if value != free and index not in self.fresh and index not in self.fat:
+                self.fat[index] = value
+
+    # 需要复制原内容的块
+    def needs_copy(self, index):
+        return index not in self.fresh and index not in self.moved
+
+    # 释放块时调用 快照之前已在用的块留给快照 返回(留下的块, 可以释放的块)
+    def hold(self, blocks):
+        held = [index for index in blocks if index not in self.fresh]
+        released = [index for index in blocks if index in self.fresh]
+        self.held.update(held)
+        self.fresh.difference_update(released)
+        return held, released
+
+    # 只属于快照的块
+    def owned_blocks(self):
+        return self.held | set(self.moved.values())
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "time": self.time,
+            "nodes": len(self.nodes),
+            "fat_entries": len(self.fat),
+            "copied_blocks": len(self.moved),
+            "held_blocks": len(self.held),
+        }
+
+    # 删除本快照 把前一个快照还需要的原状态交给它 返回可以释放的块
+    def merge_into(self, previous):
+        blocks = []
+        if previous is None:
+            return list(self.owned_blocks())
+        for node, record in self.nodes.items():
+            previous.nodes.setdefault(node, record)
+        for index, value in self.fat.items():
+            if index not in previous.fresh:
+                previous.fat.setdefault(index, value)
+        for index, copy in self.moved.items():
+            if index in previous.moved or index in previous.fresh:
+                blocks.append(copy)
+            else:
+                previous.moved[index] = copy
+        for index in self.held:
+            if index in previous.fresh:
+                # 在前一个快照之后分配 又在本快照之后释放的块
+                blocks.append(index)
+                previous.fresh.discard(index)
+            else:
+                previous.held.add(index)
+        previous.fresh |= self.fresh
+        return blocks
+
+
+# 某个快照看到的卷 chain为该快照及其后的全部快照 为空时即当前状态
+class SnapshotView:
+    def __init__(self, fs, chain):
+        self.fs = fs
+        self.chain = chain
+        self.nodes = ChainMap(*(snapshot.nodes for snapshot in chain))
+        self.fat = ChainMap(*(snapshot.fat for snapshot in chain))
+        self.moved = ChainMap(*(snapshot.moved for snapshot in chain))
+
+    def record(self, node):
+        record = self.nodes.get(node)
+        return record if record is not None else record_of(node)
+
+    # 文件夹的(子文件夹, 文件) 未保存时直接返回当前的表 不复制
+    def children(self, node):
+        record = self.nodes.get(node)
+        if record is not None:
+            return record[2], record[3]
+        return node.dir_index, node.file_index
+
+    def resolve(self, path):
+        cursor = self.fs.file_tree.root
+        names = [x for x in path.split("/") if x != ""]
+        for i, name in enumerate(names):
+            dirs, files = self.children(cursor)
+            if name in dirs:
+                cursor = dirs[name]
+            elif i == len(names) - 1 and name in files:
+                return files[name]
+            else:
+                return None
+        return cursor
+
+    # 快照中文件的链 块号为当时的编号 内容被改写过的块换成副本
+    def blocks(self, start, count):
+        table = self.fs.fat.table
+        blocks = []
+        cursor = start
+        while cursor is not None and cursor != FAT_END and len(blocks) < count:
+            blocks.append(self.moved.get(cursor, cursor))
+            cursor = self.fat.get(cursor, table[cursor])
+        return blocks
+
+
+# 比较两个视图 changed为两者之间被保存过的结点 未保存的文件夹整棵子树相同 直接跳过
+# 返回[(变化, 路径)] 变化为added/removed/modified 重命名为("renamed", 原路径, 新路径)
+# 修改时间或长度不同的文件算作modified 文件夹以/结尾
+def diff_views(old: SnapshotView, new: SnapshotView, changed):
+    result = []
+    stack = [("", old.fs.file_tree.root)]
+    while stack:
+        path, node = stack.pop()
+        if node not in changed:
+            continue
+        old_dirs, old_files = old.children(node)
+        new_dirs, new_files = new.children(node)
+        for old_items, new_items, suffix in ((old_files, new_files, ""), (old_dirs, new_dirs, "/")):
+            new_names = {id(item): name for name, item in new_items.items()}
+            for name, item in old_items.items():
+                new_name = new_names.get(id(item))
+                if new_name is None:
+                    result.append(("removed", path + "/" + name + suffix))
+                    continue
+                if new_name != name:
+                    result.append(("renamed", path + "/" + name + suffix, path + "/" + new_name + suffix))
+                if suffix:
+                    stack.append((path + "/" + new_name, item))
+                elif item in changed and old.record(item)[1:3] != new.record(item)[1:3]:
+                    result.append(("modified", path + "/" + new_name))
+            old_ids = {id(item) for item in old_items.values()}
+            for name, item in new_items.items():
+                if id(item) not in old_ids:
+                    result.append(("added", path + "/" + name + suffix))
+    return result
@@ -0,0 +1,147 @@
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+
+# 被统计的FileSystem公开方法
+INSTRUMENTED = (
+    "find_free_index", "resolve",
+    "create_dir", "delete_dir", "rename_dir",
+    "create_file", "rename_file", "delete_file",
+    "open_and_read_bytes", "open_and_read_file", "write_and_close_file",
+    "pread", "pwrite", "truncate_file", "set_compression", "relocate_file",
+    "format", "grow", "save", "checkpoint",
+    "bulk_import", "apply_batch",
+)
+
+BUCKETS = 32  # 延迟直方图 第k格为[2^(k-1), 2^k)微秒
+
+
+# 按操作统计次数/延迟直方图/读写的块数
+# attach时用计时包装替换FileSystem实例上的方法 detach时恢复 未开启时没有任何额外开销
+# 嵌套调用(如open_and_read_file调用open_and_read_bytes)分别计入两个操作
+# 块计数为全局计数器在操作前后的差值 多线程并发时会互相计入
+# profile: 用cProfile记录开启统计的线程中的调用  trace_memory: 用tracemalloc跟踪内存分配
+class OperationStats:
+    def __init__(self, fs, profile=False, trace_memory=False):
+        self.fs = fs
+        self.lock = threading.Lock()
+        self.ops = {}
+        self.blocks_read = 0  # 由FileSystem在读写块时累加
+        self.blocks_written = 0
+        self.profiler = cProfile.Profile() if profile else None
+        self.trace_memory = trace_memory
+        self.started_tracing = False
+        self.started = time.perf_counter()
+
+    def attach(self):
+        for name in INSTRUMENTED:
+            setattr(self.fs, name, self.__wrap(name, getattr(self.fs, name)))
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def detach(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        for name in INSTRUMENTED:
+            self.fs.__dict__.pop(name, None)
+
+    def __wrap(self, name, method):
+        def timed(*args, **kwargs):
+            read, written = self.blocks_read, self.blocks_written
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - start,
+                            self.blocks_read - read, self.blocks_written - written)
+        timed.__wrapped__ = method
+        return timed
+
+    def record(self, name, elapsed, blocks_read=0, blocks_written=0):
+        with self.lock:
+            op = self.ops.get(name)
+            if op is None:
+                op = self.ops[name] = {"count": 0, "total": 0.0, "max": 0.0, "histogram": [0] * BUCKETS,
+                                       "blocks_read": 0, "blocks_written": 0}
+            op["count"] += 1
+            op["total"] += elapsed
+            op["max"] = max(op["max"], elapsed)
+            op["histogram"][min(int(elapsed * 1e6).bit_length(), BUCKETS - 1)] += 1
+            op["blocks_read"] += blocks_read
+            op["blocks_written"] += blocks_written
+
+    def reset(self):
+        with self.lock:
+            self.ops.clear()
+            self.blocks_read = self.blocks_written = 0
+            self.started = time.perf_counter()
+
+    # 由直方图估计分位数 返回所在格的上界(微秒)
+    @staticmethod
+    def percentile(histogram, fraction):
+        target = sum(histogram) * fraction
+        seen = 0
+        for k, n in enumerate(histogram):
+            seen += n
+            if n and seen >= target:
+                return 2 ** k
+        return 0
+
+    def to_dict(self, top=20):
+        with self.lock:
+            ops = {}
+            for name, op in sorted(self.ops.items()):
+                histogram = op["histogram"]
+                ops[name] = {
+                    "count": op["count"],
+                    "total_sec": op["total"],
+                    "mean_us": op["total"] / op["count"] * 1e6,
+                    "max_us": op["max"] * 1e6,
+                    "p50_us": self.percentile(histogram, 0.5),
+                    "p99_us": self.percentile(histogram, 0.99),
+                    # 格的上界(微秒) -> 次数
+                    "histogram": {str(2 ** k): n for k, n in enumerate(histogram) if n},
+                    "blocks_read": op["blocks_read"],
+                    "blocks_written": op["blocks_written"],
+                }
+        result = {"elapsed_sec": time.perf_counter() - self.started, "ops": ops}
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            result["memory"] = {
+                "current_bytes": current,
+                "peak_bytes": peak,
+                "top": [{"where": str(stat.traceback[0]), "bytes": stat.size, "count": stat.count}
+                        for stat in snapshot.statistics("lineno")[:top]],
+            }
+        if self.profiler is not None:
+            stats = pstats.Stats(self.profiler)
+            rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+            result["profile"] = [{"function": "%s:%d(%s)" % key, "calls": value[1],
+                                  "tottime": value[2], "cumtime": value[3]} for key, value in rows]
+        return result
+
+    def dump(self, path, **extra):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dict(self.to_dict(), **extra), f, ensure_ascii=False, indent=2)
+
+    # cProfile的文本报告 按自身耗时排序
+    def profile_report(self, limit=20):
+        if self.profiler is None:
+            return ""
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats("tottime").print_stats(limit)
+        return out.getvalue()
+
+    def close(self):
+        self.detach()
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from file_system_components import FileSystem
+from file_system_fsck import fsck
+
+# 各test_file_system_*.py共用的测试基类
+# 每个测试有自己的临时目录 self.image为其中的镜像路径 测试结束后删除
+# 新建的卷不含演示用的目录树 块较小 便于构造多块的文件
+
+
+class VolumeTestCase(unittest.TestCase):
+    BLOCK_SIZE = 16
+    BLOCK_NUM = 4096
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.image = os.path.join(self.workdir, "image")
+
+    def new_volume(self, system_info_file=None, **kwargs):
+        kwargs.setdefault("block_size", self.BLOCK_SIZE)
+        kwargs.setdefault("block_num", self.BLOCK_NUM)
+        return FileSystem(system_info_file, demo=False, **kwargs)
+
+    # 打开self.image 测试结束时关闭
+    def open_image(self, **kwargs):
+        fs = FileSystem(self.image, demo=False, **kwargs)
+        self.addCleanup(fs.close)
+        return fs
+
+    @staticmethod
+    def write(fs, path, data):
+        fs.apply_batch([("write", path, data)])
+
+    @staticmethod
+    def read(fs, path):
+        return bytes(fs.open_and_read_bytes(fs.resolve(path)))
+
+    def assertConsistent(self, fs):
+        report = fsck(fs)
+        self.assertEqual(report["errors"], 0, report)
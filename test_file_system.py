@@ -0,0 +1,231 @@
+import unittest
+
+from file_system_components import FAT_FREE, count_refs
+from file_system_testing import VolumeTestCase
+
+
+class RenameTest(VolumeTestCase):
+    def test_rename_file_onto_existing_name(self):
+        fs = self.new_volume()
+        root = fs.file_tree.root
+        a = fs.create_file("a", root)
+        b = fs.create_file("b", root)
+        self.write(fs, "/a", b"a" * 100)
+        self.write(fs, "/b", b"b" * 100)
+        with self.assertRaises(FileExistsError):
+            fs.rename_file(a, "b", root)
+        self.assertIs(fs.resolve("/a"), a)
+        self.assertIs(fs.resolve("/b"), b)
+        self.assertConsistent(fs)
+        # 改为原名不算冲突
+        fs.rename_file(a, "a", root)
+        self.assertIs(fs.resolve("/a"), a)
+
+    def test_rename_dir_onto_existing_name(self):
+        fs = self.new_volume()
+        root = fs.file_tree.root
+        fs.apply_batch([("mkdir", "/", "x"), ("mkdir", "/", "y"), ("create", "/y", "f"), ("write", "/y/f", b"f")])
+        with self.assertRaises(FileExistsError):
+            fs.apply_batch([("mvdir", "/x", "y")])
+        self.assertEqual(self.read(fs, "/y/f"), b"f")
+        self.assertEqual(sorted(root.dir_index), ["x", "y"])
+        self.assertConsistent(fs)
+
+    # 已删除的文件夹不能再改名 否则日志中记下的路径是根目录
+    def test_rename_deleted_dir(self):
+        fs = self.new_volume(self.image, journal=True)
+        root = fs.file_tree.root
+        node = fs.create_dir(root, "x", root.create_time)
+        fs.delete_dir(node)
+        with self.assertRaises(FileNotFoundError):
+            fs.rename_dir(node, "y")
+        self.assertEqual(root.dir_name, "/")
+        fs.close()
+        fs = self.open_image(journal=True)
+        self.assertEqual(fs.file_tree.root.dir_name, "/")
+        self.assertEqual(fs.file_tree.root.dir_index, {})
+
+
+class FileHandleTest(VolumeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fs = self.new_volume()
+        self.fs.apply_batch([("create", "/", "a"), ("write", "/a", bytes(range(160))),
+                             ("create", "/", "b"), ("write", "/b", b"b" * 160)])
+
+    def test_invalid_mode(self):
+        for mode in ("x", "rw", "", "wb"):
+            with self.assertRaises(ValueError):
+                self.fs.open("/a", mode)
+        with self.assertRaises(ValueError):
+            self.fs.open("/missing", "x")
+
+    def test_other_files_keep_cached_chain(self):
+        fs = self.fs
+        with fs.open("/a") as handle:
+            self.assertEqual(handle.read(80), bytes(range(80)))
+            chain = list(handle.chain)
+            # 改写/截断/删除其他文件 不影响这个句柄缓存的链
+            fs.pwrite(fs.resolve("/b"), 100, b"x" * 100)
+            fs.truncate_file(fs.resolve("/b"), 10)
+            fs.delete_file(fs.resolve("/b"))
+            self.assertEqual(handle.read(), bytes(range(80, 160)))
+            self.assertEqual(handle.chain[:len(chain)], chain)
+            self.assertEqual(handle.epoch, (fs.chain_epoch, handle.fcb.epoch))
+
+    def test_own_chain_change_refreshes_cache(self):
+        fs = self.fs
+        with fs.open("/a", "r+") as handle:
+            self.assertEqual(handle.read(), bytes(range(160)))
+            fs.truncate_file(handle.fcb, 40)
+            fs.write_and_close_file(b"new" * 50, handle.fcb)
+            handle.seek(0)
+            self.assertEqual(handle.read(), b"new" * 50)
+            handle.seek(0, 2)
+            handle.write(b"!")
+            self.assertEqual(self.read(fs, "/a"), b"new" * 50 + b"!")
+        self.assertConsistent(fs)
+
+
+class SameNameTest(VolumeTestCase):
+    def test_file_and_dir_cannot_share_a_name(self):
+        fs = self.new_volume()
+        root = fs.file_tree.root
+        fcb = fs.create_file("x", root)
+        self.assertIsNone(fs.create_dir(root, "x", fcb.create_time))
+        node = fs.create_dir(root, "y", fcb.create_time)
+        self.assertIsNone(fs.create_file("y", root))
+        with self.assertRaises(FileExistsError):
+            fs.rename_file(fcb, "y", root)
+        with self.assertRaises(FileExistsError):
+            fs.rename_dir(node, "x")
+        with self.assertRaises(FileExistsError):
+            fs.bulk_import(root, [("x/f", b"f", None)])
+        with self.assertRaises(FileExistsError):
+            fs.bulk_import(root, [("y", b"y", None)])
+        self.assertConsistent(fs)
+
+    def test_journal_replay_with_clashing_names(self):
+        fs = self.new_volume(self.image, journal=True)
+        fs.apply_batch([("create", "/", "x"), ("mkdir", "/", "x"), ("write", "/x", b"data")])
+        fs.close()
+        fs = self.open_image(journal=True)
+        self.assertEqual(self.read(fs, "/x"), b"data")
+
+
+class GrowTest(VolumeTestCase):
+    def fill(self, fs):
+        fs.apply_batch([("create", "/", "a"), ("write", "/a", b"a" * 16 * fs.block_num)])
+        with self.assertRaises(AssertionError):
+            fs.apply_batch([("create", "/", "b"), ("write", "/b", b"b")])
+
+    def test_grow_full_volume(self):
+        fs = self.new_volume(block_num=64)
+        self.fill(fs)
+        fs.grow(32)
+        self.assertEqual((fs.block_num, fs.fat.block_num, fs.disk.block_num), (96, 96, 96))
+        self.assertEqual((len(fs.fat.table), len(fs.free_space.bitmap), fs.allocator.free_num), (96, 96, 32))
+        self.write(fs, "/b", b"b" * 16 * 32)
+        self.assertEqual(fs.chain_of(fs.resolve("/b")), list(range(64, 96)))
+        self.assertEqual(self.read(fs, "/a"), b"a" * 16 * 64)
+        self.assertConsistent(fs)
+
+    # 扩容后的块数随镜像保存 映射镜像的磁盘也能扩展
+    def test_grow_mounted_image(self):
+        for lazy in (False, True):
+            fs = self.new_volume(block_num=64)
+            self.fill(fs)
+            fs.save(self.image)
+            fs.close()
+            fs = self.open_image(lazy=lazy)
+            fs.grow(1000)
+            self.write(fs, "/b", b"b" * 16 * 500)
+            fs.save(self.image)
+            fs.close()
+            fs = self.open_image(lazy=lazy)
+            self.assertEqual(fs.block_num, 1064)
+            self.assertEqual(self.read(fs, "/a"), b"a" * 16 * 64)
+            self.assertEqual(self.read(fs, "/b"), b"b" * 16 * 500)
+            self.assertConsistent(fs)
+
+    # 扩容写入日志 重放时先扩容再写入
+    def test_journal_replay(self):
+        fs = self.new_volume(self.image, block_num=64, journal=True)
+        self.fill(fs)
+        fs.grow(64)
+        self.write(fs, "/b", b"b" * 16 * 40)
+        fs.close()
+        fs = self.open_image(journal=True)
+        self.assertEqual(fs.block_num, 128)
+        self.assertEqual(self.read(fs, "/b"), b"b" * 16 * 40)
+        self.assertConsistent(fs)
+
+
+class DedupTest(VolumeTestCase):
+    BODY = bytes(range(256)) * 2  # 32块
+
+    def setUp(self):
+        super().setUp()
+        self.fs = self.new_volume(dedup=True)
+        root = self.fs.file_tree.root
+        self.a = self.fs.create_file("a", root)
+        self.b = self.fs.create_file("b", root)
+        # 首块不同 其后的块相同
+        self.fs.write_and_close_file(b"A" * 16 + self.BODY, self.a)
+        self.fs.write_and_close_file(b"B" * 16 + self.BODY, self.b)
+
+    def check(self):
+        fs = self.fs
+        self.assertEqual(fs.refs, count_refs(fs.fat.table))
+        self.assertConsistent(fs)
+
+    def test_identical_tails_share_blocks(self):
+        fs = self.fs
+        stats = fs.dedup_stats()
+        self.assertEqual(stats["logical_blocks"], 66)
+        self.assertEqual(stats["physical_blocks"], 34)
+        # 首块从不共用
+        self.assertNotEqual(self.a.start_address, self.b.start_address)
+        self.assertNotIn(self.a.start_address, fs.refs)
+        self.assertEqual(fs.chain_of(self.a)[1:], fs.chain_of(self.b)[1:])
+        self.check()
+
+    def test_pwrite_copies_shared_blocks(self):
+        fs = self.fs
+        fs.pwrite(self.a, 100, b"!" * 20)
+        expected = bytearray(b"A" * 16 + self.BODY)
+        expected[100:120] = b"!" * 20
+        self.assertEqual(bytes(fs.open_and_read_bytes(self.a)), bytes(expected))
+        self.assertEqual(bytes(fs.open_and_read_bytes(self.b)), b"B" * 16 + self.BODY)
+        self.check()
+
+    def test_truncate_leaves_other_file_intact(self):
+        fs = self.fs
+        fs.truncate_file(self.a, 40)
+        fs.truncate_file(self.b, 600)
+        self.assertEqual(bytes(fs.open_and_read_bytes(self.a)), (b"A" * 16 + self.BODY)[:40])
+        self.assertEqual(bytes(fs.open_and_read_bytes(self.b)), b"B" * 16 + self.BODY + bytes(600 - 528))
+        self.check()
+
+    def test_delete_drops_references(self):
+        fs = self.fs
+        fs.delete_file(self.a)
+        self.assertEqual(bytes(fs.open_and_read_bytes(self.b)), b"B" * 16 + self.BODY)
+        self.assertEqual(fs.refs, {})
+        self.check()
+        fs.delete_file(self.b)
+        self.assertEqual(fs.fat.table.count(FAT_FREE), fs.block_num)
+        self.check()
+
+    def test_rewrite_reuses_existing_tail(self):
+        fs = self.fs
+        c = fs.create_file("c", fs.file_tree.root)
+        hits = fs.dedup_hits
+        fs.write_and_close_file(b"C" * 16 + self.BODY, c)
+        self.assertEqual(fs.dedup_hits - hits, 32)
+        self.assertEqual(fs.refs[fs.chain_of(c)[1]], 3)
+        self.check()
+
+
+if __name__ == '__main__':
+    unittest.main()
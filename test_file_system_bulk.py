@@ -0,0 +1,161 @@
+import io
+import os
+import tarfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from file_system_bulk import export_tar, export_tree, import_tar, import_tree
+from file_system_components import FCB
+from file_system_testing import VolumeTestCase
+
+
+class BulkPathTest(VolumeTestCase):
+    def make_tar(self, *names):
+        path = os.path.join(self.workdir, "in.tar")
+        with tarfile.open(path, "w") as tar:
+            for name in names:
+                info = tarfile.TarInfo(name)
+                info.size = 1
+                tar.addfile(info, io.BytesIO(b"x"))
+        return path
+
+    def test_import_rejects_parent_references(self):
+        fs = self.new_volume()
+        with self.assertRaises(ValueError):
+            import_tar(fs, self.make_tar("ok.txt", "../escaped.txt"))
+        with self.assertRaises(ValueError):
+            fs.bulk_import(fs.file_tree.root, [("a/../../b", b"x", None)])
+        self.assertEqual(fs.file_tree.root.size(), 0)
+
+    def test_import_strips_absolute_names(self):
+        fs = self.new_volume()
+        self.assertEqual(import_tar(fs, self.make_tar("/abs/f.txt")), 1)
+        self.assertIsInstance(fs.resolve("/abs/f.txt"), FCB)
+
+    def test_export_refuses_unsafe_names(self):
+        fs = self.new_volume()
+        root = fs.file_tree.root
+        node = fs.create_dir(root, "..", root.create_time)
+        fs.write_and_close_file(b"x", fs.create_file("escaped.txt", node))
+        out = os.path.join(self.workdir, "out")
+        with self.assertRaises(ValueError):
+            export_tree(fs, out)
+        self.assertFalse(os.path.exists(os.path.join(self.workdir, "escaped.txt")))
+        with self.assertRaises(ValueError):
+            export_tar(fs, os.path.join(self.workdir, "out.tar"))
+        fs.rename_dir(node, "a/b")
+        with self.assertRaises(ValueError):
+            export_tree(fs, out)
+        fs.rename_dir(node, "safe")
+        self.assertEqual(export_tree(fs, out), 1)
+        self.assertTrue(os.path.isfile(os.path.join(out, "safe", "escaped.txt")))
+
+
+
+class BulkImportTest(VolumeTestCase):
+    TIME = datetime(2020, 1, 2, 3, 4, 5)
+
+    def make_tree(self):
+        host = os.path.join(self.workdir, "host")
+        os.makedirs(os.path.join(host, "a", "b"))
+        os.makedirs(os.path.join(host, "empty"))
+        for rel, data in (("top.txt", b"top"), ("a/f", b"f" * 40), ("a/b/g", b"")):
+            path = os.path.join(host, *rel.split("/"))
+            with open(path, "wb") as f:
+                f.write(data)
+            os.utime(path, (self.TIME.timestamp(),) * 2)
+        return host
+
+    def listing(self, host):
+        result = {}
+        for current, dirs, files in os.walk(host):
+            rel = os.path.relpath(current, host)
+            result.update({os.path.join(rel, name): None for name in dirs})
+            for name in files:
+                path = os.path.join(current, name)
+                with open(path, "rb") as f:
+                    result[os.path.join(rel, name)] = (f.read(), os.stat(path).st_mtime)
+        return result
+
+    def test_tree_round_trip(self):
+        fs = self.new_volume()
+        host = self.make_tree()
+        self.assertEqual(import_tree(fs, host), 3)
+        self.assertEqual(fs.resolve("/a/f").modify_time, self.TIME)
+        self.assertIsNotNone(fs.resolve("/empty"))
+        out = os.path.join(self.workdir, "out")
+        self.assertEqual(export_tree(fs, out), 3)
+        self.assertEqual(self.listing(out), self.listing(host))
+        self.assertConsistent(fs)
+
+    def test_tar_round_trip(self):
+        fs = self.new_volume()
+        import_tree(fs, self.make_tree())
+        path = os.path.join(self.workdir, "out.tar")
+        self.assertEqual(export_tar(fs, path, fs.resolve("/a")), 2)
+        other = self.new_volume()
+        self.assertEqual(import_tar(other, path), 2)
+        self.assertEqual(self.read(other, "/f"), b"f" * 40)
+        self.assertEqual(self.read(other, "/b/g"), b"")
+        self.assertEqual(other.resolve("/f").modify_time, self.TIME)
+
+    # 同名文件夹合并 同名文件覆盖 整个导入只写一条日志
+    def test_merge_and_journal(self):
+        fs = self.new_volume(self.image, journal=True)
+        fs.apply_batch([("mkdir", "/", "a"), ("create", "/a", "old"), ("write", "/a/old", b"old"),
+                        ("create", "/a", "f"), ("write", "/a/f", b"previous" * 10)])
+        with mock.patch.object(fs.journal, "append", wraps=fs.journal.append) as append:
+            self.assertEqual(fs.bulk_import(fs.file_tree.root, [("a/f", b"new", None), ("a/c/d", "text", None),
+                                                                ("./x", b"x" * 50, self.TIME)]), 3)
+        self.assertEqual(append.call_count, 1)
+        expected = {"/a/old": b"old", "/a/f": b"new", "/a/c/d": b"text", "/x": b"x" * 50}
+        fs.close()
+        fs = self.open_image(journal=True)
+        for path, data in expected.items():
+            self.assertEqual(self.read(fs, path), data)
+        self.assertEqual(fs.resolve("/x").modify_time, self.TIME)
+        self.assertConsistent(fs)
+
+    # 空间不足时不做任何修改
+    def test_not_enough_space(self):
+        fs = self.new_volume(block_num=16)
+        with self.assertRaises(AssertionError):
+            fs.bulk_import(fs.file_tree.root, [("d/a", b"a" * 128, None), ("b", b"b" * 129, None)])
+        self.assertEqual(fs.file_tree.root.size(), 0)
+        self.assertEqual(fs.allocator.free_num, 16)
+
+
+class ApplyBatchTest(VolumeTestCase):
+    def test_results_and_single_record(self):
+        fs = self.new_volume(self.image, journal=True)
+        with mock.patch.object(fs.journal, "append", wraps=fs.journal.append) as append:
+            results = fs.apply_batch([("mkdir", "/", "d"), ("create", "/d", "f"), ("write", "/d/f", "hello"),
+                                      ("pwrite", "/d/f", 5, b" world"), ("truncate", "/d/f", 8),
+                                      ("mv", "/d/f", "g"), ("mvdir", "/d", "e")])
+        self.assertEqual(append.call_count, 1)
+        self.assertIs(results[1], fs.resolve("/e/g"))
+        self.assertEqual(results[3], 6)
+        # 同一批操作的修改时间相同
+        self.assertEqual(fs.resolve("/e").create_time, fs.resolve("/e/g").modify_time)
+        fs.close()
+        fs = self.open_image(journal=True)
+        self.assertEqual(self.read(fs, "/e/g"), b"hello wo")
+
+    # 失败之前的操作仍然生效并记入日志
+    def test_failure_keeps_earlier_operations(self):
+        fs = self.new_volume(self.image, journal=True)
+        with self.assertRaises(FileNotFoundError):
+            fs.apply_batch([("create", "/", "f"), ("write", "/f", b"kept"), ("rm", "/missing"), ("mkdir", "/", "d")])
+        with self.assertRaises(ValueError):
+            fs.apply_batch([("chmod", "/f")])
+        self.assertIsNone(fs.resolve("/d"))
+        fs.close()
+        fs = self.open_image(journal=True)
+        self.assertEqual(self.read(fs, "/f"), b"kept")
+        self.assertIsNone(fs.resolve("/d"))
+        self.assertConsistent(fs)
+
+
+if __name__ == '__main__':
+    unittest.main()
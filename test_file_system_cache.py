@@ -0,0 +1,99 @@
+import unittest
+
+from file_system_cache import ARCPolicy, BlockCache, LRUPolicy
+from file_system_components import FAT, FAT_END, Disk
+from file_system_testing import VolumeTestCase
+
+
+class PolicyTest(unittest.TestCase):
+    def test_lru_evicts_least_recent(self):
+        policy = LRUPolicy(3)
+        for key in (1, 2, 3):
+            self.assertEqual(policy.admit(key), [])
+        policy.hit(1)
+        self.assertEqual(policy.admit(4), [2])
+        self.assertEqual(policy.admit(5), [3])
+        self.assertEqual(list(policy.order), [1, 4, 5])
+
+    # 反复访问的块不会被一次顺序扫描冲掉 LRU则会
+    def test_arc_resists_scan(self):
+        for policy, survives in ((LRUPolicy(8), False), (ARCPolicy(8), True)):
+            hot = range(4)
+            for key in hot:
+                policy.admit(key)
+                policy.hit(key)
+            for key in range(100, 120):
+                policy.admit(key)
+            self.assertEqual(all(key in policy for key in hot), survives, type(policy).__name__)
+
+    def test_arc_ghost_hit_adapts(self):
+        policy = ARCPolicy(4)
+        for key in (0, 1):
+            policy.admit(key)
+            policy.hit(key)
+        policy.admit(2)
+        policy.admit(3)
+        self.assertEqual(policy.admit(4), [2])
+        self.assertEqual(policy.p, 0)
+        # 刚被换出的块再次访问 命中B1 T1的目标大小增大
+        self.assertIn(2, policy.b1)
+        self.assertEqual(policy.admit(2), [3])
+        self.assertEqual(policy.p, 1)
+        self.assertEqual((list(policy.t1), list(policy.t2)), ([4], [0, 1, 2]))
+        self.assertEqual(list(policy.b1), [3])
+
+
+class BlockCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.disk = Disk(64, 16)
+        self.fat = FAT(64)
+        for index in range(10):
+            self.disk.write_block(index, bytes([index]) * 16)
+            self.fat.set(index, index + 1 if index < 9 else FAT_END)
+
+    # 写入只改缓存 换出或flush时才写回磁盘
+    def test_write_back(self):
+        cache = BlockCache(self.disk, self.fat, capacity=2, read_ahead=0)
+        cache.write_block(20, b"x" * 16)
+        cache.write_block(21, b"yy", 4)
+        self.assertEqual(self.disk.read_block(20), bytes(16))
+        self.assertEqual(cache.read_block(21), bytes(4) + b"yy" + bytes(10))
+        cache.write_block(22, b"z" * 16)
+        self.assertEqual(self.disk.read_block(20), b"x" * 16)
+        self.assertEqual(cache.stats()["writebacks"], 1)
+        cache.flush()
+        self.assertEqual(self.disk.read_block(21), bytes(4) + b"yy" + bytes(10))
+        self.assertEqual(self.disk.read_block(22), b"z" * 16)
+        self.assertEqual(cache.stats()["dirty"], 0)
+
+    def test_read_ahead_follows_chain(self):
+        cache = BlockCache(self.disk, self.fat, capacity=16, read_ahead=4)
+        self.assertEqual(cache.read_block(0), bytes([0]) * 16)
+        for index in range(1, 5):
+            self.assertEqual(cache.read_block(index), bytes([index]) * 16)
+        stats = cache.stats()
+        self.assertEqual((stats["misses"], stats["hits"], stats["prefetches"]), (1, 4, 4))
+        # 链尾不再预读
+        cache.read_block(8)
+        self.assertEqual(cache.stats()["prefetches"], 5)
+
+
+class CachedVolumeTest(VolumeTestCase):
+    def test_cached_volume_saves_dirty_blocks(self):
+        for policy in ("lru", "arc"):
+            fs = self.new_volume(cache_blocks=8, cache_policy=policy)
+            data = bytes(range(256)) * 2
+            fs.apply_batch([("create", "/", "f"), ("write", "/f", data), ("pwrite", "/f", 100, b"new")])
+            expected = data[:100] + b"new" + data[103:]
+            self.assertEqual(self.read(fs, "/f"), expected)
+            self.assertLessEqual(fs.cache.stats()["resident"], 8)
+            fs.save(self.image)
+            self.assertEqual(fs.cache.stats()["dirty"], 0)
+            fs.close()
+            fs = self.open_image()
+            self.assertEqual(self.read(fs, "/f"), expected)
+            self.assertConsistent(fs)
+
+
+if __name__ == '__main__':
+    unittest.main()
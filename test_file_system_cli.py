@@ -0,0 +1,96 @@
+import os
+import stat
+import threading
+import time
+import unittest
+
+from file_system_cli import command_argv, request, run_command, serve
+from file_system_testing import VolumeTestCase
+
+
+class CliTest(VolumeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fs = self.new_volume()
+
+    def run_ok(self, *argv, data=None):
+        status, output, error = run_command(self.fs, list(argv), data)
+        self.assertEqual((status, error), (0, ""))
+        return output.decode("utf-8")
+
+    # 选项的值与命令同名时 仍按argparse切出命令
+    def test_command_argv(self):
+        self.assertEqual(command_argv(["--socket", "ls", "ls", "-l", "/"]), ["ls", "-l", "/"])
+        self.assertEqual(command_argv(["--image", "img", "--socket", "s", "cat", "/a"]), ["cat", "/a"])
+        self.assertEqual(command_argv(["write", "/a", "--image"]), ["write", "/a", "--image"])
+
+    def test_commands(self):
+        self.run_ok("mkdir", "-p", "/a/b")
+        self.run_ok("write", "/a/b/f", "hello")
+        self.run_ok("write", "/a/g", data=b"x" * 40)
+        self.assertEqual(self.run_ok("cat", "/a/b/f"), "hello")
+        self.assertEqual(self.run_ok("ls", "/a"), "b/\ng\n")
+        self.assertRegex(self.run_ok("ls", "-l", "/"), r"^\s+45  .*  a/\n$")
+        self.run_ok("mv", "/a/g", "h")
+        self.assertIn("size: 40\n", self.run_ok("stat", "/a/h"))
+        self.assertIn("files: 2\n", self.run_ok("stat", "/a"))
+        self.assertIn("errors: 0\n", self.run_ok("fsck"))
+        self.assertEqual(run_command(self.fs, ["rm", "/a"])[0], 1)
+        self.run_ok("rm", "-r", "/a")
+        self.assertEqual(self.run_ok("ls"), "")
+        self.assertConsistent(self.fs)
+
+    def test_errors(self):
+        self.assertEqual(run_command(self.fs, ["cat", "/missing"])[0], 1)
+        self.assertEqual(run_command(self.fs, ["mkdir", "/a/b"])[0], 1)
+        self.assertEqual(run_command(self.fs, ["nope"])[0], 2)
+
+    # ls -l与同一文件夹中的mkdir并发执行 不能互相等待
+    def test_ls_long_with_concurrent_mkdir(self):
+        for _ in range(20):
+            fs = self.new_volume()
+            fs.apply_batch([("mkdir", "/", "d%d" % i) for i in range(10)])
+            errors = []
+
+            def ls():
+                status, output, error = run_command(fs, ["ls", "-l", "/"])
+                if status:
+                    errors.append(error)
+
+            def mkdir():
+                for i in range(10):
+                    run_command(fs, ["mkdir", "/x%d" % i])
+
+            threads = [threading.Thread(target=ls, daemon=True), threading.Thread(target=mkdir, daemon=True)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+                self.assertFalse(thread.is_alive(), "deadlock")
+            self.assertEqual(errors, [])
+            self.assertEqual(len(fs.file_tree.root.dir_index), 20)
+
+
+class DaemonTest(VolumeTestCase):
+    def test_serve(self):
+        self.new_volume().save(self.image)
+        sock = os.path.join(self.workdir, "sock")
+        thread = threading.Thread(target=serve, args=(self.image, sock), daemon=True)
+        thread.start()
+        for _ in range(500):
+            if os.path.exists(sock):
+                break
+            time.sleep(0.01)
+        # 套接字只允许本用户访问
+        self.assertEqual(stat.S_IMODE(os.stat(sock).st_mode), 0o600)
+        self.assertEqual(request(sock, ["write", "/f"], b"daemon")[0], 0)
+        self.assertEqual(request(sock, ["cat", "/f"]), (0, b"daemon", ""))
+        self.assertEqual(request(sock, ["stop"])[0], 0)
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        fs = self.open_image()
+        self.assertEqual(self.read(fs, "/f"), b"daemon")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import random
+import unittest
+from unittest import mock
+
+from file_system_components import COMPRESSORS, FRAME_SIZE
+from file_system_testing import VolumeTestCase
+
+
+class CompressionTest(VolumeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fs = self.new_volume()
+        rng = random.Random(2)
+        # 可压缩但不是常量 跨三帧多一点
+        self.data = bytes(rng.choice(b"abcd") for _ in range(3 * FRAME_SIZE + 100))
+        self.fs.apply_batch([("create", "/", "f"), ("write", "/f", self.data)])
+        self.fcb = self.fs.resolve("/f")
+
+    def test_round_trip(self):
+        fs = self.fs
+        raw_blocks = fs.block_count(self.fcb)
+        for compression in ("zlib", "lzma", None):
+            fs.set_compression(self.fcb, compression)
+            self.assertEqual(self.fcb.compression, compression)
+            self.assertEqual(self.read(fs, "/f"), self.data)
+            self.assertEqual(len(fs.chain_of(self.fcb)), fs.block_count(self.fcb))
+            self.assertConsistent(fs)
+        self.assertEqual(fs.block_count(self.fcb), raw_blocks)
+        fs.set_compression(self.fcb, "zlib")
+        self.assertEqual(len(self.fcb.frames), 4)
+        self.assertLess(fs.block_count(self.fcb), raw_blocks // 2)
+        with self.assertRaises(ValueError):
+            fs.set_compression(self.fcb, "rar")
+
+    def test_pread_across_frames(self):
+        fs = self.fs
+        fs.set_compression(self.fcb, "zlib")
+        for offset, size in ((0, 10), (FRAME_SIZE - 5, 10), (FRAME_SIZE * 2 - 1, FRAME_SIZE + 2),
+                             (len(self.data) - 3, 10), (len(self.data) + 5, 10), (0, -1)):
+            expected = self.data[offset:] if size < 0 else self.data[offset:offset + size]
+            self.assertEqual(fs.pread(self.fcb, offset, size), expected)
+
+    # 顺序小块读取时 每帧只解压一次
+    def test_sequential_reads_decompress_each_frame_once(self):
+        fs = self.fs
+        fs.set_compression(self.fcb, "zlib")
+        compress, decompress = COMPRESSORS["zlib"]
+        spy = mock.Mock(wraps=decompress)
+        with mock.patch.dict(COMPRESSORS, {"zlib": (compress, spy)}):
+            with fs.open("/f") as handle:
+                data = b"".join(handle.chunks(100))
+        self.assertEqual(data, self.data)
+        self.assertEqual(spy.call_count, 4)
+
+    def test_pwrite_and_truncate(self):
+        fs = self.fs
+        fs.set_compression(self.fcb, "lzma")
+        expected = bytearray(self.data)
+        fs.pwrite(self.fcb, FRAME_SIZE - 2, b"xyzw")
+        expected[FRAME_SIZE - 2:FRAME_SIZE + 2] = b"xyzw"
+        fs.pwrite(self.fcb, len(expected) + 10, b"tail")
+        expected += bytes(10) + b"tail"
+        self.assertEqual(self.read(fs, "/f"), bytes(expected))
+        fs.truncate_file(self.fcb, FRAME_SIZE + 1)
+        del expected[FRAME_SIZE + 1:]
+        self.assertEqual(len(self.fcb.frames), 2)
+        self.assertEqual(self.read(fs, "/f"), bytes(expected))
+        fs.truncate_file(self.fcb, FRAME_SIZE + 50)
+        expected += bytes(49)
+        self.assertEqual(self.read(fs, "/f"), bytes(expected))
+        self.assertEqual(self.fcb.compression, "lzma")
+        self.assertConsistent(fs)
+
+    # 压缩方式与帧随镜像保存
+    def test_save_and_reopen(self):
+        fs = self.fs
+        fs.set_compression(self.fcb, "zlib")
+        frames = self.fcb.frames
+        fs.save(self.image)
+        fs.close()
+        fs = self.open_image()
+        fcb = fs.resolve("/f")
+        self.assertEqual((fcb.compression, fcb.frames), ("zlib", frames))
+        self.assertEqual(self.read(fs, "/f"), self.data)
+        self.write(fs, "/f", b"short")
+        self.assertEqual(len(fcb.frames), 1)
+        fs.save(self.image)
+        fs.close()
+        fs = self.open_image()
+        self.assertEqual(self.read(fs, "/f"), b"short")
+        self.assertConsistent(fs)
+
+
+if __name__ == '__main__':
+    unittest.main()
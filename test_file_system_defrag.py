@@ -0,0 +1,81 @@
+import unittest
+
+from file_system_defrag import Defragmenter, fragmentation
+from file_system_testing import VolumeTestCase
+
+
+class DefragTest(VolumeTestCase):
+    FILE_NUM = 10
+
+    def setUp(self):
+        super().setUp()
+        fs = self.fs = self.new_volume(block_num=256)
+        fs.apply_batch([("create", "/", "f%d" % i) for i in range(self.FILE_NUM)])
+        # 轮流追加 每个文件的块交错分布
+        for _ in range(4):
+            fs.apply_batch([("pwrite", "/f%d" % i, fs.resolve("/f%d" % i).length, b"%d" % i * 16)
+                            for i in range(self.FILE_NUM)])
+        # 删除一半 留下空洞
+        fs.apply_batch([("rm", "/f%d" % i) for i in range(0, self.FILE_NUM, 2)])
+        self.files = {"/f%d" % i: b"%d" % i * 64 for i in range(1, self.FILE_NUM, 2)}
+
+    def check_files(self):
+        for path, data in self.files.items():
+            self.assertEqual(self.read(self.fs, path), data)
+        self.assertConsistent(self.fs)
+
+    def test_fragmentation_metrics(self):
+        report = fragmentation(self.fs)
+        self.assertEqual(report["files"], 5)
+        self.assertEqual(report["blocks"], 20)
+        self.assertEqual(report["fragmented_files"], 5)
+        self.assertEqual(report["extents"], 20)
+        self.assertEqual(report["fragmentation"], 1.0)
+        self.assertGreater(report["free_extents"], 1)
+
+    # 整理后每个文件连续 空闲区间减少
+    def test_run(self):
+        report = Defragmenter(self.fs).run()
+        self.assertEqual(report["moved"], 5)
+        before, after = report["before"], report["after"]
+        self.assertEqual((after["fragmented_files"], after["extents"], after["fragmentation"]), (0, 5, 0))
+        self.assertLess(after["free_extents"], before["free_extents"])
+        self.assertEqual(after["blocks"], 20)
+        self.assertEqual(self.fs.allocator.free_num, 256 - 20)
+        self.check_files()
+        # 连续的文件前移 重复整理直到没有可搬动的文件
+        while Defragmenter(self.fs).run()["moved"]:
+            pass
+        self.assertEqual(fragmentation(self.fs)["fragmented_files"], 0)
+        self.check_files()
+
+    # 时间片为0时每次step只处理一个文件 期间删除或改写文件不影响整理
+    def test_incremental_steps(self):
+        fs = self.fs
+        defragmenter = Defragmenter(fs)
+        self.assertFalse(defragmenter.step(0))
+        self.assertEqual(defragmenter.moved, 1)
+        fs.apply_batch([("rm", "/f9"), ("write", "/f7", b"new" * 30)])
+        del self.files["/f9"]
+        self.files["/f7"] = b"new" * 30
+        steps = 1
+        while not defragmenter.step(0):
+            steps += 1
+        self.assertEqual(steps, 4)
+        self.assertEqual(defragmenter.report()["after"]["fragmented_files"], 0)
+        self.check_files()
+
+    # 挂载镜像时旧块延迟释放 保存后重新打开内容不变
+    def test_mounted_image(self):
+        fs = self.fs
+        fs.save(self.image)
+        Defragmenter(fs).run()
+        fs.save(self.image)
+        fs.close()
+        self.fs = self.open_image()
+        self.assertEqual(fragmentation(self.fs)["fragmented_files"], 0)
+        self.check_files()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import random
+import unittest
+from array import array
+
+from bitarray import bitarray
+
+from file_system_components import FAT_END, FAT_FREE, SPACE_FREE, SPACE_OCCUPY
+from file_system_fsck import _fat_used, fsck
+from file_system_testing import VolumeTestCase
+
+
+class FsckTest(VolumeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fs = self.new_volume()
+        self.fs.apply_batch([("mkdir", "/", "d"),
+                             ("create", "/", "a"), ("write", "/a", b"a" * 80),
+                             ("create", "/d", "b"), ("write", "/d/b", b"b" * 80)])
+        self.a = self.fs.resolve("/a")
+        self.b = self.fs.resolve("/d/b")
+
+    def repair(self, **errors):
+        fs = self.fs
+        report = fsck(fs)
+        for key, value in errors.items():
+            self.assertEqual(report[key], value, report)
+        self.assertTrue(fsck(fs, repair=True)["repaired"])
+        self.assertConsistent(fs)
+        return report
+
+    def test_clean_volume(self):
+        report = fsck(self.fs)
+        self.assertEqual(report["files"], 2)
+        self.assertEqual(report["errors"], 0)
+        self.assertFalse(fsck(self.fs, repair=True)["repaired"])
+
+    # 两个文件的链从同一块开始 后走到的文件在该处截断 原来的链成为孤立块
+    def test_cross_linked(self):
+        fs = self.fs
+        self.b.start_address = self.a.start_address
+        self.repair(cross_linked=["/d/b"], orphan_blocks=5)
+        self.assertEqual(self.b.length, 0)
+        self.assertEqual(self.read(fs, "/a"), b"a" * 80)
+
+    # 指向其他文件链中间的指针按去重共用的链尾处理 只有引用计数不符
+    def test_shared_tail(self):
+        fs = self.fs
+        chain = fs.chain_of(self.a)
+        fs.fat.set(chain[1], fs.chain_of(self.b)[2])
+        self.repair(cross_linked=[], refs_mismatch=1, orphan_blocks=3)
+        self.assertEqual(self.read(fs, "/a"), b"a" * 32 + b"b" * 48)
+        self.assertEqual(self.read(fs, "/d/b"), b"b" * 80)
+
+    def test_cycle(self):
+        fs = self.fs
+        chain = fs.chain_of(self.b)
+        fs.fat.set(chain[3], chain[1])
+        self.repair(cycles=["/d/b"])
+        self.assertEqual(self.read(fs, "/d/b"), b"b" * 64)
+
+    def test_bad_pointer(self):
+        fs = self.fs
+        fs.fat.set(fs.chain_of(self.a)[0], fs.block_num + 5)
+        self.repair(bad_pointers=["/a"])
+        self.assertEqual(self.read(fs, "/a"), b"a" * 16)
+
+    def test_short_chain(self):
+        fs = self.fs
+        self.a.length = 200
+        self.repair(length_mismatch=["/a"])
+        self.assertEqual(self.a.length, 80)
+
+    def test_orphans_and_bitmap(self):
+        fs = self.fs
+        fs.fat.set(1000, FAT_END)
+        fs.fat.set(1001, 1000)
+        fs.free_space.bitmap[2000] = SPACE_OCCUPY
+        fs.free_space.bitmap[fs.chain_of(self.a)[0]] = SPACE_FREE
+        self.repair(orphan_blocks=2, bitmap_mismatch=2)
+        self.assertEqual(fs.fat.table[1000], FAT_FREE)
+        self.assertEqual(fs.allocator.free_num, fs.free_space.bitmap.count(SPACE_FREE))
+        self.assertEqual(self.read(fs, "/a"), b"a" * 80)
+
+    # 压缩文件只保留完整的帧
+    def test_compressed_keeps_whole_frames(self):
+        fs = self.fs
+        rng = random.Random(0)
+        data = bytes(rng.getrandbits(8) for _ in range(3 * 4096))
+        fs.write_and_close_file(data, self.a)
+        fs.set_compression(self.a, "zlib")
+        frames = self.a.frames
+        chain = fs.chain_of(self.a)
+        cut = (frames[0] + 15) // 16 + 2
+        fs.fat.set(chain[cut - 1], FAT_END)
+        self.repair(length_mismatch=["/a"])
+        self.assertEqual(self.a.frames, frames[:1])
+        self.assertEqual(self.read(fs, "/a"), data[:4096])
+
+    def test_check_on_open(self):
+        fs = self.fs
+        self.a.length = 200
+        fs.save(self.image)
+        fs = self.open_image(check=True)
+        self.assertEqual(fs.resolve("/a").length, 80)
+        self.assertConsistent(fs)
+
+
+class FatUsedTest(unittest.TestCase):
+    def test_matches_entries(self):
+        rng = random.Random(1)
+        values = [FAT_FREE, FAT_END, 0, 254, 65534, 2 ** 24 - 2, -3, -258, 2 ** 31 - 2]
+        table = array("i", (rng.choice(values) for _ in range(10000)))
+        self.assertEqual(_fat_used(table), bitarray([entry != FAT_FREE for entry in table]))
+        self.assertEqual(len(_fat_used(array("i"))), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
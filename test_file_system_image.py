@@ -0,0 +1,217 @@
+import random
+import unittest
+from unittest import mock
+
+import file_system_image
+
+from file_system_components import FCB
+from file_system_defrag import Defragmenter, fragmentation
+from file_system_image import ImageFile
+from file_system_testing import VolumeTestCase
+
+
+class LazyImageTest(VolumeTestCase):
+    DIR_NUM = 64
+
+    def setUp(self):
+        super().setUp()
+        fs = self.new_volume()
+        fs.apply_batch([("mkdir", "/", "d%d" % i) for i in range(self.DIR_NUM)]
+                       + [("create", "/d%d" % i, "f") for i in range(self.DIR_NUM)]
+                       + [("write", "/d%d/f" % i, b"a" * 16) for i in range(self.DIR_NUM)])
+        # 追加一块 每个文件都分成两段
+        fs.apply_batch([("pwrite", "/d%d/f" % i, 16, b"b" * 16) for i in range(self.DIR_NUM)])
+        fs.save(self.image)
+
+    def open_lazy(self):
+        fs = self.open_image(lazy=True)
+        fs.image.resident_num = 8
+        return fs
+
+    def read_all(self, fs):
+        for i in range(self.DIR_NUM):
+            fcb = fs.resolve("/d%d/f" % i)
+            if fcb is not None:
+                self.assertEqual(bytes(fs.open_and_read_bytes(fcb)), b"a" * 16 + b"b" * 16)
+
+    def test_evicted_handles_are_detached(self):
+        fs = self.open_lazy()
+        stale = fs.resolve("/d0/f")
+        self.read_all(fs)
+        self.assertIsNot(fs.resolve("/d0/f"), stale)
+        with self.assertRaises(FileNotFoundError):
+            fs.write_and_close_file(b"x", stale)
+
+    def test_defragment_lazy_volume(self):
+        fs = self.open_lazy()
+        self.assertEqual(fragmentation(fs)["fragmented_files"], self.DIR_NUM)
+        report = Defragmenter(fs).run()
+        self.assertEqual(report["moved"], self.DIR_NUM)
+        self.assertEqual(report["after"]["fragmented_files"], 0)
+        self.read_all(fs)
+        fs.save(self.image)
+        fs.close()
+        fs = self.open_lazy()
+        self.assertConsistent(fs)
+        self.read_all(fs)
+
+    def test_delete_loaded_dir(self):
+        fs = self.open_lazy()
+        fs.delete_dir(fs.resolve("/d0"))
+        self.read_all(fs)
+        self.assertIsNone(fs.resolve("/d0"))
+        self.assertConsistent(fs)
+        # 重命名不影响换出
+        fs.rename_dir(fs.resolve("/d1"), "e1")
+        self.read_all(fs)
+        self.assertIsInstance(fs.resolve("/e1/f"), FCB)
+        self.assertLessEqual(len(fs.image.resident), fs.image.resident_num + 1)
+
+
+class CrashBeforeCommitTest(VolumeTestCase):
+    OLD = bytes(range(100))
+
+    def setUp(self):
+        super().setUp()
+        fs = self.new_volume()
+        fs.apply_batch([("create", "/", "f"), ("write", "/f", self.OLD)])
+        fs.save(self.image)
+        fs.close()
+
+    # 修改后保存 在写超级块前"崩溃" 重新打开应仍是上一代的内容
+    def crash_after(self, modify):
+        fs = self.open_image()
+        modify(fs, fs.resolve("/f"))
+        with mock.patch.object(ImageFile, "_ImageFile__pack_super", side_effect=OSError("crash")):
+            with self.assertRaises(OSError):
+                fs.save(self.image)
+        fs.close()
+        fs = self.open_image()
+        self.assertEqual(self.read(fs, "/f"), self.OLD)
+        self.assertConsistent(fs)
+
+    def test_rewrite(self):
+        self.crash_after(lambda fs, fcb: fs.write_and_close_file(bytes(reversed(self.OLD)), fcb))
+
+    def test_pwrite(self):
+        self.crash_after(lambda fs, fcb: fs.pwrite(fcb, 20, b"x" * 30))
+
+    def test_truncate_and_extend(self):
+        self.crash_after(lambda fs, fcb: fs.truncate_file(fcb, 150))
+
+    def test_saved_content(self):
+        fs = self.open_image()
+        fcb = fs.resolve("/f")
+        fs.pwrite(fcb, 20, b"x" * 30)
+        fs.pwrite(fcb, 95, b"y" * 10)
+        expected = self.OLD[:20] + b"x" * 30 + self.OLD[50:95] + b"y" * 10
+        self.assertEqual(bytes(fs.open_and_read_bytes(fcb)), expected)
+        fs.save(self.image)
+        fs.close()
+        fs = self.open_image()
+        self.assertEqual(self.read(fs, "/f"), expected)
+        self.assertConsistent(fs)
+
+    # 空闲块不够时提前复用延迟释放的块 记一条警告 之后的保存仍然完整
+    def test_reuse_deferred_blocks_warns(self):
+        fs = self.new_volume(block_num=16)
+        fs.apply_batch([("create", "/", "f"), ("write", "/f", b"a" * 128)])
+        fs.save(self.image)
+        fs.close()
+        fs = self.open_image()
+        with self.assertLogs("file_system_components", "WARNING") as logs:
+            self.write(fs, "/f", b"b" * 160)
+        self.assertIn("not crash-safe", logs.output[0])
+        fs.save(self.image)
+        fs.close()
+        fs = self.open_image()
+        self.assertEqual(self.read(fs, "/f"), b"b" * 160)
+        self.assertConsistent(fs)
+
+
+class IncrementalTreeTest(VolumeTestCase):
+    def setUp(self):
+        super().setUp()
+        fs = self.new_volume()
+        fs.apply_batch([("mkdir", "/", "d%d" % i) for i in range(20)]
+                       + [("mkdir", "/d%d" % i, "e") for i in range(20)]
+                       + [("create", "/d%d/e" % i, "f") for i in range(20)]
+                       + [("write", "/d%d/e/f" % i, b"%d" % i) for i in range(20)])
+        fs.save(self.image)
+        fs.close()
+
+    def listing(self, fs):
+        result = []
+        stack = [("", fs.file_tree.root)]
+        while stack:
+            path, node = stack.pop()
+            result.append((path, node.modify_stamp))
+            for fcb in node.leaf_node_children:
+                result.append((path + "/" + fcb.file_name, fcb.modify_stamp, self.read(fs, path + "/" + fcb.file_name)))
+            stack.extend((path + "/" + child.dir_name, child) for child in node.tree_node_children)
+        return sorted(result)
+
+    def save_counting(self, fs):
+        with mock.patch.object(file_system_image, "_node_record", wraps=file_system_image._node_record) as record:
+            fs.save(self.image)
+        return record.call_count
+
+    # 只有修改过的文件夹及其到根的路径重新编码
+    def test_only_dirty_path_is_encoded(self):
+        fs = self.open_image()
+        self.assertEqual(self.save_counting(fs), 0)
+        self.write(fs, "/d3/e/f", b"changed")
+        self.assertEqual(self.save_counting(fs), 3)
+        fs.apply_batch([("mkdir", "/d5/e", "new"), ("create", "/d5/e/new", "g")])
+        self.assertEqual(self.save_counting(fs), 4)
+        expected = self.listing(fs)
+        fs.close()
+        fs = self.open_image()
+        self.assertEqual(self.listing(fs), expected)
+
+    def test_random_changes_survive_reopen(self):
+        rng = random.Random(5)
+        fs = self.open_image()
+        for _ in range(30):
+            i, j = rng.randrange(20), rng.randrange(20)
+            operation = rng.choice(["write", "mkdir", "rename", "rm", "rmdir"])
+            try:
+                if operation == "write":
+                    fs.apply_batch([("write", "/d%d/e/f" % i, b"x" * rng.randrange(100))])
+                elif operation == "mkdir":
+                    fs.apply_batch([("mkdir", "/d%d/e" % i, "n%d" % j), ("create", "/d%d/e/n%d" % (i, j), "g")])
+                elif operation == "rename":
+                    fs.rename_dir(fs.resolve("/d%d" % i), "d%d" % (i + 100))
+                    fs.rename_dir(fs.resolve("/d%d" % (i + 100)), "d%d" % i)
+                elif operation == "rm":
+                    fs.delete_file(fs.resolve("/d%d/e/f" % i))
+                else:
+                    fs.delete_dir(fs.resolve("/d%d/e" % i))
+            except (AttributeError, FileNotFoundError, FileExistsError):
+                continue
+            if rng.random() < 0.3:
+                fs.save(self.image)
+        fs.save(self.image)
+        expected = self.listing(fs)
+        fs.close()
+        fs = self.open_image()
+        self.assertEqual(self.listing(fs), expected)
+        self.assertConsistent(fs)
+
+    # 回滚直接恢复结点 之后的保存重新编码整棵树
+    def test_rollback_then_save(self):
+        fs = self.open_image()
+        fs.create_snapshot("s1")
+        fs.apply_batch([("write", "/d1/e/f", b"gone"), ("rmdir", "/d2")])
+        fs.save(self.image)
+        fs.rollback("s1")
+        expected = self.listing(fs)
+        fs.save(self.image)
+        fs.close()
+        fs = self.open_image()
+        self.assertEqual(self.listing(fs), expected)
+        self.assertEqual(self.read(fs, "/d1/e/f"), b"1")
+
+
+if __name__ == '__main__':
+    unittest.main()
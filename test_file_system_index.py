@@ -0,0 +1,77 @@
+import unittest
+from datetime import datetime, timedelta
+
+from file_system_testing import VolumeTestCase
+
+
+class MetadataIndexTest(VolumeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fs = self.new_volume()
+        self.fs.apply_batch([("mkdir", "/", "a"), ("mkdir", "/a", "b"),
+                             ("create", "/a", "x.txt"), ("write", "/a/x.txt", b"x" * 10),
+                             ("create", "/a/b", "y.txt"), ("write", "/a/b/y.txt", b"y" * 20),
+                             ("create", "/", "z.log"), ("write", "/z.log", b"z" * 30)])
+        self.index = self.fs.metadata_index()
+
+    def stats(self, path):
+        stats = self.fs.dir_stats(self.fs.resolve(path))
+        return stats["files"], stats["bytes"]
+
+    def names(self, **kwargs):
+        return sorted(fcb.file_name for fcb in self.fs.find_files(**kwargs))
+
+    # 增量维护的结果应与重新统计一致
+    def check(self):
+        root = self.fs.file_tree.root
+        expected = {path: self.stats(path) for path in ("/", "/a", "/a/b") if self.fs.resolve(path) is not None}
+        found = self.names()
+        self.index.rebuild()
+        self.assertEqual({path: self.stats(path) for path in expected}, expected)
+        self.assertEqual(self.names(), found)
+        self.assertEqual(len(self.index.keys), root.file_count)
+
+    def test_find(self):
+        self.assertEqual(self.names(name="y.txt"), ["y.txt"])
+        self.assertEqual(self.names(name="*.txt"), ["x.txt", "y.txt"])
+        self.assertEqual(self.names(name="*.txt", under=self.fs.resolve("/a/b")), ["y.txt"])
+        self.assertEqual(self.names(modified_after=datetime.now() + timedelta(days=1)), [])
+        self.assertEqual(self.names(modified_before=datetime.now() + timedelta(days=1)),
+                         ["x.txt", "y.txt", "z.log"])
+
+    def test_du_follows_changes(self):
+        fs = self.fs
+        self.assertEqual(self.stats("/"), (3, 60))
+        self.assertEqual(self.stats("/a"), (2, 30))
+        fs.apply_batch([("write", "/a/b/y.txt", b"y" * 5), ("create", "/a/b", "w"), ("rm", "/z.log")])
+        self.assertEqual(self.stats("/"), (3, 15))
+        self.assertEqual(self.stats("/a/b"), (2, 5))
+        fs.rename_file(fs.resolve("/a/x.txt"), "x.log", fs.resolve("/a"))
+        self.assertEqual(self.names(name="*.log"), ["x.log"])
+        fs.delete_dir(fs.resolve("/a/b"))
+        self.assertEqual(self.stats("/"), (1, 10))
+        self.check()
+
+    # 新文件夹的dir_added送达前 其中已新建了文件(另一线程) 不能重复计数
+    def test_late_dir_added(self):
+        fs = self.fs
+        root = fs.file_tree.root
+        fs.apply_batch([("mkdir", "/", "c"), ("create", "/c", "f"), ("write", "/c/f", b"f" * 7)])
+        self.index.on_changed("dir_added", root, fs.resolve("/c"))
+        self.assertEqual(self.stats("/"), (4, 67))
+        self.assertEqual(self.stats("/c"), (1, 7))
+        self.assertEqual(self.names(name="f"), ["f"])
+        self.assertEqual(len(self.index.fcbs), 4)
+        self.check()
+
+    def test_bulk_import(self):
+        fs = self.fs
+        fs.bulk_import(fs.resolve("/a"), [("n/f%d" % i, b"n" * i, None) for i in range(100)])
+        self.assertEqual(self.stats("/a/n"), (100, sum(range(100))))
+        self.assertEqual(self.stats("/"), (103, 60 + sum(range(100))))
+        self.assertEqual(len(self.names(name="f*")), 100)
+        self.check()
+
+
+if __name__ == '__main__':
+    unittest.main()